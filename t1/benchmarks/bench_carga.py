@@ -0,0 +1,433 @@
+import contextlib
+import datetime
+import importlib.util
+import itertools
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Adiciona o diretório src ao sys.path para importar 'common'
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.append(SRC_DIR)
+
+import pika
+
+from common import broker as broker_module
+from common.broker import Broker
+from common.catalog import generate_leiloes, write_catalog
+from common.memory import MemoryServer
+from common.metrics import REGISTRY, trace_headers
+from common.serial import (
+    ChavePublica,
+    Lance,
+    decode_event,
+    encode_event,
+    encode_signed,
+)
+from common.shards import partition_routing_key
+from common.signing import (
+    generate_private_key,
+    make_signer,
+    public_key_der,
+    user_id_of,
+)
+
+# Teste de carga de ponta a ponta: MS-Leilao, MS-Lance, MS-Notificacao e usuários
+# simulados que dão lances em todos os leilões ativos.
+#
+# Uso: python benchmarks/bench_carga.py [modo] [usuarios] [leiloes] [duracao_s] [lances_s] [json]
+# - modo "memoria": tudo em um só processo, com o broker em memória (common/memory.py)
+#   no lugar do RabbitMQ. Cada serviço roda em uma thread, e a CPU de cada um é a da
+#   sua thread principal (as threads de verificação do MS-Lance entram só no total).
+# - modo "processos": cada serviço em um processo, com o RabbitMQ configurado no
+#   ambiente (RABBITMQ_*). A CPU de cada serviço vem do processo (os.wait4).
+# - json: imprime o resultado como uma linha JSON, para comparar execuções no CI.
+#
+# Os lances são publicados a uma taxa fixa (lances_s no total), com valores sempre
+# crescentes, então todos devem ser validados. A latência vai da publicação do lance
+# até a chegada da notificação (lance_validado ou lance_agregado) na fila do usuário.
+# No modo memória também são mostrados os estágios medidos pelos serviços
+# (common/metrics.py).
+
+MODE = sys.argv[1] if len(sys.argv) > 1 else "memoria"
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+LEILOES = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+DURATION_S = float(sys.argv[4]) if len(sys.argv) > 4 else 10.0
+BID_RATE = float(sys.argv[5]) if len(sys.argv) > 5 else 2000.0
+JSON_OUTPUT = len(sys.argv) > 6 and sys.argv[6] == "json"
+
+# Tempo até o início dos leilões (os serviços precisam estar de pé)
+START_DELAY_S = {"memoria": 1.0, "processos": 5.0}
+# Tempo extra, depois do fim dos leilões, para as últimas notificações chegarem
+DRAIN_TIMEOUT_S = 10.0
+# Máximo de lances enviados de uma vez quando os usuários se atrasam
+MAX_BURST = 256
+
+EXCHANGE_NAME = "exchange"
+SERVICES = ("leilao", "lance", "notificacao")
+
+
+class NullWriter:
+    # Descarta os prints dos serviços, que não fazem parte da medida
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class Bidders:
+    # Usuários simulados em uma só conexão: recebem os inícios dos leilões, dão lances
+    # neles a uma taxa fixa e medem a latência das notificações
+    def __init__(self, broker: Broker, users: int, leiloes: int, rate: float):
+        self.broker = broker
+        self.leiloes = leiloes
+        self.interval = 1.0 / rate
+
+        # (ID do usuário, chave pública em DER, chave privada)
+        self.users = []
+        for _ in range(users):
+            private_key = generate_private_key("ed25519")
+            public_key = public_key_der(private_key)
+            self.users.append((user_id_of(public_key), public_key, private_key))
+
+        self.active: dict[str, float] = {}
+        self.sent: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self.sent_count = 0
+        self.aggregated = 0
+        self.finished = 0
+        self.first_bid = None
+        self.last_notification = None
+
+        self._values = itertools.count(1)
+        self._turn = itertools.count()
+        self._signers = [(user_id, make_signer(key)) for user_id, _, key in self.users]
+        self._public_keys = {user_id: key for user_id, key, _ in self.users}
+        self._next_send = None
+        self._queue = broker.declare_queue(
+            "",
+            routing_keys=("leilao_iniciado",)
+            + tuple(f"chave_solicitada.{user_id}" for user_id in self._public_keys),
+            exclusive=True,
+        )
+
+        broker.consume(self._queue, self.on_message, auto_ack=True)
+        broker.on_connect(self.register_keys)
+
+    def register_key(self, user_id: str) -> None:
+        message, content_type = encode_event(
+            ChavePublica(user_id, self._public_keys[user_id])
+        )
+        self.broker.publish(
+            "chave_registrada", message, pika.BasicProperties(content_type=content_type)
+        )
+
+    def register_keys(self) -> None:
+        # As chaves são registradas no MS-Lance pelo broker a cada conexão
+        for user_id in self._public_keys:
+            self.register_key(user_id)
+
+    def bid(self, leilao_id: str) -> None:
+        turn = next(self._turn)
+        user_id, sign = self._signers[turn % len(self._signers)]
+        value = str(next(self._values))
+
+        payload, content_type = encode_event(Lance(user_id, leilao_id, value))
+        message = encode_signed(payload, sign(payload), content_type)
+
+        self.sent[value] = time.perf_counter()
+        self.sent_count += 1
+        self.broker.publish(
+            partition_routing_key("lance_realizado", leilao_id),
+            message,
+            pika.BasicProperties(content_type=content_type, headers=trace_headers()),
+        )
+
+    def step(self) -> float | None:
+        now = time.perf_counter()
+        wall = time.time()
+
+        # Leilões encerrados não recebem mais lances
+        for leilao_id, end in list(self.active.items()):
+            if end <= wall:
+                del self.active[leilao_id]
+
+        if not self.active:
+            self._next_send = None
+            return None
+
+        if self._next_send is None:
+            self._next_send = now
+            if self.first_bid is None:
+                self.first_bid = now
+
+        ids = list(self.active)
+        burst = 0
+
+        while self._next_send <= now and burst < MAX_BURST:
+            self.bid(ids[self.sent_count % len(ids)])
+            self._next_send += self.interval
+            burst += 1
+
+        # Atrasado demais: a taxa oferecida cai, em vez de acumular lances
+        if self._next_send < now:
+            self._next_send = now
+
+        return max(0.0, self._next_send - time.perf_counter())
+
+    def on_message(self, method, properties, body):
+        if method.routing_key.startswith("chave_solicitada."):
+            self.register_key(method.routing_key.split(".", 1)[1])
+            return
+
+        if method.routing_key == "leilao_iniciado":
+            leilao = decode_event("leilao", body, properties.content_type)
+            self.broker.bind(self._queue, f"leilao_{leilao.id}")
+            self.active[leilao.id] = leilao.end.timestamp()
+            return
+
+        kind = properties.type
+        message = decode_event(kind, body, properties.content_type)
+
+        if kind in ("lance_validado", "lance_agregado"):
+            sent = self.sent.pop(message.value, None)
+            now = time.perf_counter()
+
+            if sent is not None:
+                self.latencies.append(now - sent)
+                self.last_notification = now
+
+            if kind == "lance_agregado":
+                self.aggregated += message.count - 1
+        elif kind == "leilao_vencedor":
+            self.finished += 1
+
+            if self.finished >= self.leiloes:
+                self.broker.stop()
+
+
+def load_service(name: str):
+    # Carrega src/services/<nome>.py como módulo, sem executar o main
+    path = os.path.join(SRC_DIR, "services", f"{name}.py")
+    spec = importlib.util.spec_from_file_location(f"ms_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+
+    argv = sys.argv
+    sys.argv = [path]
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+
+    return module
+
+
+def write_leiloes(path: str, start: datetime.datetime) -> None:
+    with open(path, "wb") as f:
+        write_catalog(f, generate_leiloes(LEILOES, start, 0.0, DURATION_S, seed=0))
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_memory(directory: str) -> tuple[Bidders, dict[str, float], dict[str, int]]:
+    server = MemoryServer()
+    broker_module.CONNECTION_FACTORY = server.connect
+
+    modules = {name: load_service(name) for name in SERVICES}
+
+    # Sem fork dentro de um processo com threads; o GIL é dividido com os serviços
+    modules["lance"].VERIFY_MODE = "thread"
+    modules["leilao"].CATALOG_PATH = os.path.join(directory, "catalogo.bin")
+
+    bidders = Bidders(Broker(exchange=EXCHANGE_NAME), USERS, LEILOES, BID_RATE)
+
+    cpu: dict[str, float] = {}
+
+    def run_service(name: str) -> None:
+        start = time.thread_time()
+        try:
+            modules[name].main()
+        finally:
+            cpu[name] = time.thread_time() - start
+
+    threads = [
+        threading.Thread(target=run_service, args=(name,), daemon=True)
+        for name in ("lance", "notificacao", "leilao")
+    ]
+
+    start = datetime.datetime.now() + datetime.timedelta(seconds=START_DELAY_S[MODE])
+    write_leiloes(modules["leilao"].CATALOG_PATH, start)
+
+    process_start = time.process_time()
+    bidders_start = time.thread_time()
+
+    for thread in threads:
+        thread.start()
+
+    run_bidders(bidders)
+
+    cpu["usuarios"] = time.thread_time() - bidders_start
+    server.stop()
+
+    for thread in threads:
+        thread.join(timeout=DRAIN_TIMEOUT_S)
+
+    cpu["total"] = time.process_time() - process_start
+
+    return bidders, cpu, server.stats()
+
+
+def run_processes(
+    directory: str,
+) -> tuple[Bidders, dict[str, float], dict[str, int]]:
+    bidders = Bidders(Broker(exchange=EXCHANGE_NAME), USERS, LEILOES, BID_RATE)
+
+    catalog = os.path.join(directory, "catalogo.bin")
+    start = datetime.datetime.now() + datetime.timedelta(seconds=START_DELAY_S[MODE])
+    write_leiloes(catalog, start)
+
+    arguments = {"leilao": [catalog], "lance": ["bench"], "notificacao": []}
+    processes = {
+        name: subprocess.Popen(
+            [sys.executable, os.path.join(SRC_DIR, "services", f"{name}.py")]
+            + arguments[name],
+            cwd=directory,
+            stdout=subprocess.DEVNULL,
+        )
+        for name in ("lance", "notificacao", "leilao")
+    }
+
+    bidders_start = time.process_time()
+    run_bidders(bidders)
+
+    cpu = {"usuarios": time.process_time() - bidders_start}
+
+    for name, process in processes.items():
+        process.send_signal(signal.SIGINT)
+
+    for name, process in processes.items():
+        _, _, usage = os.wait4(process.pid, 0)
+        cpu[name] = usage.ru_utime + usage.ru_stime
+
+    cpu["total"] = sum(cpu.values())
+
+    return bidders, cpu, {}
+
+
+def run_bidders(bidders: Bidders) -> None:
+    # Roda até o último leilao_vencedor chegar ou o tempo acabar
+    deadline = time.monotonic() + START_DELAY_S[MODE] + DURATION_S + DRAIN_TIMEOUT_S
+
+    def step() -> float | None:
+        if time.monotonic() >= deadline:
+            bidders.broker.stop()
+            return 0
+
+        time_limit = bidders.step()
+        remaining = deadline - time.monotonic()
+
+        return remaining if time_limit is None else min(time_limit, remaining)
+
+    bidders.broker.run(step)
+    bidders.broker.close()
+
+
+def report(bidders: Bidders, cpu: dict[str, float], broker: dict[str, int]) -> dict:
+    latencies = sorted(bidders.latencies)
+    elapsed = (
+        bidders.last_notification - bidders.first_bid
+        if bidders.first_bid is not None and bidders.last_notification is not None
+        else 0.0
+    )
+
+    return {
+        "modo": MODE,
+        "usuarios": USERS,
+        "leiloes": LEILOES,
+        "lances_enviados": bidders.sent_count,
+        "lances_notificados": len(latencies),
+        "lances_agregados": bidders.aggregated,
+        "leiloes_finalizados": bidders.finished,
+        "lances_s": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latencia_ms": {
+            f"p{p}": percentile(latencies, p) * 1000 for p in (50, 90, 99, 99.9)
+        }
+        | {"max": latencies[-1] * 1000 if latencies else float("nan")},
+        "cpu_s": cpu,
+        # Broker em memória: acks/nacks de tags desconhecidas ou já resolvidas, que
+        # no RabbitMQ fechariam o canal
+        "broker": broker,
+        # No modo memória os serviços dividem o registro de métricas do processo
+        "estagios": REGISTRY.snapshot()["histograms"] if MODE == "memoria" else {},
+    }
+
+
+def main():
+    assert MODE in START_DELAY_S, f"Unknown mode '{MODE}'."
+
+    directory = tempfile.mkdtemp(prefix="bench_carga_")
+    cwd = os.getcwd()
+
+    # Os serviços usam ./chaves e ./wal
+    os.chdir(directory)
+    try:
+        with contextlib.redirect_stdout(NullWriter()):
+            if MODE == "memoria":
+                bidders, cpu, broker = run_memory(directory)
+            else:
+                bidders, cpu, broker = run_processes(directory)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result = report(bidders, cpu, broker)
+
+    if JSON_OUTPUT:
+        print(json.dumps(result))
+        return 1
+
+    print(
+        f"{result['modo']}: {USERS} usuários, {LEILOES} leilões de {DURATION_S:.0f}s, {BID_RATE:.0f} lances/s oferecidos"
+    )
+    print(
+        f"lances: {result['lances_enviados']} enviados, {result['lances_notificados']} notificados, {result['lances_agregados']} agregados"
+    )
+    print(
+        f"leilões finalizados: {result['leiloes_finalizados']}/{LEILOES}, vazão: {result['lances_s']:.1f} lances/s"
+    )
+    print(
+        "latência (ms): "
+        + ", ".join(f"{name} {value:.2f}" for name, value in result["latencia_ms"].items())
+    )
+    print(
+        "CPU (s): " + ", ".join(f"{name} {value:.2f}" for name, value in cpu.items())
+    )
+
+    if broker:
+        print(
+            f"broker: {broker['published']} publicadas, {broker['delivered']} entregues, {broker['unknown_tags']} acks de tags desconhecidas"
+        )
+
+    for name, stats in result["estagios"].items():
+        print(
+            f"{name}: n {stats['count']}, p50 {stats['p50_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms"
+        )
+
+    return 1
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import datetime
+import os
+import sys
+import timeit
+import uuid
+
+# Adiciona o diretório src ao sys.path para importar 'common'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from common.serial import (
+    Lance,
+    LanceValidado,
+    Leilao,
+    LeilaoVencedor,
+    Record,
+    decode_event,
+    decode_signed,
+    encode_event,
+    encode_signed,
+)
+
+# Compara o formato JSON com o formato binário de common/serial.py:
+# tempo de codificação/decodificação por evento e tamanho da mensagem.
+#
+# Uso: python benchmarks/bench_serial.py [repetições]
+
+REPETITIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+
+def sample_events() -> dict[str, Record]:
+    now = datetime.datetime.now()
+
+    return {
+        "leilao": Leilao(
+            uuid.uuid4().hex,
+            "Cadeira de madeira antiga em bom estado.",
+            now,
+            now + datetime.timedelta(seconds=20),
+        ),
+        "lance": Lance(uuid.uuid4().hex, uuid.uuid4().hex, "1500"),
+        "lance_validado": LanceValidado(uuid.uuid4().hex, uuid.uuid4().hex, "1500"),
+        "leilao_vencedor": LeilaoVencedor(uuid.uuid4().hex, "1500", uuid.uuid4().hex),
+    }
+
+
+def measure(kind: str, event: Record, binary: bool) -> tuple[float, float, int]:
+    body, content_type = encode_event(event, binary=binary)
+
+    encode_s = timeit.timeit(
+        lambda: encode_event(event, binary=binary), number=REPETITIONS
+    )
+    decode_s = timeit.timeit(
+        lambda: decode_event(kind, body, content_type), number=REPETITIONS
+    )
+
+    return (
+        encode_s / REPETITIONS * 1e6,
+        decode_s / REPETITIONS * 1e6,
+        len(body),
+    )
+
+
+def measure_signed(event: Lance, binary: bool) -> tuple[float, float, int]:
+    # Envelope completo de um lance: codifica o payload e o envelope, e na leitura
+    # abre o envelope e decodifica o payload
+    signature = os.urandom(256)
+
+    def encode():
+        payload, content_type = encode_event(event, binary=binary)
+        return encode_signed(payload, signature, content_type), content_type
+
+    def decode():
+        payload, _ = decode_signed(body, content_type)
+        return decode_event("lance", payload, content_type)
+
+    body, content_type = encode()
+
+    encode_s = timeit.timeit(encode, number=REPETITIONS)
+    decode_s = timeit.timeit(decode, number=REPETITIONS)
+
+    return (
+        encode_s / REPETITIONS * 1e6,
+        decode_s / REPETITIONS * 1e6,
+        len(body),
+    )
+
+
+def main():
+    print(f"{REPETITIONS} repetições por medida")
+    print(
+        f"{'evento':<16} {'formato':<8} {'encode (us)':>12} {'decode (us)':>12} {'bytes':>6}"
+    )
+
+    events = sample_events()
+
+    for kind in list(events) + ["lance_assinado"]:
+        for binary in (False, True):
+            if kind == "lance_assinado":
+                encode_us, decode_us, size = measure_signed(events["lance"], binary)
+            else:
+                encode_us, decode_us, size = measure(kind, events[kind], binary)
+
+            name = "binario" if binary else "json"
+
+            print(
+                f"{kind:<16} {name:<8} {encode_us:>12.2f} {decode_us:>12.2f} {size:>6}"
+            )
+
+    return 1
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+# Adiciona o diretório src ao sys.path para importar 'common'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from common.signing import (
+    SIGNATURE_ALGORITHMS,
+    generate_private_key,
+    make_signer,
+    make_verifier,
+)
+
+# Compara os algoritmos de assinatura dos lances: gerações de chave, assinaturas e
+# verificações por segundo. O verificador é criado uma vez por chave, como no cache
+# de chaves do MS-Lance.
+#
+# Uso: python benchmarks/bench_signing.py [duração de cada medida em segundos]
+
+DURATION_S = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+
+# Tamanho aproximado de um lance no formato binário
+PAYLOAD = os.urandom(40)
+
+
+def rate(fn) -> float:
+    count = 0
+    start = time.perf_counter()
+    deadline = start + DURATION_S
+
+    while True:
+        fn()
+        count += 1
+
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+
+def main():
+    print(f"{'algoritmo':<10} {'chaves/s':>10} {'assinaturas/s':>14} {'verificações/s':>15}")
+
+    for algorithm in SIGNATURE_ALGORITHMS:
+        private_key = generate_private_key(algorithm)
+        sign = make_signer(private_key)
+        verify = make_verifier(private_key.public_key())
+        signature = sign(PAYLOAD)
+
+        assert verify(signature, PAYLOAD), "Signature does not verify."
+
+        keygen = rate(lambda: generate_private_key(algorithm))
+        signing = rate(lambda: sign(PAYLOAD))
+        verification = rate(lambda: verify(signature, PAYLOAD))
+
+        print(f"{algorithm:<10} {keygen:>10.1f} {signing:>14.1f} {verification:>15.1f}")
+
+    return 1
+
+
+if __name__ == "__main__":
+    main()
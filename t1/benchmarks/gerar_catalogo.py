@@ -0,0 +1,82 @@
+import datetime
+import io
+import itertools
+import os
+import sys
+import time
+
+# Adiciona o diretório src ao sys.path para importar 'common'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from common.catalog import generate_leiloes, write_catalog
+
+# Gera um catálogo sintético de leilões para testes de carga do MS-Leilao.
+#
+# Uso: python benchmarks/gerar_catalogo.py <quantidade> <arquivo> [janela_s] [jsonl]
+# - janela_s: intervalo em que os inícios são distribuídos, a partir de agora + 10s
+# - jsonl: grava em JSONL em vez do formato binário
+#
+# Com "-" no lugar do arquivo, os leilões são publicados em lotes na fila
+# leilao_cadastro do MS-Leilao em execução.
+
+START_DELAY_S = 10
+DURATION_S = 20
+PUBLISH_BATCH = 10_000
+EXCHANGE_NAME = "exchange"
+
+
+def publish(leiloes, binary: bool) -> int:
+    import pika
+
+    from common.broker import connection_parameters
+
+    connection = pika.BlockingConnection(connection_parameters())
+    channel = connection.channel()
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="direct")
+
+    count = 0
+
+    while True:
+        batch = io.BytesIO()
+        written = write_catalog(
+            batch, itertools.islice(leiloes, PUBLISH_BATCH), binary=binary
+        )
+
+        if written == 0:
+            break
+
+        channel.basic_publish(
+            exchange=EXCHANGE_NAME, routing_key="leilao_cadastro", body=batch.getvalue()
+        )
+        count += written
+
+    connection.close()
+
+    return count
+
+
+def main():
+    count = int(sys.argv[1])
+    path = sys.argv[2]
+    spread_s = float(sys.argv[3]) if len(sys.argv) > 3 else 3600.0
+    binary = not (len(sys.argv) > 4 and sys.argv[4] == "jsonl")
+
+    first_start = datetime.datetime.now() + datetime.timedelta(seconds=START_DELAY_S)
+    leiloes = generate_leiloes(count, first_start, spread_s, DURATION_S)
+
+    start = time.perf_counter()
+
+    if path == "-":
+        written = publish(leiloes, binary)
+    else:
+        with open(path, "wb") as f:
+            written = write_catalog(f, leiloes, binary=binary)
+
+    elapsed = time.perf_counter() - start
+    print(f"{written} leilões gerados em {elapsed:.2f}s.")
+
+    return 1
+
+
+if __name__ == "__main__":
+    main()
@@ -1,191 +1,509 @@
 import pika
-import json
-import base64
-import datetime
 import functools
-import uuid
+import heapq
+import itertools
+import random
+import struct
+import threading
 import os
 import sys
+import time
+import uuid
 
-from pika.adapters.blocking_connection import BlockingChannel
-from simple_term_menu import TerminalMenu
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
+from queue import SimpleQueue
+from typing import Callable
 
 # Adiciona o diretório raiz do projeto ao sys.path para importar 'common'
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from common.serial import deserialize_leilao, deserialize_dict, serialize_dict
+from common.bidding import POLICIES, BiddingPolicy, make_policy
+from common.broker import Broker, DeclaredQueue
+from common.metrics import (
+    HEADER_TRACE_ID,
+    REGISTRY,
+    trace_age,
+    trace_headers,
+    trace_of,
+)
+from common.serial import (
+    ChavePublica,
+    Lance,
+    Record,
+    decode_event,
+    decode_typed_event,
+    encode_event,
+    encode_signed,
+)
+from common.shards import partition_routing_key
+from common.signing import (
+    generate_private_key,
+    load_private_key_pem,
+    make_signer,
+    private_key_pem,
+    public_key_der,
+    user_id_of,
+)
 
 # Variáveis globais
 EXCHANGE_NAME = "exchange"
 ID_SUMMARY_LENGTH = 8
+# Usa o formato binário de common/serial.py (False para JSON)
+WIRE_BINARY = True
+# Algoritmo de assinatura dos lances: "ed25519" ou "rsa"
+SIGNATURE_ALGORITHM = "ed25519"
+# Chaves privadas dos usuários (<perfil>.pem), reutilizadas entre execuções. O ID do
+# usuário é a impressão digital da chave pública (common/signing.py).
+IDENTITY_DIRECTORY = "./identidades"
+
+# Métricas (common/metrics.py): assinatura dos lances e tempo entre o envio de um
+# lance e a chegada da sua notificação
+SIGN_TIME = REGISTRY.histogram("cliente_assinatura_seconds")
+DELIVERY_TIME = REGISTRY.histogram("cliente_entrega_seconds")
+
+# Modo simulado (python src/client.py simulado <usuarios> <estrategia> <preco_maximo>):
+# usuários sem terminal, cada um com uma estratégia de lances (common/bidding.py).
+# O preço máximo de cada usuário é sorteado entre a metade e o valor informado.
+SIMULATED_INCREMENT = 1
+SIMULATED_REACTION_S = 0.2
+SIMULATED_SNIPER_LEAD_S = 1.0
+
+
+def send_lance(
+    user_id: str,
+    leilao_id: str,
+    value: str,
+    broker: Broker,
+    sign: Callable[[bytes], bytes],
+) -> str:
+    # Publica um lance e retorna o seu trace id
 
-
-def publisher(
-    user_id: str, leilao: dict, channel: BlockingChannel, private_key: rsa.RSAPrivateKey
-):
-    value = input("[Cliente] Digite o valor do lance: ")
-    message = serialize_dict(
-        {"user_id": user_id, "leilao_id": leilao["id"], "value": value}
-    )
-
-    print(
-        f"[Cliente] Você deu um lance de {value} no leilão {leilao['id'][:ID_SUMMARY_LENGTH]}"
+    # Requisito 2.3 - Cada lance contém: ID do leilão, ID do usuário, valor do lance.
+    payload, content_type = encode_event(
+        Lance(user_id, leilao_id, value), binary=WIRE_BINARY
     )
 
     # Requisito 2.3 - O cliente assina digitalmente cada lance com sua chave privada.
-    signature = private_key.sign(
+    start = time.perf_counter()
+    signature = sign(payload)
+    SIGN_TIME.record_since(start)
+
+    # O envelope leva exatamente os bytes assinados, sem serializar o lance de novo
+    message = encode_signed(payload, signature, content_type)
+
+    # Requisito 2.3 - Publica lances na fila de mensagens lance_realizado.
+    # O lance vai para a partição do leilão, atendida por uma única instância do MS-Lance.
+    # O trace id segue o lance até a notificação
+    headers = trace_headers()
+    broker.publish(
+        partition_routing_key("lance_realizado", leilao_id),
         message,
-        padding.PSS(
-            mgf=padding.MGF1(hashes.SHA256()),
-            salt_length=padding.PSS.MAX_LENGTH,
-        ),
-        hashes.SHA256(),
+        pika.BasicProperties(content_type=content_type, headers=headers),
     )
-    encoded_signature = base64.b64encode(signature).decode("utf-8")
 
-    # Requisito 2.3 - Cada lance contém: ID do leilão, ID do usuário, valor do lance.
-    message = deserialize_dict(message)
-    message["signature"] = encoded_signature
-    message = serialize_dict(message)
+    return headers[HEADER_TRACE_ID]
 
-    # Requisito 2.3 - Publica lances na fila de mensagens lance_realizado.
+
+def register_key(user_id: str, public_key: bytes, broker: Broker) -> None:
+    # Registra a chave pública no MS-Lance. É repetido a cada conexão e quando o
+    # MS-Lance pede a chave ("chave_solicitada.<usuário>")
+    message, content_type = encode_event(
+        ChavePublica(user_id, public_key), binary=WIRE_BINARY
+    )
+    broker.publish(
+        "chave_registrada", message, pika.BasicProperties(content_type=content_type)
+    )
+
+
+def publisher(
+    user_id: str,
+    leilao_id: str,
+    broker: Broker,
+    sign: Callable[[bytes], bytes],
+    value: str,
+):
     print(
-        f"[Log] Foi enviado uma mensagem para \"lance_realizado\" para o leilão {leilao['id'][:ID_SUMMARY_LENGTH]}"
+        f"[Cliente] Você deu um lance de {value} no leilão {leilao_id[:ID_SUMMARY_LENGTH]}"
     )
-    channel.basic_publish(
-        exchange=EXCHANGE_NAME, routing_key="lance_realizado", body=message
+
+    trace_id = send_lance(user_id, leilao_id, value, broker, sign)
+
+    print(
+        f'[Log] Foi enviado uma mensagem para "lance_realizado" para o leilão {leilao_id[:ID_SUMMARY_LENGTH]} (trace {trace_id})'
     )
 
     return 1
 
 
-def consumer(channel, queue_name, connection, user_id, private_key: rsa.RSAPrivateKey):
-    def on_message(ch, method, properties, body):
-        if method.routing_key == "leilao_iniciado":
-            leilao = deserialize_leilao(body)
+def decode_notification(properties: pika.BasicProperties, body: bytes) -> Record:
+    # O tipo vem na propriedade `type` da mensagem; notificações sem ela trazem o
+    # tipo no próprio corpo
+    if properties.type is not None:
+        return decode_event(properties.type, body, properties.content_type)
 
-            answer = input(
-                f"[Cliente] O leilao {leilao['id'][:ID_SUMMARY_LENGTH]} foi iniciado! Deseja realizar um lance?"
-            )
+    return decode_typed_event(body, properties.content_type)
 
-            if answer.lower() in ["s", "sim", "y", "yes"]:
-                publisher(user_id, leilao, channel, private_key)
 
-                # Requisito 2.4 - Ao dar um lance em um leilão, o cliente atuará como consumidor desse leilão
-                channel.queue_bind(
-                    exchange=EXCHANGE_NAME,
-                    queue=queue_name,
-                    routing_key=f"leilao_{leilao['id']}",
+def consumer(
+    broker: Broker,
+    queue: DeclaredQueue,
+    user_id,
+    public_key: bytes,
+    sign: Callable[[bytes], bytes],
+):
+    # As perguntas ao usuário são feitas em outra thread: um input() na thread da
+    # conexão pararia as entregas e os heartbeats, e o broker derrubaria a conexão
+    prompts: SimpleQueue = SimpleQueue()
+
+    def place_bid(leilao_id: str, value: str):
+        # Na thread da conexão
+        publisher(user_id, leilao_id, broker, sign, value)
+
+        # Requisito 2.4 - Ao dar um lance em um leilão, o cliente atuará como consumidor desse leilão
+        broker.bind(queue, f"leilao_{leilao_id}")
+
+    def prompt_loop():
+        while True:
+            leilao_id, question = prompts.get()
+            answer = input(question)
+
+            if answer.lower() in ["s", "sim", "y", "yes"]:
+                value = input("[Cliente] Digite o valor do lance: ")
+                broker.call_threadsafe(functools.partial(place_bid, leilao_id, value))
+
+    threading.Thread(target=prompt_loop, daemon=True).start()
+
+    def on_message(method, properties, body):
+        if method.routing_key.startswith("chave_solicitada."):
+            register_key(user_id, public_key, broker)
+        elif method.routing_key == "leilao_iniciado":
+            try:
+                leilao = decode_event("leilao", body, properties.content_type)
+            except (ValueError, struct.error) as e:
+                print(f"[Warning] Leilão inválido: {e}")
+                broker.done(method.delivery_tag, broker.generation)
+                return
+
+            prompts.put(
+                (
+                    leilao.id,
+                    f"[Cliente] O leilao {leilao.id[:ID_SUMMARY_LENGTH]} foi iniciado! Deseja realizar um lance?",
                 )
+            )
         elif method.routing_key.startswith("leilao_"):
-            message = deserialize_dict(body)
-            assert "type" in message, "Key 'type' does not exist in the dictionary."
+            try:
+                message = decode_notification(properties, body)
+            except (ValueError, struct.error) as e:
+                print(f"[Warning] Notificação inválida: {e}")
+                broker.done(method.delivery_tag, broker.generation)
+                return
+
+            type = message.KIND
+
+            if type in ("lance_validado", "lance_agregado"):
+                # Lances agregados pelo MS-Notificacao chegam como um só, o maior deles
+                count = message.count if type == "lance_agregado" else 1
+
+                if count > 1:
+                    print(
+                        f"[Log] {count} lances validados no leilão {message.leilao_id[:ID_SUMMARY_LENGTH]}, o maior foi:"
+                    )
 
-            type = message["type"]
+                if message.user_id == user_id:
+                    log = f"[Log] Seu lance de {message.value} no leilão {message.leilao_id[:ID_SUMMARY_LENGTH]} foi validado."
+                else:
+                    log = f"[Log] O usuário {message.user_id[:ID_SUMMARY_LENGTH]} deu um lance de {message.value} no leilão {message.leilao_id[:ID_SUMMARY_LENGTH]} que foi validado."
 
-            if type == "lance_validado":
-                assert message["user_id"]
-                assert message["leilao_id"]
-                assert message["value"]
+                # Tempo desde o envio do lance, pelos relógios das máquinas
+                trace = trace_of(properties.headers)
+                age = trace_age(trace)
 
-                if message["user_id"] == user_id:
-                    log = f"[Log] Seu lance de {message['value']} no leilão {message['leilao_id'][:ID_SUMMARY_LENGTH]} foi validado."
-                else:
-                    log = f"[Log] O usuário {message['user_id'][:ID_SUMMARY_LENGTH]} deu um lance de {message['value']} no leilão {message['leilao_id'][:ID_SUMMARY_LENGTH]} que foi validado."
+                if age is not None:
+                    DELIVERY_TIME.record(age)
+                    log += f" (trace {trace.get(HEADER_TRACE_ID)}, {age * 1000:.1f} ms)"
 
                 print(log)
 
-                if message["user_id"] != user_id:
-                    answer = input(
-                        f"[Cliente] Deseja dar um lance maior que {message['value']} no leilão {message['leilao_id'][:ID_SUMMARY_LENGTH]}? "
+                if message.user_id != user_id:
+                    prompts.put(
+                        (
+                            message.leilao_id,
+                            f"[Cliente] Deseja dar um lance maior que {message.value} no leilão {message.leilao_id[:ID_SUMMARY_LENGTH]}? ",
+                        )
                     )
-
-                    if answer.lower() in ["s", "sim", "y", "yes"]:
-                        leilao = {"id": message["leilao_id"]}
-                        publisher(user_id, leilao, channel, private_key)
             elif type == "leilao_vencedor":
-                assert message["leilao_id"]
-                assert message["lance_vencedor"]
-                assert message["cliente_vencedor"]
-
-                if message["cliente_vencedor"] == user_id:
-                    log = f"[Log] Parabéns! Você venceu o leilão {message['leilao_id'][:ID_SUMMARY_LENGTH]} com um lance de {message['lance_vencedor']}."
+                if message.cliente_vencedor == user_id:
+                    log = f"[Log] Parabéns! Você venceu o leilão {message.leilao_id[:ID_SUMMARY_LENGTH]} com um lance de {message.lance_vencedor}."
                 else:
-                    log = f"[Log] Leilão {message['leilao_id'][:ID_SUMMARY_LENGTH]} finalizado. O vencedor foi o usuário {message['cliente_vencedor'][:ID_SUMMARY_LENGTH]} com um lance de {message['lance_vencedor']}."
+                    log = f"[Log] Leilão {message.leilao_id[:ID_SUMMARY_LENGTH]} finalizado. O vencedor foi o usuário {message.cliente_vencedor[:ID_SUMMARY_LENGTH]} com um lance de {message.lance_vencedor}."
 
                 print(log)
             else:
                 print(f"[Warning] Tipo de mensagem desconhecido: {type}")
 
-        cb = functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag)
-        connection.add_callback_threadsafe(cb)
+        broker.done(method.delivery_tag, broker.generation)
 
-    channel.basic_consume(
-        queue=queue_name, on_message_callback=on_message, auto_ack=False
-    )
+    broker.consume(queue, on_message)
 
     print(" [Client] Waiting for messages. To exit press CTRL+C")
-    channel.start_consuming()
+    broker.run()
 
 
-def main():
-    user_id = random_id = str(uuid.uuid4().hex)
-    print(f"[Client] Seu ID de usuário é {user_id[:ID_SUMMARY_LENGTH]}")
+def load_identity(profile: str) -> tuple[str, bytes, Callable[[bytes], bytes]]:
+    # Retorna o ID do usuário, a chave pública (DER) e o assinador do perfil. O par de
+    # chaves é criado na primeira execução do perfil e reutilizado nas seguintes.
+    path = os.path.join(IDENTITY_DIRECTORY, f"{profile}.pem")
 
-    # Inicializa o par de chaves
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-    )
-    public_key = private_key.public_key()
-
-    # Salva a chave pública
-    # Verifica se o diretório existe
-    if not os.path.isdir("./keys"):
-        os.makedirs("./keys")
-
-    with open(f"./keys/{user_id}.pem", "wb") as f:
-        f.write(
-            public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo,
-            )
+    try:
+        with open(path, "rb") as f:
+            private_key = load_private_key_pem(f.read())
+    except FileNotFoundError:
+        # Inicializa o par de chaves
+        private_key = generate_private_key(SIGNATURE_ALGORITHM)
+
+        # Salva a chave privada, legível só pelo dono
+        os.makedirs(IDENTITY_DIRECTORY, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+        with os.fdopen(fd, "wb") as f:
+            f.write(private_key_pem(private_key))
+
+    public_key = public_key_der(private_key)
+
+    return user_id_of(public_key), public_key, make_signer(private_key)
+
+
+class SimulatedUser:
+    __slots__ = ("user_id", "public_key", "sign", "policy", "bids", "wins")
+
+    def __init__(
+        self,
+        user_id: str,
+        public_key: bytes,
+        sign: Callable[[bytes], bytes],
+        policy: BiddingPolicy,
+    ):
+        self.user_id = user_id
+        self.public_key = public_key
+        self.sign = sign
+        self.policy = policy
+        self.bids = 0
+        self.wins = 0
+
+
+def simulated_consumer(
+    broker: Broker, queue: DeclaredQueue, users: list[SimulatedUser]
+):
+    # Todos os usuários simulados dividem a conexão e a fila. Nada aqui bloqueia: os
+    # lances e os despertares das estratégias são agendados em um heap, atendido
+    # entre os eventos da conexão
+    timers: list = []
+    sequence = itertools.count()
+    rng = random.Random()
+
+    # Usuários participantes de cada leilão em andamento
+    participants: dict[str, list[SimulatedUser]] = {}
+    by_id = {user.user_id: user for user in users}
+
+    def register_keys():
+        for user in users:
+            register_key(user.user_id, user.public_key, broker)
+
+    broker.on_connect(register_keys)
+
+    def schedule(when: float, callback: Callable[[], None]):
+        heapq.heappush(timers, (when, next(sequence), callback))
+
+    def place_bid(user: SimulatedUser, leilao_id: str, value: int):
+        if leilao_id not in participants:
+            return
+
+        send_lance(user.user_id, leilao_id, str(value), broker, user.sign)
+        user.bids += 1
+
+    def bid_later(user: SimulatedUser, leilao_id: str, value: int | None):
+        if value is None:
+            return
+
+        delay = rng.uniform(0, user.policy.reaction_s)
+        schedule(
+            time.time() + delay, functools.partial(place_bid, user, leilao_id, value)
         )
 
-    # Realiza a conexao com o RabbitMQ
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host="localhost"))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="direct")
+    def wake(user: SimulatedUser, leilao_id: str):
+        bid_later(user, leilao_id, user.policy.on_wake(leilao_id))
+
+    def on_message(method, properties, body):
+        if method.routing_key.startswith("chave_solicitada."):
+            user = by_id.get(method.routing_key.split(".", 1)[1])
+
+            if user is not None:
+                register_key(user.user_id, user.public_key, broker)
+        elif method.routing_key == "leilao_iniciado":
+            try:
+                leilao = decode_event("leilao", body, properties.content_type)
+            except (ValueError, struct.error) as e:
+                print(f"[Warning] Leilão inválido: {e}")
+                broker.done(method.delivery_tag, broker.generation)
+                return
+
+            joined = [user for user in users if user.policy.join(leilao)]
+
+            if joined:
+                participants[leilao.id] = joined
+                broker.bind(queue, f"leilao_{leilao.id}")
+
+            for user in joined:
+                bid_later(user, leilao.id, user.policy.on_iniciado(leilao))
+                wake_at = user.policy.wake_at(leilao)
+
+                if wake_at is not None:
+                    schedule(wake_at, functools.partial(wake, user, leilao.id))
+        else:
+            try:
+                message = decode_notification(properties, body)
+
+                if message.KIND in ("lance_validado", "lance_agregado"):
+                    value = int(message.value)
+            except (ValueError, struct.error) as e:
+                print(f"[Warning] Notificação inválida: {e}")
+                broker.done(method.delivery_tag, broker.generation)
+                return
+
+            type = message.KIND
+
+            if type in ("lance_validado", "lance_agregado"):
+                trace = trace_of(properties.headers)
+                age = trace_age(trace)
+
+                if age is not None:
+                    DELIVERY_TIME.record(age)
+
+                leilao_id = message.leilao_id
+
+                for user in participants.get(leilao_id, ()):
+                    own = user.user_id == message.user_id
+                    bid_later(
+                        user, leilao_id, user.policy.on_validado(leilao_id, value, own)
+                    )
+            elif type == "leilao_vencedor":
+                for user in participants.pop(message.leilao_id, ()):
+                    user.policy.on_finalizado(message.leilao_id)
 
-    # Cria uma fila com nome aleatória
-    result = channel.queue_declare(queue="", exclusive=True)
-    queue_name = result.method.queue
+                    if user.user_id == message.cliente_vencedor:
+                        user.wins += 1
+
+                print(
+                    f"[Log] Leilão {message.leilao_id[:ID_SUMMARY_LENGTH]} finalizado com um lance de {message.lance_vencedor}."
+                )
+
+        broker.done(method.delivery_tag, broker.generation)
+
+    def step() -> float | None:
+        now = time.time()
+
+        while timers and timers[0][0] <= now:
+            heapq.heappop(timers)[2]()
+
+        if not timers:
+            return None
+
+        return max(0.0, timers[0][0] - time.time())
+
+    broker.consume(queue, on_message)
+
+    print(f" [Client] {len(users)} usuários simulados. To exit press CTRL+C")
+    broker.run(step)
+
+
+def main_simulated(count: int, policy_name: str, max_price: int):
+    if policy_name not in POLICIES:
+        print(f"[Client] Estratégias disponíveis: {', '.join(POLICIES)}")
+        return 0
+
+    rng = random.Random()
+    kwargs = {"increment": SIMULATED_INCREMENT, "reaction_s": SIMULATED_REACTION_S}
 
+    if policy_name == "sniper":
+        kwargs["lead_s"] = SIMULATED_SNIPER_LEAD_S
+
+    # Os usuários simulados também mantêm as suas chaves entre execuções
+    users = []
+    for i in range(count):
+        user_id, public_key, sign = load_identity(f"simulado-{i}")
+        policy = make_policy(
+            policy_name, rng.randint(max(1, max_price // 2), max_price), **kwargs
+        )
+        users.append(SimulatedUser(user_id, public_key, sign, policy))
+
+    broker = Broker(exchange=EXCHANGE_NAME, publishers=1)
+    queue = broker.declare_queue(
+        "",
+        routing_keys=("leilao_iniciado",)
+        + tuple(f"chave_solicitada.{user.user_id}" for user in users),
+        exclusive=True,
+    )
+
+    try:
+        simulated_consumer(broker, queue, users)
+    except KeyboardInterrupt:
+        print("[Client] Exiting...")
+
+    broker.close()
+
+    print(
+        f"[Client] {sum(user.bids for user in users)} lances enviados, {sum(user.wins for user in users)} leilões vencidos."
+    )
+    print(f"[Client] Métricas:\n{REGISTRY.summary()}")
+
+    return 1
+
+
+def main(profile: str | None = None):
+    # Sem perfil, cada execução é um usuário novo, com um perfil de nome aleatório
+    # (que pode ser reutilizado depois pelo nome)
+    if profile is None:
+        profile = f"anonimo-{uuid.uuid4().hex[:8]}"
+
+    user_id, public_key, sign = load_identity(profile)
+    print(
+        f"[Client] Perfil '{profile}', seu ID de usuário é {user_id[:ID_SUMMARY_LENGTH]}"
+    )
+
+    # Realiza a conexao com o RabbitMQ. Os lances saem por um publicador próprio, e
+    # a conexão é refeita (com as ligações da fila) se cair
+    broker = Broker(exchange=EXCHANGE_NAME, publishers=1)
+
+    # Cria uma fila com nome aleatória
     # Conecta a fila criada com o exchange, aceitando apenas mensagens com o identificador "leilao_iniciado"
     # Requisito 2.2 - Logo ao inicializar, atuará como consumidor recebendo eventos da fila leilao_iniciado.
-    channel.queue_bind(
-        exchange=EXCHANGE_NAME, queue=queue_name, routing_key="leilao_iniciado"
+    # Os pedidos da chave pelo MS-Lance chegam na mesma fila
+    queue = broker.declare_queue(
+        "",
+        routing_keys=("leilao_iniciado", f"chave_solicitada.{user_id}"),
+        exclusive=True,
     )
 
+    # A chave pública é registrada no MS-Lance a cada conexão
+    broker.on_connect(lambda: register_key(user_id, public_key, broker))
+
     try:
-        consumer(
-            channel,
-            queue_name,
-            connection,
-            user_id,
-            private_key,
-        )
+        consumer(broker, queue, user_id, public_key, sign)
     except KeyboardInterrupt:
         print("[Client] Exiting...")
-        connection.close()
+        print(f"[Client] Métricas:\n{REGISTRY.summary()}")
+
+    broker.close()
 
-    if connection.is_open:
-        connection.close()
-        
     return 1
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "simulado":
+        main_simulated(
+            int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+            sys.argv[3] if len(sys.argv) > 3 else "maximo",
+            int(sys.argv[4]) if len(sys.argv) > 4 else 1000,
+        )
+    else:
+        # python src/client.py [perfil]
+        main(sys.argv[1] if len(sys.argv) > 1 else None)
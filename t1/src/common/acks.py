@@ -0,0 +1,141 @@
+from typing import Any, Callable
+
+# Confirma as mensagens em lote com basic_ack(multiple=True).
+#
+# As mensagens podem terminar fora de ordem (ex.: lances de leilões diferentes no
+# pipeline de verificação), mas um ack com multiple=True confirma todas as tags até
+# a informada. Por isso só é confirmado o prefixo contíguo de tags já concluídas.
+# O lote é enviado quando `batch_size` mensagens estão prontas ou quando a mais
+# antiga delas espera `max_delay_s`. `before_ack` é chamado antes de cada ack em lote
+# (ex.: o commit em grupo do log de estado do MS-Lance).
+#
+# Uma entrega recusada (reject) recebe um basic_nack próprio e sai da janela sem nunca
+# ser confirmada: ela conta como concluída para o prefixo, mas um ack em lote nunca usa
+# a tag dela (o broker fecha o canal com "unknown delivery tag" se a tag de um ack já
+# foi resolvida).
+#
+# Todos os métodos devem ser chamados na thread da conexão.
+
+# Novas tentativas de uma publicação recusada pelo broker antes de recusar (reject) a
+# entrega que a gerou (Broker.publish_then_ack, AsyncBroker.publish_nowait). O estado
+# já foi alterado pela entrega (ex.: o lance já está no livro do leilão); reentregue,
+# ela gera o evento de novo a partir do estado, mas publicar outra vez é mais barato.
+PUBLISH_RETRIES = 3
+
+
+class BatchAcker:
+    def __init__(
+        self,
+        channel,
+        call_later: Callable[[float, Callable[[], None]], Any],
+        batch_size: int = 64,
+        max_delay_s: float = 0.05,
+        before_ack: Callable[[], None] | None = None,
+    ):
+        assert batch_size > 0, "batch_size must be positive."
+
+        self.channel = channel
+        self.batch_size = batch_size
+        self.max_delay_s = max_delay_s
+
+        self.acks_sent = 0
+        self.messages_acked = 0
+        self.messages_rejected = 0
+
+        self._call_later = call_later
+        self._before_ack = before_ack
+        self._timer = None
+        self._acked = 0
+        self._watermark = 0
+        self._completed: set[int] = set()
+        self._rejected: set[int] = set()
+
+    def done(self, delivery_tag: int) -> None:
+        if delivery_tag != self._watermark + 1:
+            self._completed.add(delivery_tag)
+            return
+
+        self._watermark = delivery_tag
+
+        while self._watermark + 1 in self._completed:
+            self._watermark += 1
+            self._completed.remove(self._watermark)
+
+        if self._watermark - self._acked >= self.batch_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._call_later(self.max_delay_s, self._on_timer)
+
+    def reject(self, delivery_tag: int, requeue: bool = True) -> None:
+        # Devolve a entrega (requeue) ou a descarta, no lugar do ack
+        self.channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+        self._rejected.add(delivery_tag)
+        self.messages_rejected += 1
+        self.done(delivery_tag)
+
+    def flush(self) -> None:
+        if self._watermark <= self._acked:
+            return
+
+        # O ack em lote vai até a maior tag do prefixo que não foi recusada
+        target = self._watermark
+        while target > self._acked and target in self._rejected:
+            target -= 1
+
+        rejected = [tag for tag in self._rejected if tag <= self._watermark]
+        self._rejected.difference_update(rejected)
+
+        if target > self._acked:
+            if self._before_ack is not None:
+                self._before_ack()
+
+            self.channel.basic_ack(delivery_tag=target, multiple=True)
+            self.acks_sent += 1
+
+        self.messages_acked += self._watermark - self._acked - len(rejected)
+        self._acked = self._watermark
+
+    def reset(self, channel=None) -> None:
+        # As tags recomeçam em 1 a cada novo canal (ex.: após reconectar)
+        if channel is not None:
+            self.channel = channel
+
+        self._timer = None
+        self._acked = 0
+        self._watermark = 0
+        self._completed.clear()
+        self._rejected.clear()
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "acks_sent": self.acks_sent,
+            "messages_acked": self.messages_acked,
+            "waiting": self._watermark - self._acked + len(self._completed),
+            "messages_rejected": self.messages_rejected,
+        }
+
+
+def create_acker(
+    connection,
+    channel,
+    prefetch_count: int,
+    batch_size: int,
+    max_delay_s: float,
+    before_ack: Callable[[], None] | None = None,
+) -> BatchAcker:
+    # Limita o número de mensagens não confirmadas que o broker entrega ao consumidor.
+    # O lote precisa ser menor que a janela, senão o broker para de entregar antes
+    # do lote fechar e só o temporizador libera as confirmações.
+    channel.basic_qos(prefetch_count=prefetch_count)
+
+    return BatchAcker(
+        channel,
+        connection.call_later,
+        batch_size=max(1, min(batch_size, prefetch_count // 2)),
+        max_delay_s=max_delay_s,
+        before_ack=before_ack,
+    )
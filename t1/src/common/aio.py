@@ -0,0 +1,317 @@
+import asyncio
+import signal
+from typing import Any, Callable
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from common.acks import PUBLISH_RETRIES, BatchAcker
+
+# Runtime asyncio para os serviços, sobre o AsyncioConnection do pika.
+#
+# - As publicações usam publisher confirms e não esperam a confirmação: cada uma
+#   devolve um future que é resolvido quando o broker confirma (ou recusa).
+# - Várias entregas são processadas ao mesmo tempo; o limite é o prefetch do consumidor.
+# - A mensagem de origem só é confirmada (ack) depois que as publicações que ela gerou
+#   foram confirmadas pelo broker. Assim a janela de confirmações segura os acks, e
+#   com ela o prefetch: se o broker demora a confirmar, ele deixa de entregar.
+# - No SIGINT/SIGTERM o consumidor é cancelado e o trabalho em andamento termina
+#   (publicações confirmadas e acks enviados) antes de fechar a conexão.
+
+
+class PublishNacked(Exception):
+    pass
+
+
+class AsyncBroker:
+    def __init__(self, parameters: pika.ConnectionParameters):
+        self.parameters = parameters
+
+        self.connection: AsyncioConnection | None = None
+        self.channel = None
+        self.acker: BatchAcker | None = None
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._closed: asyncio.Future | None = None
+        self._stopped: asyncio.Event | None = None
+        self._calls: set[asyncio.Future] = set()
+        self._confirms: dict[int, asyncio.Future] = {}
+        self._publish_seq = 0
+        self._waiting_confirms = 0
+        self._consumer_tags: list[str] = []
+
+    # Conexão
+
+    async def connect(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._closed = self._loop.create_future()
+        self._stopped = asyncio.Event()
+
+        opened = self._loop.create_future()
+
+        def on_open(connection):
+            opened.set_result(connection)
+
+        def on_open_error(connection, error):
+            if not isinstance(error, BaseException):
+                error = pika.exceptions.AMQPConnectionError(error)
+
+            opened.set_exception(error)
+
+        def on_close(connection, reason):
+            if not opened.done():
+                opened.set_exception(reason)
+            if not self._closed.done():
+                self._closed.set_result(reason)
+
+            self._fail_pending(reason)
+            self._stopped.set()
+
+        self.connection = AsyncioConnection(
+            self.parameters,
+            on_open_callback=on_open,
+            on_open_error_callback=on_open_error,
+            on_close_callback=on_close,
+            custom_ioloop=self._loop,
+        )
+        await opened
+
+        self.channel = await self._call(self.connection.channel, "on_open_callback")
+        self.channel.add_on_close_callback(self._on_channel_closed)
+
+        await self._call(
+            self.channel.confirm_delivery, ack_nack_callback=self._on_confirm
+        )
+
+    def _call(self, method: Callable, callback_name: str = "callback", **kwargs):
+        # Converte uma chamada com callback do pika em um future
+        future = self._loop.create_future()
+
+        def done(result):
+            self._calls.discard(future)
+            if not future.done():
+                future.set_result(result)
+
+        kwargs[callback_name] = done
+        self._calls.add(future)
+        method(**kwargs)
+
+        return future
+
+    def _on_channel_closed(self, channel, reason) -> None:
+        self._fail_pending(reason)
+        self._stopped.set()
+
+    def _fail_pending(self, reason) -> None:
+        error = reason if isinstance(reason, BaseException) else Exception(reason)
+
+        for future in list(self._calls) + list(self._confirms.values()):
+            if not future.done():
+                future.set_exception(error)
+
+        self._calls.clear()
+        self._confirms.clear()
+
+    # Declarações
+
+    async def exchange_declare(self, exchange: str, exchange_type: str) -> None:
+        await self._call(
+            self.channel.exchange_declare,
+            exchange=exchange,
+            exchange_type=exchange_type,
+        )
+
+    async def queue_declare(self, queue: str = "", **kwargs) -> str:
+        frame = await self._call(self.channel.queue_declare, queue=queue, **kwargs)
+        return frame.method.queue
+
+    async def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        await self._call(
+            self.channel.queue_bind,
+            queue=queue,
+            exchange=exchange,
+            routing_key=routing_key,
+        )
+
+    # Publicação
+
+    def publish_nowait(
+        self,
+        exchange: str,
+        routing_key: str,
+        body: bytes,
+        properties: pika.BasicProperties | None = None,
+    ) -> asyncio.Future:
+        # Publica na ordem das chamadas e devolve o future da confirmação. Uma
+        # publicação recusada pelo broker é repetida até PUBLISH_RETRIES vezes.
+        result = self._loop.create_future()
+
+        def attempt(retries: int) -> None:
+            confirm = self._publish(exchange, routing_key, body, properties)
+
+            def done(confirm: asyncio.Future) -> None:
+                if result.done():
+                    return
+
+                if confirm.cancelled():
+                    result.cancel()
+                elif confirm.exception() is None:
+                    result.set_result(None)
+                elif (
+                    isinstance(confirm.exception(), PublishNacked)
+                    and retries > 0
+                    and self.channel.is_open
+                ):
+                    attempt(retries - 1)
+                else:
+                    result.set_exception(confirm.exception())
+
+            confirm.add_done_callback(done)
+
+        attempt(PUBLISH_RETRIES)
+        return result
+
+    def _publish(
+        self,
+        exchange: str,
+        routing_key: str,
+        body: bytes,
+        properties: pika.BasicProperties | None,
+    ) -> asyncio.Future:
+        self.channel.basic_publish(exchange, routing_key, body, properties)
+
+        self._publish_seq += 1
+        future = self._loop.create_future()
+        self._confirms[self._publish_seq] = future
+
+        return future
+
+    def _on_confirm(self, frame) -> None:
+        method = frame.method
+        ok = isinstance(method, pika.spec.Basic.Ack)
+
+        if method.multiple:
+            # As tags ficam no dicionário em ordem crescente
+            tags = []
+            for tag in self._confirms:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = (
+                [method.delivery_tag] if method.delivery_tag in self._confirms else []
+            )
+
+        for tag in tags:
+            future = self._confirms.pop(tag)
+
+            if future.done():
+                continue
+            if ok:
+                future.set_result(None)
+            else:
+                future.set_exception(PublishNacked(f"Publish {tag} was nacked."))
+
+    @property
+    def unconfirmed(self) -> int:
+        return len(self._confirms)
+
+    # Consumo
+
+    async def consume(
+        self,
+        queue: str,
+        on_message: Callable[[Any, pika.BasicProperties, bytes], None],
+        prefetch_count: int,
+        batch_size: int,
+        max_delay_s: float,
+        before_ack: Callable[[], None] | None = None,
+        arguments: dict | None = None,
+    ) -> None:
+        # Pode ser chamado para várias filas; todas compartilham o canal e o acker
+        await self._call(self.channel.basic_qos, prefetch_count=prefetch_count)
+
+        if self.acker is None:
+            # Mesmo limite do create_acker: o lote precisa ser menor que a janela
+            self.acker = BatchAcker(
+                self.channel,
+                self._loop.call_later,
+                batch_size=max(1, min(batch_size, prefetch_count // 2)),
+                max_delay_s=max_delay_s,
+                before_ack=before_ack,
+            )
+
+        consumer_tag = self.channel.basic_consume(
+            queue,
+            lambda ch, method, properties, body: on_message(method, properties, body),
+            auto_ack=False,
+            arguments=arguments,
+        )
+        self._consumer_tags.append(consumer_tag)
+
+    def ack(self, delivery_tag: int) -> None:
+        self.acker.done(delivery_tag)
+
+    def ack_after(self, delivery_tag: int, confirms: list[asyncio.Future]) -> None:
+        # Confirma a entrega quando todas as publicações derivadas dela forem confirmadas
+        if not confirms:
+            self.ack(delivery_tag)
+            return
+
+        self._waiting_confirms += 1
+
+        def done(gathered: asyncio.Future) -> None:
+            self._waiting_confirms -= 1
+
+            if gathered.cancelled():
+                return
+
+            failed = any(isinstance(r, BaseException) for r in gathered.result())
+
+            if not self.channel.is_open:
+                return
+
+            # Uma publicação que falhou mesmo depois das novas tentativas devolve a
+            # mensagem de origem para a fila; ela nunca é confirmada
+            if failed:
+                self.acker.reject(delivery_tag)
+            else:
+                self.acker.done(delivery_tag)
+
+        asyncio.gather(*confirms, return_exceptions=True).add_done_callback(done)
+
+    # Encerramento
+
+    def install_signal_handlers(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self._stopped.set)
+            except NotImplementedError:
+                # Windows não suporta add_signal_handler
+                pass
+
+    async def wait_stopped(self) -> None:
+        await self._stopped.wait()
+
+    async def close(self, drained: Callable[[], bool] | None = None) -> None:
+        if self.channel is not None and self.channel.is_open:
+            # Para de receber novas entregas
+            for consumer_tag in self._consumer_tags:
+                await self._call(self.channel.basic_cancel, consumer_tag=consumer_tag)
+
+            # Termina o trabalho em andamento
+            while drained is not None and not drained():
+                await asyncio.sleep(0.01)
+
+            # Espera as confirmações pendentes registrarem os acks
+            while self._waiting_confirms and self.channel.is_open:
+                await asyncio.sleep(0.01)
+
+            if self.acker is not None and self.channel.is_open:
+                self.acker.flush()
+
+        if self.connection is not None and not self.connection.is_closed:
+            if not self.connection.is_closing:
+                self.connection.close()
+
+            await self._closed
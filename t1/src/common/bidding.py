@@ -0,0 +1,132 @@
+from typing import Type
+
+from common.serial import Leilao
+
+# Estratégias de lance dos usuários simulados do cliente (python src/client.py
+# simulado ...).
+#
+# Uma estratégia recebe os eventos dos leilões e decide quando dar lances. Os métodos
+# on_* retornam o valor do lance a dar (ou None para não dar lance), que o cliente
+# publica depois de um tempo de reação aleatório de até `reaction_s`. wake_at pede
+# que on_wake seja chamado em um instante (timestamp) do leilão.
+#
+# Os métodos são chamados na thread da conexão do cliente e não devem bloquear.
+
+
+class BiddingPolicy:
+    def __init__(self, max_price: int, increment: int = 1, reaction_s: float = 0.0):
+        assert max_price > 0, "max_price must be positive."
+        assert increment > 0, "increment must be positive."
+
+        self.max_price = max_price
+        self.increment = increment
+        self.reaction_s = reaction_s
+
+        # Maior lance validado de cada leilão acompanhado, e os leilões em que o
+        # usuário tem o maior lance
+        self.highest: dict[str, int] = {}
+        self.winning: set[str] = set()
+
+    def join(self, leilao: Leilao) -> bool:
+        # Se o usuário participa do leilão
+        return True
+
+    def on_iniciado(self, leilao: Leilao) -> int | None:
+        self.highest[leilao.id] = 0
+        return None
+
+    def on_validado(self, leilao_id: str, value: int, own: bool) -> int | None:
+        if leilao_id not in self.highest:
+            return None
+
+        if value >= self.highest[leilao_id]:
+            self.highest[leilao_id] = value
+
+            if own:
+                self.winning.add(leilao_id)
+            else:
+                self.winning.discard(leilao_id)
+
+        return None
+
+    def wake_at(self, leilao: Leilao) -> float | None:
+        return None
+
+    def on_wake(self, leilao_id: str) -> int | None:
+        return None
+
+    def on_finalizado(self, leilao_id: str) -> None:
+        self.highest.pop(leilao_id, None)
+        self.winning.discard(leilao_id)
+
+    def next_bid(self, leilao_id: str) -> int | None:
+        # O menor lance que supera o atual, se couber no preço máximo
+        if leilao_id in self.winning or leilao_id not in self.highest:
+            return None
+
+        value = self.highest[leilao_id] + self.increment
+
+        return value if value <= self.max_price else None
+
+
+class MaxPricePolicy(BiddingPolicy):
+    # Dá o lance inicial e cobre qualquer lance de outro usuário até o preço máximo
+    def on_iniciado(self, leilao: Leilao) -> int | None:
+        super().on_iniciado(leilao)
+        return self.next_bid(leilao.id)
+
+    def on_validado(self, leilao_id: str, value: int, own: bool) -> int | None:
+        super().on_validado(leilao_id, value, own)
+        return None if own else self.next_bid(leilao_id)
+
+
+class SniperPolicy(BiddingPolicy):
+    # Só entra no leilão `lead_s` segundos antes do fim; a partir daí cobre os lances
+    # dos outros usuários até o preço máximo
+    def __init__(
+        self,
+        max_price: int,
+        increment: int = 1,
+        reaction_s: float = 0.0,
+        lead_s: float = 1.0,
+    ):
+        super().__init__(max_price, increment, reaction_s)
+        self.lead_s = lead_s
+        self.sniping: set[str] = set()
+
+    def wake_at(self, leilao: Leilao) -> float | None:
+        return leilao.end.timestamp() - self.lead_s
+
+    def on_wake(self, leilao_id: str) -> int | None:
+        if leilao_id not in self.highest:
+            return None
+
+        self.sniping.add(leilao_id)
+        return self.next_bid(leilao_id)
+
+    def on_validado(self, leilao_id: str, value: int, own: bool) -> int | None:
+        super().on_validado(leilao_id, value, own)
+
+        if own or leilao_id not in self.sniping:
+            return None
+
+        return self.next_bid(leilao_id)
+
+    def on_finalizado(self, leilao_id: str) -> None:
+        super().on_finalizado(leilao_id)
+        self.sniping.discard(leilao_id)
+
+
+POLICIES: dict[str, Type[BiddingPolicy]] = {
+    "maximo": MaxPricePolicy,
+    "sniper": SniperPolicy,
+}
+
+
+def make_policy(name: str, max_price: int, **kwargs) -> BiddingPolicy:
+    policy = POLICIES.get(name)
+
+    if policy is None:
+        raise ValueError(f"Unknown bidding policy '{name}'.")
+
+    return policy(max_price, **kwargs)
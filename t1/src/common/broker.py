@@ -0,0 +1,538 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable
+
+import pika
+from pika.exceptions import AMQPChannelError, AMQPConnectionError
+
+from common.acks import PUBLISH_RETRIES, BatchAcker, create_acker
+from common.aio import AsyncBroker
+from common.metrics import REGISTRY
+
+# Camada comum de acesso ao RabbitMQ dos serviços e do cliente.
+#
+# - Os parâmetros da conexão vêm do ambiente (connection_parameters).
+# - As publicações não usam o canal de consumo: saem por um pool de publicadores,
+#   cada um com a sua conexão e a sua thread, com publisher confirms em pipeline.
+#   Mensagens com a mesma chave de ordem (por padrão, a routing key) sempre usam o
+#   mesmo publicador, mantendo a ordem entre elas.
+# - O Broker guarda o exchange, as filas, as ligações e os consumidores declarados, e
+#   os declara de novo ao reconectar. Publicadores também reconectam, e o que foi
+#   publicado sem conexão é enviado quando ela volta.
+#
+# As tags de entrega recomeçam a cada conexão; o Broker numera as conexões
+# (`generation`) e descarta confirmações de entregas de uma conexão anterior, que o
+# broker já devolveu para a fila.
+
+EXCHANGE_NAME = "exchange"
+
+RECONNECT_DELAY_S = 1.0
+MAX_RECONNECT_DELAY_S = 30.0
+
+# Tempo máximo para os publicadores receberem as confirmações pendentes ao encerrar
+CLOSE_TIMEOUT_S = 5.0
+
+# Cria a conexão de consumo do Broker a partir dos parâmetros. O benchmark de ponta a
+# ponta troca pelo broker em memória (common/memory.py); como os publicadores usam o
+# runtime asyncio do pika, com outra fábrica as publicações saem pelo canal de
+# consumo.
+CONNECTION_FACTORY = pika.BlockingConnection
+
+OnDone = Callable[[bool], None]
+
+# Tempo entre a publicação e a confirmação (de volta na thread da conexão), e
+# publicações com confirmação pedida, somando os Brokers do processo
+_CONFIRM_TIME = REGISTRY.histogram("broker_confirmacao_seconds")
+_SENT = REGISTRY.counter("broker_publicacoes_enviadas")
+_CONFIRMED = REGISTRY.counter("broker_publicacoes_confirmadas")
+REGISTRY.gauge("broker_publicacoes_pendentes", lambda: _SENT.value - _CONFIRMED.value)
+
+
+def connection_parameters() -> pika.ConnectionParameters:
+    # RABBITMQ_HOST, RABBITMQ_PORT, RABBITMQ_VHOST, RABBITMQ_USER, RABBITMQ_PASSWORD e
+    # RABBITMQ_HEARTBEAT; sem elas, o RabbitMQ local com o usuário padrão
+    return pika.ConnectionParameters(
+        host=os.environ.get("RABBITMQ_HOST", "localhost"),
+        port=int(os.environ.get("RABBITMQ_PORT", "5672")),
+        virtual_host=os.environ.get("RABBITMQ_VHOST", "/"),
+        credentials=pika.PlainCredentials(
+            os.environ.get("RABBITMQ_USER", "guest"),
+            os.environ.get("RABBITMQ_PASSWORD", "guest"),
+        ),
+        heartbeat=int(os.environ.get("RABBITMQ_HEARTBEAT", "60")),
+    )
+
+
+class Publisher:
+    # Publicador com conexão própria, em uma thread com um loop asyncio (AsyncBroker).
+    # publish() pode ser chamado de qualquer thread; on_done(ok) é chamado na thread do
+    # publicador quando o broker confirma (True) ou recusa a mensagem, ou a conexão cai
+    # antes da confirmação (False).
+    def __init__(
+        self,
+        parameters: pika.ConnectionParameters,
+        exchange: str,
+        exchange_type: str,
+    ):
+        self.parameters = parameters
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._broker: AsyncBroker | None = None
+        self._backlog: deque = deque()
+        self._closing = False
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def publish(
+        self,
+        routing_key: str,
+        body: bytes,
+        properties: pika.BasicProperties | None = None,
+        on_done: OnDone | None = None,
+    ) -> None:
+        self._loop.call_soon_threadsafe(
+            self._publish, routing_key, body, properties, on_done
+        )
+
+    def _publish(self, routing_key, body, properties, on_done) -> None:
+        broker = self._broker
+
+        if broker is None or not broker.channel.is_open:
+            self._backlog.append((routing_key, body, properties, on_done))
+            return
+
+        confirm = broker.publish_nowait(self.exchange, routing_key, body, properties)
+
+        if on_done is not None:
+            confirm.add_done_callback(
+                lambda f: on_done(not f.cancelled() and f.exception() is None)
+            )
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._main())
+        self._loop.close()
+
+    async def _main(self) -> None:
+        delay = RECONNECT_DELAY_S
+
+        while not self._closing:
+            broker = AsyncBroker(self.parameters)
+
+            try:
+                await broker.connect()
+                await broker.exchange_declare(self.exchange, self.exchange_type)
+            except (AMQPConnectionError, AMQPChannelError, OSError) as error:
+                print(
+                    f"[Broker] Publicador sem conexão ({error!r}), nova tentativa em {delay:.0f}s"
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_S)
+                continue
+
+            delay = RECONNECT_DELAY_S
+            self._broker = broker
+
+            # O que foi publicado sem conexão sai agora, na ordem original
+            backlog, self._backlog = self._backlog, deque()
+            for message in backlog:
+                self._publish(*message)
+
+            await broker.wait_stopped()
+            self._broker = None
+
+            if not self._closing:
+                print("[Broker] Publicador perdeu a conexão, reconectando")
+
+    async def _close(self) -> None:
+        self._closing = True
+        broker = self._broker
+
+        if broker is None:
+            return
+
+        deadline = time.monotonic() + CLOSE_TIMEOUT_S
+        while broker.unconfirmed and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        await broker.close()
+
+    def close(self) -> None:
+        if not self._thread.is_alive():
+            return
+
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._thread.join()
+
+
+def _timed(on_done: OnDone) -> OnDone:
+    start = time.perf_counter()
+    _SENT.inc()
+
+    def done(ok: bool) -> None:
+        _CONFIRMED.inc()
+        _CONFIRM_TIME.record_since(start)
+        on_done(ok)
+
+    return done
+
+
+class PublisherPool:
+    def __init__(
+        self,
+        size: int,
+        parameters: pika.ConnectionParameters,
+        exchange: str,
+        exchange_type: str,
+    ):
+        assert size > 0, "size must be positive."
+
+        self._publishers = [
+            Publisher(parameters, exchange, exchange_type) for _ in range(size)
+        ]
+        self._started = False
+
+    def start(self) -> None:
+        if self._started:
+            return
+
+        for publisher in self._publishers:
+            publisher.start()
+
+        self._started = True
+
+    def publish(
+        self,
+        routing_key: str,
+        body: bytes,
+        properties: pika.BasicProperties | None = None,
+        on_done: OnDone | None = None,
+        order_key: str | None = None,
+    ) -> None:
+        # A mesma chave de ordem vai sempre para o mesmo publicador
+        key = order_key if order_key is not None else routing_key
+        index = zlib.crc32(key.encode("utf-8")) % len(self._publishers)
+        self._publishers[index].publish(routing_key, body, properties, on_done)
+
+    def close(self) -> None:
+        for publisher in self._publishers:
+            publisher.close()
+
+
+class DeclaredQueue:
+    # Fila declarada pelo Broker. Filas com nome gerado pelo servidor (queue="")
+    # recebem um nome novo a cada conexão, atualizado em `name`.
+    def __init__(self, queue: str, routing_keys: list[str], arguments: dict):
+        self.queue = queue
+        self.routing_keys = routing_keys
+        self.arguments = arguments
+        self.name = queue
+
+
+class Broker:
+    def __init__(
+        self,
+        parameters: pika.ConnectionParameters | None = None,
+        exchange: str = EXCHANGE_NAME,
+        exchange_type: str = "direct",
+        publishers: int = 1,
+    ):
+        self.parameters = parameters or connection_parameters()
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+
+        self.connection: pika.BlockingConnection | None = None
+        self.channel = None
+        self.acker: BatchAcker | None = None
+
+        # Número da conexão atual; muda a cada reconexão
+        self.generation = 0
+
+        self.pool = (
+            PublisherPool(publishers, self.parameters, exchange, exchange_type)
+            if publishers > 0 and CONNECTION_FACTORY is pika.BlockingConnection
+            else None
+        )
+
+        self._queues: list[DeclaredQueue] = []
+        self._consumers: list[tuple[DeclaredQueue, Callable, bool, dict | None]] = []
+        self._qos: tuple[int, int, float, Callable[[], None] | None] | None = None
+        self._on_connect: list[Callable[[], None]] = []
+        self._stopping = False
+
+    # Topologia (repetida a cada conexão)
+
+    def declare_queue(
+        self, queue: str = "", routing_keys: tuple[str, ...] = (), **arguments
+    ) -> DeclaredQueue:
+        declared = DeclaredQueue(queue, list(routing_keys), arguments)
+        self._queues.append(declared)
+
+        if self.is_connected:
+            self._declare(declared)
+
+        return declared
+
+    def bind(self, declared: DeclaredQueue, routing_key: str) -> None:
+        if routing_key in declared.routing_keys:
+            return
+
+        declared.routing_keys.append(routing_key)
+
+        if self.is_connected:
+            self.channel.queue_bind(
+                exchange=self.exchange, queue=declared.name, routing_key=routing_key
+            )
+
+    def set_qos(
+        self,
+        prefetch_count: int,
+        batch_size: int,
+        max_delay_s: float,
+        before_ack: Callable[[], None] | None = None,
+    ) -> None:
+        # Prefetch e confirmação em lote (common/acks.py) das entregas
+        self._qos = (prefetch_count, batch_size, max_delay_s, before_ack)
+
+    def consume(
+        self,
+        declared: DeclaredQueue,
+        on_message: Callable[[Any, pika.BasicProperties, bytes], None],
+        auto_ack: bool = False,
+        arguments: dict | None = None,
+    ) -> None:
+        # on_message(method, properties, body)
+        consumer = (declared, on_message, auto_ack, arguments)
+        self._consumers.append(consumer)
+
+        if self.is_connected:
+            self._consume(*consumer)
+
+    def on_connect(self, callback: Callable[[], None]) -> None:
+        # Chamado depois de cada conexão (e reconexão) estar pronta
+        self._on_connect.append(callback)
+
+    def _declare(self, declared: DeclaredQueue) -> None:
+        result = self.channel.queue_declare(queue=declared.queue, **declared.arguments)
+        declared.name = result.method.queue
+
+        for routing_key in declared.routing_keys:
+            self.channel.queue_bind(
+                exchange=self.exchange, queue=declared.name, routing_key=routing_key
+            )
+
+    def _consume(self, declared, on_message, auto_ack, arguments) -> None:
+        self.channel.basic_consume(
+            queue=declared.name,
+            on_message_callback=lambda ch, method, properties, body: on_message(
+                method, properties, body
+            ),
+            auto_ack=auto_ack,
+            arguments=arguments,
+        )
+
+    # Conexão
+
+    @property
+    def is_connected(self) -> bool:
+        return self.channel is not None and self.channel.is_open
+
+    def _connect(self) -> None:
+        self.connection = CONNECTION_FACTORY(self.parameters)
+        self.channel = self.connection.channel()
+        self.generation += 1
+
+        self.channel.exchange_declare(
+            exchange=self.exchange, exchange_type=self.exchange_type
+        )
+
+        for declared in self._queues:
+            self._declare(declared)
+
+        if self._qos is not None:
+            prefetch_count, batch_size, max_delay_s, before_ack = self._qos
+            self.acker = create_acker(
+                self.connection,
+                self.channel,
+                prefetch_count,
+                batch_size,
+                max_delay_s,
+                before_ack=before_ack,
+            )
+
+        for consumer in self._consumers:
+            self._consume(*consumer)
+
+        if self.pool is not None:
+            self.pool.start()
+
+        for callback in self._on_connect:
+            callback()
+
+    def _disconnect(self) -> None:
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except (AMQPConnectionError, AMQPChannelError):
+            pass
+
+        self.connection = None
+        self.channel = None
+        self.acker = None
+
+    def run(self, step: Callable[[], float | None] | None = None) -> None:
+        # Laço principal, reconectando quando a conexão cai. `step` é chamado a cada
+        # volta na thread da conexão e retorna quanto tempo esperar por eventos (None
+        # espera até o próximo evento).
+        delay = RECONNECT_DELAY_S
+
+        while not self._stopping:
+            try:
+                if not self.is_connected:
+                    # Ex.: o canal foi fechado pelo broker sem derrubar a conexão
+                    self._disconnect()
+                    self._connect()
+                    delay = RECONNECT_DELAY_S
+
+                time_limit = step() if step is not None else None
+                self.connection.process_data_events(time_limit=time_limit)
+            except (AMQPConnectionError, AMQPChannelError) as error:
+                if self._stopping:
+                    break
+
+                print(
+                    f"[Broker] Sem conexão ({error!r}), nova tentativa em {delay:.0f}s"
+                )
+                self._disconnect()
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY_S)
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def close(self) -> None:
+        self._stopping = True
+
+        # Espera as confirmações pendentes; os callbacks delas chegam à thread da
+        # conexão e registram os acks antes do último lote
+        if self.pool is not None:
+            self.pool.close()
+
+        if self.is_connected:
+            self.connection.process_data_events(time_limit=0)
+
+            if self.acker is not None:
+                self.acker.flush()
+
+        self._disconnect()
+
+    def call_threadsafe(self, callback: Callable[[], None]) -> None:
+        # Executa na thread da conexão atual. Se ela caiu, o callback é descartado:
+        # as entregas a que ele se refere voltam para a fila.
+        connection = self.connection
+
+        try:
+            if connection is not None:
+                connection.add_callback_threadsafe(callback)
+        except (AMQPConnectionError, AMQPChannelError):
+            pass
+
+    # Publicação e confirmação
+
+    def publish(
+        self,
+        routing_key: str,
+        body: bytes,
+        properties: pika.BasicProperties | None = None,
+        on_done: OnDone | None = None,
+        order_key: str | None = None,
+    ) -> None:
+        # on_done(ok) é chamado na thread da conexão de consumo
+        if on_done is not None:
+            on_done = _timed(on_done)
+
+        if self.pool is None:
+            self.channel.basic_publish(self.exchange, routing_key, body, properties)
+
+            if on_done is not None:
+                on_done(True)
+            return
+
+        callback = None
+        if on_done is not None:
+            callback = lambda ok: self.call_threadsafe(functools.partial(on_done, ok))
+
+        self.pool.publish(routing_key, body, properties, callback, order_key)
+
+    def done(self, delivery_tag: int, generation: int) -> None:
+        # Confirma uma entrega recebida na conexão `generation`
+        if generation != self.generation or not self.is_connected:
+            return
+
+        if self.acker is not None:
+            self.acker.done(delivery_tag)
+        else:
+            self.channel.basic_ack(delivery_tag=delivery_tag)
+
+    def reject(self, delivery_tag: int, generation: int) -> None:
+        # Devolve para a fila uma entrega recebida na conexão `generation`, no lugar
+        # do ack (done): uma tag tem um único destino
+        if generation != self.generation or not self.is_connected:
+            return
+
+        if self.acker is not None:
+            self.acker.reject(delivery_tag)
+        else:
+            self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+
+    def publish_then_ack(
+        self,
+        delivery_tags: list[int],
+        generation: int,
+        messages: list[tuple[str, bytes, pika.BasicProperties | None]],
+        order_key: str | None = None,
+    ) -> None:
+        # Publica as mensagens derivadas de entregas e as confirma quando o broker
+        # confirmar todas. Uma publicação recusada é repetida até PUBLISH_RETRIES
+        # vezes; se ainda falhar, as entregas voltam para a fila (nack) e nunca são
+        # confirmadas.
+        if not messages:
+            for delivery_tag in delivery_tags:
+                self.done(delivery_tag, generation)
+            return
+
+        remaining = len(messages)
+        failed = False
+
+        def send(message, attempt: int) -> None:
+            def on_done(ok: bool) -> None:
+                nonlocal remaining, failed
+
+                if not ok and attempt < PUBLISH_RETRIES and self.is_connected:
+                    send(message, attempt + 1)
+                    return
+
+                remaining -= 1
+                failed = failed or not ok
+
+                if remaining == 0:
+                    for delivery_tag in delivery_tags:
+                        if failed:
+                            self.reject(delivery_tag, generation)
+                        else:
+                            self.done(delivery_tag, generation)
+
+            routing_key, body, properties = message
+            self.publish(routing_key, body, properties, on_done, order_key)
+
+        for message in messages:
+            send(message, 0)
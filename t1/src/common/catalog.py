@@ -0,0 +1,164 @@
+import io
+import itertools
+import random
+import struct
+from datetime import datetime
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+from common.serial import (
+    CONTENT_TYPE_BINARY,
+    Leilao,
+    decode_event,
+    deserialize_leilao,
+    encode_event,
+    serialize_leilao,
+)
+
+# Catálogo de leilões em arquivo, lido de forma incremental (um leilão por vez).
+#
+# Formatos:
+# - JSONL: um leilão por linha, no mesmo JSON de serialize_leilao.
+# - Binário: CATALOG_MAGIC seguido de registros (tamanho u32 + leilão no formato
+#   binário de common/serial.py).
+#
+# O formato é detectado pelos primeiros bytes, tanto em arquivos quanto em lotes
+# recebidos pelo broker.
+#
+# Um leilão mal formado lança ValueError, a não ser que `on_invalid` seja informado:
+# nesse caso o erro é repassado a ele e o leilão é pulado. Um registro binário
+# truncado sempre lança ValueError, já que não há como achar o registro seguinte.
+CATALOG_MAGIC = b"LCAT\x01"
+
+_RECORD_LENGTH = struct.Struct(">I")
+
+OnInvalid = Callable[[Exception], None] | None
+
+
+def _decode(decode, record: bytes, on_invalid: OnInvalid) -> Leilao | None:
+    try:
+        return decode(record)
+    except (ValueError, struct.error) as e:
+        if on_invalid is None:
+            raise
+
+        on_invalid(e)
+        return None
+
+
+def iter_catalog(f: BinaryIO, on_invalid: OnInvalid = None) -> Iterator[Leilao]:
+    head = f.read(len(CATALOG_MAGIC))
+
+    if head == CATALOG_MAGIC:
+        yield from _iter_binary(f, on_invalid)
+        return
+
+    # JSONL: a primeira linha começa nos bytes já lidos
+    for line in itertools.chain((head + f.readline(),), f):
+        line = line.strip()
+
+        if line:
+            leilao = _decode(deserialize_leilao, line, on_invalid)
+
+            if leilao is not None:
+                yield leilao
+
+
+def _decode_binary_leilao(record: bytes) -> Leilao:
+    return decode_event("leilao", record, CONTENT_TYPE_BINARY)
+
+
+def _iter_binary(f: BinaryIO, on_invalid: OnInvalid) -> Iterator[Leilao]:
+    while True:
+        header = f.read(_RECORD_LENGTH.size)
+
+        if not header:
+            return
+        if len(header) != _RECORD_LENGTH.size:
+            raise ValueError("Truncated catalog record.")
+
+        (length,) = _RECORD_LENGTH.unpack(header)
+        record = f.read(length)
+
+        if len(record) != length:
+            raise ValueError("Truncated catalog record.")
+
+        leilao = _decode(_decode_binary_leilao, record, on_invalid)
+
+        if leilao is not None:
+            yield leilao
+
+
+def read_catalog(path: str, on_invalid: OnInvalid = None) -> Iterator[Leilao]:
+    with open(path, "rb") as f:
+        yield from iter_catalog(f, on_invalid)
+
+
+def parse_catalog(data: bytes) -> Iterator[Leilao]:
+    return iter_catalog(io.BytesIO(data))
+
+
+def write_catalog(f: BinaryIO, leiloes: Iterable[Leilao], binary: bool = True) -> int:
+    count = 0
+
+    if binary:
+        f.write(CATALOG_MAGIC)
+
+    for leilao in leiloes:
+        if binary:
+            record, content_type = encode_event(leilao, binary=True)
+
+            if content_type != CONTENT_TYPE_BINARY:
+                raise ValueError(f"Leilao '{leilao.id}' has no binary encoding.")
+
+            f.write(_RECORD_LENGTH.pack(len(record)))
+            f.write(record)
+        else:
+            f.write(serialize_leilao(leilao))
+            f.write(b"\n")
+
+        count += 1
+
+    return count
+
+
+# Gerador sintético para testes de carga. Cria um único vocabulário com o Faker e
+# monta as descrições com o random, que é muito mais rápido que instanciar o Faker
+# (ou gerar uma frase com ele) para cada leilão. Os inícios saem em ordem crescente,
+# o que permite ler o catálogo gerado de forma incremental.
+_vocabulary: list[str] | None = None
+
+
+def _get_vocabulary() -> list[str]:
+    global _vocabulary
+
+    if _vocabulary is None:
+        from faker import Faker
+
+        # O dicionário do Faker pode ter menos de 1000 palavras distintas
+        _vocabulary = sorted(set(Faker().words(nb=5000)))
+
+    return _vocabulary
+
+
+def generate_leiloes(
+    count: int,
+    first_start: datetime,
+    spread_s: float,
+    duration_s: float,
+    seed: int | None = None,
+) -> Iterator[Leilao]:
+    rng = random.Random(seed)
+    words = _get_vocabulary()
+
+    base = first_start.timestamp()
+    step = spread_s / max(count, 1)
+
+    for i in range(count):
+        start = base + (i + rng.random()) * step
+
+        yield Leilao(
+            f"{rng.getrandbits(128):032x}",
+            " ".join(rng.choices(words, k=5)).capitalize() + ".",
+            datetime.fromtimestamp(start),
+            datetime.fromtimestamp(start + duration_s),
+        )
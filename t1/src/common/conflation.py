@@ -0,0 +1,77 @@
+from typing import Any, Callable, Hashable
+
+# Agrega atualizações rápidas de uma mesma chave (ex.: lances validados de um leilão)
+# em uma única atualização com o estado mais recente.
+#
+# A primeira atualização de uma chave abre uma janela de `window_s`; as seguintes
+# apenas substituem o item guardado e incrementam o contador. Ao fim da janela (ou
+# em um flush explícito) `on_flush(chave, item, quantidade, tags)` recebe o item mais
+# recente, quantos itens foram agregados e as tags de entrega de todos eles, que só
+# devem ser confirmadas depois que a atualização agregada for publicada.
+#
+# Todos os métodos devem ser chamados na thread da conexão.
+
+
+class Conflator:
+    def __init__(
+        self,
+        call_later: Callable[[float, Callable[[], None]], Any],
+        window_s: float,
+        on_flush: Callable[[Hashable, Any, int, list[int]], None],
+    ):
+        assert window_s > 0, "window_s must be positive."
+
+        self.window_s = window_s
+
+        self.received = 0
+        self.flushed = 0
+
+        self._call_later = call_later
+        self._on_flush = on_flush
+        # chave -> [item mais recente, quantidade, tags]
+        self._pending: dict[Hashable, list] = {}
+
+    def add(self, key: Hashable, item: Any, delivery_tag: int) -> None:
+        self.received += 1
+        entry = self._pending.get(key)
+
+        if entry is not None:
+            entry[0] = item
+            entry[1] += 1
+            entry[2].append(delivery_tag)
+            return
+
+        entry = [item, 1, [delivery_tag]]
+        self._pending[key] = entry
+
+        # O temporizador só esvazia a janela que o criou; se ela já foi esvaziada por
+        # um flush explícito, uma janela nova da mesma chave não é encurtada
+        self._call_later(self.window_s, lambda: self._on_timer(key, entry))
+
+    def flush(self, key: Hashable) -> None:
+        entry = self._pending.pop(key, None)
+
+        if entry is None:
+            return
+
+        self.flushed += 1
+        self._on_flush(key, entry[0], entry[1], entry[2])
+
+    def flush_all(self) -> None:
+        for key in list(self._pending):
+            self.flush(key)
+
+    def _on_timer(self, key: Hashable, entry: list) -> None:
+        if self._pending.get(key) is entry:
+            self.flush(key)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "received": self.received,
+            "flushed": self.flushed,
+            "pending": len(self._pending),
+        }
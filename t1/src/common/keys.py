@@ -0,0 +1,218 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable
+
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives.serialization import load_der_public_key
+
+from common.signing import make_verifier, user_id_of
+
+# Chaves públicas dos usuários no MS-Lance.
+#
+# Os clientes registram a sua chave publicando um evento "chave" (common/serial.py).
+# O MS-Lance mantém o índice de chaves em memória (KeyStore), gravado em um arquivo
+# de registros só de acréscimo e recarregado ao iniciar. As chaves seguem em DER,
+# junto de cada lance, para os workers de verificação, que guardam o verificador já
+# montado de cada chave em um cache LRU (PublicKeyCache). Nenhum lance lê o disco.
+
+Verifier = Callable[[bytes, bytes], bool]
+
+
+class PublicKeyCache:
+    # O cache guarda o verificador da chave (função (assinatura, dados) -> bool), de
+    # modo que o algoritmo (RSA ou Ed25519) é identificado uma vez por chave
+    def __init__(self, max_size: int = 1024):
+        assert max_size > 0, "max_size must be positive."
+
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # user_id -> (chave em DER, verificador)
+        self._entries: OrderedDict[str, tuple[bytes, Verifier]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, user_id: str, public_key: bytes, timings: list | None = None
+    ) -> Verifier | None:
+        # Em uma falta, a interpretação da chave é medida em `timings`
+        # ((estágio, segundos)). Retorna None se a chave não puder ser usada.
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry is not None and entry[0] == public_key:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+
+        start = time.perf_counter()
+
+        try:
+            verifier = make_verifier(load_der_public_key(public_key))
+        except (ValueError, UnsupportedAlgorithm):
+            self.invalidate(user_id)
+            return None
+
+        if timings is not None:
+            timings.append(("chave_der", time.perf_counter() - start))
+
+        with self._lock:
+            self._entries[user_id] = (public_key, verifier)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return verifier
+
+    def invalidate(self, user_id: str | None = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Arquivos do KeyStore: registros de tamanho (u32) + crc32 (u32) + ID do usuário (16
+# bytes) + chave em DER. Várias instâncias do MS-Lance podem compartilhar o
+# diretório, e cada uma acrescenta só ao seu arquivo (chaves-<instância>.log), com as
+# chaves que ainda não conhecia; a carga lê os arquivos de todas e ignora chaves
+# repetidas. Um registro inválido termina a leitura do arquivo: no arquivo da própria
+# instância é uma escrita interrompida e é descartado, no de outra instância pode ser
+# uma escrita em andamento e o arquivo não é alterado.
+_RECORD_HEADER = struct.Struct(">II")
+_USER_ID_SIZE = 16
+_FILE_PREFIX = "chaves"
+_FILE_SUFFIX = ".log"
+
+
+class KeyStore:
+    def __init__(
+        self, directory: str | None = None, instance_id: str = "", fsync: bool = True
+    ):
+        # Sem diretório, as chaves ficam só em memória
+        self.directory = directory
+        self.path = (
+            os.path.join(directory, f"{_FILE_PREFIX}-{instance_id}{_FILE_SUFFIX}")
+            if directory is not None
+            else None
+        )
+        self.fsync = fsync
+
+        self.registered = 0
+        self.rejected = 0
+
+        self._keys: dict[str, bytes] = {}
+        self._file = None
+
+    def load(self) -> int:
+        # Carrega as chaves gravadas por todas as instâncias. Retorna quantas chaves
+        # foram carregadas.
+        if self.directory is None:
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith(_FILE_PREFIX) and name.endswith(_FILE_SUFFIX):
+                self._load_file(os.path.join(self.directory, name))
+
+        return len(self._keys)
+
+    def _load_file(self, path: str) -> None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        offset = 0
+
+        while offset < len(data):
+            try:
+                length, crc = _RECORD_HEADER.unpack_from(data, offset)
+            except struct.error:
+                length, crc = None, None
+
+            start = offset + _RECORD_HEADER.size
+            payload = data[start : start + length] if length is not None else b""
+
+            if length is None or len(payload) != length or zlib.crc32(payload) != crc:
+                # Só o arquivo desta instância é reparado
+                if path == self.path:
+                    print(
+                        f"[KeyStore] Descartando registro incompleto no fim de '{path}'."
+                    )
+                    os.truncate(path, offset)
+                else:
+                    print(f"[KeyStore] Registro incompleto em '{path}'; lido até ele.")
+                break
+
+            user_id = payload[:_USER_ID_SIZE].hex()
+            self._keys.setdefault(user_id, payload[_USER_ID_SIZE:])
+            offset = start + length
+
+    def get(self, user_id: str) -> bytes | None:
+        return self._keys.get(user_id)
+
+    def register(self, user_id: str, public_key: bytes) -> bool:
+        # Retorna True se a chave é nova. O ID precisa ser a impressão digital da
+        # chave (common/signing.py), senão o registro é recusado.
+        if user_id_of(public_key) != user_id:
+            self.rejected += 1
+            return False
+
+        if user_id in self._keys:
+            return False
+
+        self._keys[user_id] = public_key
+        self.registered += 1
+
+        if self.path is not None:
+            # O arquivo só é criado quando a instância grava a primeira chave
+            if self._file is None:
+                self._file = open(self.path, "ab")
+
+            payload = bytes.fromhex(user_id) + public_key
+            self._file.write(
+                _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+            )
+            self._file.flush()
+
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+        return True
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "keys": len(self._keys),
+            "registered": self.registered,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,476 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+from pika.exceptions import (
+    ChannelClosedByBroker,
+    ChannelClosedByClient,
+    ConnectionWrongStateError,
+)
+
+# Broker em memória com o subconjunto da API do pika (BlockingConnection e
+# BlockingChannel) usado pelo Broker de common/broker.py, para rodar os serviços em
+# um só processo (benchmarks/bench_carga.py) sem um RabbitMQ.
+#
+# Suporta exchanges diretos, filas com nome gerado (queue=""), exclusivas e com
+# single active consumer + x-priority, prefetch por consumidor, ack/nack (com
+# multiple e requeue) e os temporizadores e callbacks da conexão. Não há
+# persistência, publisher confirms nem limites de memória: uma publicação é roteada
+# na hora para as filas.
+#
+# Como no RabbitMQ, um ack ou nack de uma tag desconhecida ou já resolvida fecha o
+# canal (PRECONDITION_FAILED, com as entregas pendentes de volta para a fila) e chega
+# como ChannelClosedByBroker; esses casos são contados em stats()["unknown_tags"].
+#
+# O servidor é thread-safe. Cada conexão deve ser usada por uma só thread, a que
+# chama process_data_events, onde rodam os callbacks de entrega, os temporizadores
+# e os callbacks de add_callback_threadsafe (este pode ser chamado de qualquer
+# thread).
+
+
+class ServerStopped(KeyboardInterrupt):
+    # Levantada pelo process_data_events das conexões quando o servidor é parado, e
+    # encerra os serviços como um CTRL+C
+    pass
+
+
+class _Frame:
+    # Os objetos `method` do pika: queue_declare().method e o Basic.Deliver
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class _Queue:
+    def __init__(self, name: str, owner, single_active: bool):
+        self.name = name
+        self.owner = owner
+        self.single_active = single_active
+        self.messages: deque = deque()
+        self.consumers: list[_Consumer] = []
+        self.turn = 0
+
+
+class _Consumer:
+    def __init__(self, channel, tag: str, callback, auto_ack: bool, priority: int):
+        self.channel = channel
+        self.tag = tag
+        self.callback = callback
+        self.auto_ack = auto_ack
+        self.priority = priority
+        self.unacked = 0
+
+    def has_room(self) -> bool:
+        prefetch = self.channel.prefetch_count
+        return self.auto_ack or prefetch == 0 or self.unacked < prefetch
+
+
+class MemoryServer:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._exchanges: dict[str, str] = {}
+        self._bindings: dict[tuple[str, str], list[_Queue]] = {}
+        self._queues: dict[str, _Queue] = {}
+        self._connections: list[MemoryConnection] = []
+        self._names = itertools.count(1)
+        self.stopped = False
+
+        self.published = 0
+        self.delivered = 0
+        self.unknown_tags = 0
+
+    def connect(self, parameters=None) -> "MemoryConnection":
+        # Mesma assinatura de pika.BlockingConnection; os parâmetros são ignorados
+        with self._lock:
+            if self.stopped:
+                raise ServerStopped()
+
+            connection = MemoryConnection(self)
+            self._connections.append(connection)
+
+        return connection
+
+    def stop(self) -> None:
+        with self._lock:
+            self.stopped = True
+            connections = list(self._connections)
+
+        for connection in connections:
+            connection._wake()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "published": self.published,
+                "delivered": self.delivered,
+                "queued": sum(len(q.messages) for q in self._queues.values()),
+                "unknown_tags": self.unknown_tags,
+            }
+
+    # Chamados pelos canais, com o lock
+
+    def _exchange_declare(self, exchange: str, exchange_type: str) -> None:
+        if exchange_type != "direct":
+            raise ValueError(f"Unsupported exchange type '{exchange_type}'.")
+
+        self._exchanges.setdefault(exchange, exchange_type)
+
+    def _queue_declare(self, connection, name: str, exclusive: bool, arguments) -> str:
+        if not name:
+            name = f"amq.gen-{next(self._names)}"
+
+        queue = self._queues.get(name)
+
+        if queue is None:
+            single_active = bool((arguments or {}).get("x-single-active-consumer"))
+            owner = connection if exclusive else None
+            queue = self._queues[name] = _Queue(name, owner, single_active)
+
+        return name
+
+    def _queue_bind(self, exchange: str, name: str, routing_key: str) -> None:
+        if exchange not in self._exchanges:
+            raise ValueError(f"Exchange '{exchange}' was not declared.")
+
+        queues = self._bindings.setdefault((exchange, routing_key), [])
+        queue = self._queues[name]
+
+        if queue not in queues:
+            queues.append(queue)
+
+    def _publish(self, exchange: str, routing_key: str, body: bytes, properties) -> None:
+        self.published += 1
+
+        for queue in self._bindings.get((exchange, routing_key), ()):
+            queue.messages.append((exchange, routing_key, properties, body, False))
+            self._dispatch(queue)
+
+    def _consume(self, name: str, consumer: _Consumer) -> None:
+        queue = self._queues[name]
+        queue.consumers.append(consumer)
+        self._dispatch(queue)
+
+    def _pick(self, queue: _Queue) -> _Consumer | None:
+        if not queue.consumers:
+            return None
+
+        top = max(consumer.priority for consumer in queue.consumers)
+
+        if queue.single_active:
+            # O primeiro consumidor de maior prioridade recebe tudo, mesmo sem espaço
+            active = next(c for c in queue.consumers if c.priority == top)
+            return active if active.has_room() else None
+
+        # Revezamento entre os consumidores de maior prioridade com espaço
+        candidates = [
+            c for c in queue.consumers if c.priority == top and c.has_room()
+        ]
+
+        if not candidates:
+            return None
+
+        queue.turn += 1
+        return candidates[queue.turn % len(candidates)]
+
+    def _dispatch(self, queue: _Queue) -> None:
+        while queue.messages:
+            consumer = self._pick(queue)
+
+            if consumer is None:
+                return
+
+            message = queue.messages.popleft()
+            consumer.channel._deliver(queue, consumer, message)
+            self.delivered += 1
+
+    def _requeue(self, queue: _Queue, messages: list) -> None:
+        # Devolve as mensagens para o início da fila, na ordem original
+        for exchange, routing_key, properties, body, _ in reversed(messages):
+            queue.messages.appendleft((exchange, routing_key, properties, body, True))
+
+        self._dispatch(queue)
+
+    def _close_connection(self, connection) -> None:
+        for channel in connection._channels:
+            channel._close()
+
+        # Filas exclusivas são apagadas com a conexão
+        for name, queue in list(self._queues.items()):
+            if queue.owner is connection:
+                del self._queues[name]
+
+                for queues in self._bindings.values():
+                    if queue in queues:
+                        queues.remove(queue)
+
+        if connection in self._connections:
+            self._connections.remove(connection)
+
+
+class MemoryChannel:
+    def __init__(self, connection: "MemoryConnection"):
+        self.connection = connection
+        self.prefetch_count = 0
+        self.is_open = True
+
+        self._server = connection._server
+        self._consumers: dict[str, _Consumer] = {}
+        self._unacked: dict[int, tuple[_Queue, _Consumer, tuple]] = {}
+        self._delivery_tags = itertools.count(1)
+        self._consumer_tags = itertools.count(1)
+
+    def _check(self) -> None:
+        if not self.is_open:
+            raise ChannelClosedByClient(0, "Channel is closed.")
+        if self._server.stopped:
+            raise ConnectionWrongStateError("Server stopped.")
+
+    def exchange_declare(self, exchange: str, exchange_type: str = "direct", **_) -> None:
+        with self._server._lock:
+            self._check()
+            self._server._exchange_declare(exchange, exchange_type)
+
+    def queue_declare(
+        self,
+        queue: str = "",
+        exclusive: bool = False,
+        arguments: dict | None = None,
+        **_,
+    ):
+        with self._server._lock:
+            self._check()
+            name = self._server._queue_declare(
+                self.connection, queue, exclusive, arguments
+            )
+
+        return _Frame(method=_Frame(queue=name))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str | None = None) -> None:
+        with self._server._lock:
+            self._check()
+            self._server._queue_bind(exchange, queue, routing_key or queue)
+
+    def basic_qos(self, prefetch_count: int = 0, **_) -> None:
+        with self._server._lock:
+            self._check()
+            self.prefetch_count = prefetch_count
+
+    def basic_consume(
+        self,
+        queue: str,
+        on_message_callback: Callable[[Any, Any, Any, bytes], None],
+        auto_ack: bool = False,
+        arguments: dict | None = None,
+        **_,
+    ) -> str:
+        priority = (arguments or {}).get("x-priority", 0)
+
+        with self._server._lock:
+            self._check()
+            tag = f"ctag-{next(self._consumer_tags)}"
+            consumer = _Consumer(self, tag, on_message_callback, auto_ack, priority)
+            self._consumers[tag] = consumer
+            self._server._consume(queue, consumer)
+
+        return tag
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, properties=None, **_
+    ) -> None:
+        with self._server._lock:
+            self._check()
+            self._server._publish(exchange, routing_key, body, properties)
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self._settle(delivery_tag, multiple, requeue=None)
+
+    def basic_nack(
+        self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        self._settle(delivery_tag, multiple, requeue=requeue)
+
+    def _settle(self, delivery_tag: int, multiple: bool, requeue: bool | None) -> None:
+        with self._server._lock:
+            self._check()
+
+            # multiple com a tag 0 resolve todas as entregas pendentes
+            if delivery_tag not in self._unacked and not (
+                multiple and delivery_tag == 0
+            ):
+                self._server.unknown_tags += 1
+                self._close()
+                raise ChannelClosedByBroker(
+                    406, f"PRECONDITION_FAILED - unknown delivery tag {delivery_tag}"
+                )
+
+            if multiple:
+                tags = [
+                    tag
+                    for tag in self._unacked
+                    if delivery_tag == 0 or tag <= delivery_tag
+                ]
+            else:
+                tags = [delivery_tag]
+
+            self._release([self._unacked.pop(tag) for tag in sorted(tags)], requeue)
+
+    def _release(self, entries: list, requeue: bool | None) -> None:
+        # Libera o espaço dos consumidores e, com requeue, devolve as mensagens
+        returned: dict[_Queue, list] = {}
+
+        for queue, consumer, message in entries:
+            consumer.unacked -= 1
+
+            if requeue:
+                returned.setdefault(queue, []).append(message)
+
+        for queue, messages in returned.items():
+            self._server._requeue(queue, messages)
+
+        for queue in {queue for queue, _, _ in entries}:
+            self._server._dispatch(queue)
+
+    def _deliver(self, queue: _Queue, consumer: _Consumer, message: tuple) -> None:
+        # Com o lock do servidor
+        exchange, routing_key, properties, body, redelivered = message
+        delivery_tag = next(self._delivery_tags)
+
+        if not consumer.auto_ack:
+            consumer.unacked += 1
+            self._unacked[delivery_tag] = (queue, consumer, message)
+
+        method = _Frame(
+            consumer_tag=consumer.tag,
+            delivery_tag=delivery_tag,
+            redelivered=redelivered,
+            exchange=exchange,
+            routing_key=routing_key,
+        )
+        self.connection._post(
+            lambda: consumer.callback(self, method, properties, body)
+            if self.is_open
+            else None
+        )
+
+    def _close(self) -> None:
+        # Com o lock do servidor: as entregas não confirmadas voltam para as filas
+        if not self.is_open:
+            return
+
+        self.is_open = False
+
+        for consumer in self._consumers.values():
+            for queue in self._server._queues.values():
+                if consumer in queue.consumers:
+                    queue.consumers.remove(consumer)
+
+        entries = [self._unacked[tag] for tag in sorted(self._unacked)]
+        self._unacked.clear()
+        self._release(entries, requeue=True)
+
+    def close(self) -> None:
+        with self._server._lock:
+            self._close()
+
+
+class MemoryConnection:
+    def __init__(self, server: MemoryServer):
+        self._server = server
+        self._channels: list[MemoryChannel] = []
+        self._condition = threading.Condition()
+        self._events: deque[Callable[[], None]] = deque()
+        self._timers: list[tuple[float, int, list]] = []
+        self._sequence = itertools.count()
+        self.is_open = True
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def channel(self) -> MemoryChannel:
+        with self._server._lock:
+            channel = MemoryChannel(self)
+            self._channels.append(channel)
+
+        return channel
+
+    def _post(self, callback: Callable[[], None]) -> None:
+        with self._condition:
+            self._events.append(callback)
+            self._condition.notify()
+
+    def _wake(self) -> None:
+        with self._condition:
+            self._condition.notify()
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        if not self.is_open:
+            raise ConnectionWrongStateError("Connection is closed.")
+
+        self._post(callback)
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> list:
+        # O identificador é a própria entrada do temporizador, para remove_timeout
+        timer = [callback]
+
+        with self._condition:
+            heapq.heappush(
+                self._timers, (time.monotonic() + delay, next(self._sequence), timer)
+            )
+            self._condition.notify()
+
+        return timer
+
+    def remove_timeout(self, timer: list) -> None:
+        timer[0] = None
+
+    def process_data_events(self, time_limit: float | None = 0) -> None:
+        # Espera até haver eventos ou vencer o time_limit (None espera o próximo
+        # evento), e executa todos os eventos e temporizadores prontos
+        if not self.is_open:
+            raise ConnectionWrongStateError("Connection is closed.")
+
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+
+        with self._condition:
+            while not self._events and not self._server.stopped:
+                now = time.monotonic()
+                wake = self._timers[0][0] if self._timers else None
+
+                if wake is not None and wake <= now:
+                    break
+                if deadline is not None:
+                    wake = deadline if wake is None else min(wake, deadline)
+                    if deadline <= now:
+                        break
+
+                self._condition.wait(None if wake is None else wake - now)
+
+            events, self._events = self._events, deque()
+
+            due = []
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[2][0])
+
+        if self._server.stopped:
+            self.close()
+            raise ServerStopped()
+
+        for callback in due:
+            if callback is not None:
+                callback()
+
+        for callback in events:
+            callback()
+
+    def close(self) -> None:
+        if not self.is_open:
+            return
+
+        self.is_open = False
+
+        with self._server._lock:
+            self._server._close_connection(self)
@@ -0,0 +1,306 @@
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+# Métricas dos serviços: histogramas de tempo, contadores e medidores, em um registro
+# por processo (REGISTRY).
+#
+# Os histogramas têm baldes logarítmicos em microssegundos, com 8 subdivisões por
+# potência de 2 (erro relativo de no máximo 12,5%). Registrar um valor custa um
+# cálculo de índice e um incremento, sem alocação. Os percentis são estimados pelo
+# meio do balde.
+#
+# As métricas podem ser expostas de três formas, configuradas pelo ambiente:
+# - METRICS_PORT: endpoint HTTP local (/metrics) no formato de texto do Prometheus.
+# - METRICS_DUMP_S: resumo impresso periodicamente no stdout.
+# - METRICS_TRACE: com 1, cada estágio medido de uma mensagem com trace id é impresso
+#   com o ID, para seguir um lance de ponta a ponta nos logs dos serviços.
+#
+# O trace id e o instante de envio de um lance vão nos headers da mensagem, e são
+# repassados pelo MS-Lance e pelo MS-Notificacao até o cliente.
+
+HEADER_TRACE_ID = "trace_id"
+HEADER_TRACE_START = "trace_start"
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_DUMP_S = float(os.environ.get("METRICS_DUMP_S", "0"))
+METRICS_TRACE = os.environ.get("METRICS_TRACE", "0") == "1"
+
+_SUB_BITS = 3
+_SUB_BUCKETS = 1 << _SUB_BITS
+# Até 2^40 µs (cerca de 12 dias)
+_MAX_BITS = 40
+_BUCKETS = (_MAX_BITS - _SUB_BITS + 1) * _SUB_BUCKETS
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def _bucket_index(us: int) -> int:
+    if us < _SUB_BUCKETS:
+        return max(us, 0)
+
+    shift = min(us.bit_length(), _MAX_BITS) - _SUB_BITS - 1
+    mantissa = min(us >> shift, 2 * _SUB_BUCKETS - 1)
+
+    return (shift + 1) * _SUB_BUCKETS + mantissa - _SUB_BUCKETS
+
+
+def _bucket_middle(index: int) -> float:
+    # Meio do balde, em segundos
+    if index < _SUB_BUCKETS:
+        return (index + 0.5) / 1e6
+
+    shift = index // _SUB_BUCKETS - 1
+    mantissa = index % _SUB_BUCKETS + _SUB_BUCKETS
+
+    return ((mantissa << shift) + (1 << shift) / 2) / 1e6
+
+
+class Histogram:
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+        self._buckets = [0] * _BUCKETS
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        index = _bucket_index(int(seconds * 1e6))
+
+        with self._lock:
+            self._buckets[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+            if seconds > self.max:
+                self.max = seconds
+
+    def record_since(self, start: float) -> float:
+        # start vem de time.perf_counter(); retorna a duração registrada
+        seconds = time.perf_counter() - start
+        self.record(seconds)
+        return seconds
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+
+            rank = max(1, round(q * self.count))
+            seen = 0
+
+            for index, count in enumerate(self._buckets):
+                seen += count
+
+                if seen >= rank:
+                    return min(_bucket_middle(index), self.max)
+
+        return self.max
+
+    def stats(self) -> dict[str, float]:
+        stats = {"count": self.count}
+
+        if self.count:
+            stats["mean_ms"] = self.sum / self.count * 1000
+            stats |= {f"p{q * 100:g}_ms": self.quantile(q) * 1000 for q in QUANTILES}
+            stats["max_ms"] = self.max * 1000
+
+        return stats
+
+
+class Counter:
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Registry:
+    def __init__(self):
+        self._histograms: dict[str, Histogram] = {}
+        self._counters: dict[str, Counter] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        # Retorna o histograma existente com o nome, ou cria um novo
+        with self._lock:
+            histogram = self._histograms.get(name)
+
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(name)
+
+        return histogram
+
+    def counter(self, name: str) -> Counter:
+        with self._lock:
+            counter = self._counters.get(name)
+
+            if counter is None:
+                counter = self._counters[name] = Counter(name)
+
+        return counter
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        # Medidor lido na hora da coleta (ex.: tamanho de uma fila interna)
+        with self._lock:
+            self._gauges[name] = read
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            histograms = list(self._histograms.values())
+            counters = list(self._counters.values())
+            gauges = list(self._gauges.items())
+
+        return {
+            "histograms": {h.name: h.stats() for h in histograms if h.count},
+            "counters": {c.name: c.value for c in counters},
+            "gauges": {name: _read_gauge(read) for name, read in gauges},
+        }
+
+    def render(self) -> str:
+        # Formato de texto do Prometheus; os histogramas saem como summaries
+        with self._lock:
+            histograms = list(self._histograms.values())
+            counters = list(self._counters.values())
+            gauges = list(self._gauges.items())
+
+        lines = []
+
+        for histogram in histograms:
+            lines.append(f"# TYPE {histogram.name} summary")
+
+            for q in QUANTILES:
+                lines.append(
+                    f'{histogram.name}{{quantile="{q}"}} {histogram.quantile(q):.6f}'
+                )
+
+            lines.append(f"{histogram.name}_sum {histogram.sum:.6f}")
+            lines.append(f"{histogram.name}_count {histogram.count}")
+
+        for counter in counters:
+            lines.append(f"# TYPE {counter.name} counter")
+            lines.append(f"{counter.name} {counter.value}")
+
+        for name, read in gauges:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_read_gauge(read)}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        # Resumo de uma linha por métrica, para o stdout
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, stats in snapshot["histograms"].items():
+            details = ", ".join(
+                f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}"
+                for key, value in stats.items()
+            )
+            lines.append(f"{name}: {details}")
+
+        for kind in ("counters", "gauges"):
+            for name, value in snapshot[kind].items():
+                lines.append(f"{name}: {value}")
+
+        return "\n".join(lines)
+
+
+def _read_gauge(read: Callable[[], float]) -> float:
+    # Um medidor que falha (ex.: estado já encerrado) não derruba a coleta
+    try:
+        return read()
+    except Exception:
+        return float("nan")
+
+
+REGISTRY = Registry()
+
+
+# Exposição
+
+
+def start_exporter(service: str, registry: Registry = REGISTRY) -> None:
+    # Inicia o endpoint HTTP e o resumo periódico configurados no ambiente
+    if METRICS_PORT > 0:
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f"[{service}] Métricas em http://127.0.0.1:{METRICS_PORT}/metrics")
+
+    if METRICS_DUMP_S > 0:
+
+        def dump():
+            while True:
+                time.sleep(METRICS_DUMP_S)
+                print(f"[{service}] Métricas:\n{registry.summary()}")
+
+        threading.Thread(target=dump, daemon=True).start()
+
+
+# Rastreamento
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def trace_headers(trace_id: str | None = None) -> dict[str, object]:
+    # Headers de um lance novo: o trace id e o instante de envio (relógio de parede)
+    return {
+        HEADER_TRACE_ID: trace_id or new_trace_id(),
+        HEADER_TRACE_START: time.time(),
+    }
+
+
+def trace_of(headers: dict | None) -> dict[str, object]:
+    # Os headers de rastreamento de uma mensagem recebida, para repassar adiante
+    if not headers:
+        return {}
+
+    return {
+        key: headers[key]
+        for key in (HEADER_TRACE_ID, HEADER_TRACE_START)
+        if key in headers
+    }
+
+
+def trace_log(trace: dict | None, stage: str, seconds: float) -> None:
+    if METRICS_TRACE and trace and HEADER_TRACE_ID in trace:
+        print(f"[Trace] {trace[HEADER_TRACE_ID]} {stage} {seconds * 1000:.3f}ms")
+
+
+def trace_age(trace: dict | None) -> float | None:
+    # Tempo desde o envio do lance (depende dos relógios das máquinas)
+    if not trace or HEADER_TRACE_START not in trace:
+        return None
+
+    return time.time() - float(trace[HEADER_TRACE_START])
@@ -0,0 +1,151 @@
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, InvalidStateError
+from functools import partial
+from typing import Any, Callable
+
+from common.keys import PublicKeyCache
+
+# Resultados da verificação de um lance
+VERIFY_OK = "ok"
+VERIFY_NO_KEY = "sem_chave"
+VERIFY_INVALID = "invalida"
+
+# Cache de chaves do worker. Em um pool de processos cada processo possui o seu;
+# em um pool de threads ele é compartilhado (o cache é protegido por lock).
+_worker_cache: PublicKeyCache | None = None
+
+
+def init_worker(max_size: int) -> None:
+    global _worker_cache
+
+    if _worker_cache is None:
+        _worker_cache = PublicKeyCache(max_size)
+
+
+def worker_cache() -> PublicKeyCache | None:
+    return _worker_cache
+
+
+# Estágios medidos no worker: ((estágio, segundos), ...). Voltam junto do resultado
+# para serem registrados nas métricas do processo do consumidor, mesmo com um pool
+# de processos.
+Timings = tuple[tuple[str, float], ...]
+
+
+def verify_lance(
+    user_id: str, public_key: bytes, signature: bytes, message: bytes
+) -> tuple[str, Timings]:
+    # Executado dentro do pool, portanto não pode lançar exceções para o consumidor.
+    # A chave (DER) vem do índice de chaves do consumidor junto de cada lance.
+    timings = []
+    verify = _worker_cache.get(user_id, public_key, timings)
+
+    if verify is None:
+        return VERIFY_INVALID, tuple(timings)
+
+    start = time.perf_counter()
+
+    try:
+        valid = verify(signature, message)
+    except (TypeError, ValueError):
+        valid = False
+
+    timings.append(("verificacao", time.perf_counter() - start))
+
+    return VERIFY_OK if valid else VERIFY_INVALID, tuple(timings)
+
+
+# Distribui o trabalho pesado (verificação de assinaturas) em um pool, mas entrega os
+# resultados na ordem de chegada de cada chave (ID do leilão). Eventos sem trabalho
+# (início e fim do leilão) entram na mesma fila, para que um leilao_finalizado nunca
+# seja aplicado antes de um lance que chegou antes dele.
+#
+# `schedule` deve executar a função recebida na thread do consumidor (por exemplo
+# `connection.add_callback_threadsafe`); todos os `on_done` rodam nessa thread.
+class OrderedPipeline:
+    def __init__(
+        self, executor: Executor, schedule: Callable[[Callable[[], None]], None]
+    ):
+        self._executor = executor
+        self._schedule = schedule
+        self._queues: dict[str, deque[tuple[Future, Callable[[Any], None]]]] = {}
+        self.pending = 0
+
+    def submit(
+        self,
+        key: str,
+        on_done: Callable[[Any], None],
+        fn: Callable[..., Any] | None = None,
+        *args,
+    ) -> None:
+        if fn is None:
+            future = Future()
+            future.set_result(None)
+        else:
+            future = self._executor.submit(fn, *args)
+
+        self._enqueue(key, future, on_done)
+
+        if fn is None:
+            self._drain(key)
+        else:
+            future.add_done_callback(
+                lambda _: self._schedule(partial(self._drain, key))
+            )
+
+    def hold(self, key: str, on_done: Callable[[Any], None]) -> Future:
+        # Reserva a vez de um evento cujo trabalho ainda não pode começar (ex.: um
+        # lance cuja chave não chegou). Os eventos seguintes da chave esperam até o
+        # Future retornado ser concluído, com resolve ou com set_result.
+        future = Future()
+        self._enqueue(key, future, on_done)
+        future.add_done_callback(lambda _: self._schedule(partial(self._drain, key)))
+
+        return future
+
+    def resolve(self, future: Future, fn: Callable[..., Any], *args) -> None:
+        # Executa no pool o trabalho de um evento reservado com hold
+        def copy(work: Future) -> None:
+            try:
+                if work.exception() is not None:
+                    future.set_exception(work.exception())
+                else:
+                    future.set_result(work.result())
+            except InvalidStateError:
+                # O evento já foi concluído de outra forma (ex.: expirou)
+                pass
+
+        self._executor.submit(fn, *args).add_done_callback(copy)
+
+    def _enqueue(
+        self, key: str, future: Future, on_done: Callable[[Any], None]
+    ) -> None:
+        queue = self._queues.get(key)
+
+        if queue is None:
+            queue = self._queues[key] = deque()
+
+        queue.append((future, on_done))
+        self.pending += 1
+
+    def _drain(self, key: str) -> None:
+        queue = self._queues.get(key)
+
+        while queue and queue[0][0].done():
+            future, on_done = queue.popleft()
+            self.pending -= 1
+
+            # Uma falha no pool (ex.: processo morto) é entregue como resultado
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+
+            on_done(result)
+
+        if queue is not None and not queue:
+            del self._queues[key]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,114 @@
+import heapq
+from datetime import datetime
+
+from common.serial import Leilao
+
+# Agenda de início e fim dos leilões em um min-heap de prazos.
+#
+# Cada leilão gera dois eventos no heap: (prazo, tipo, id, geração). Cancelar um
+# leilão só o remove do dicionário; os eventos dele ficam no heap e são descartados
+# quando chegam ao topo (remoção preguiçosa). A geração evita que eventos de um
+# leilão cancelado disparem para um leilão readicionado com o mesmo ID. Os leilões já
+# iniciados ficam em um conjunto, para que quem cancela saiba se precisa finalizá-lo.
+#
+# Não é thread-safe: alterações vindas de outras threads devem ser executadas na
+# thread do laço (ex.: connection.add_callback_threadsafe).
+
+START = 0
+END = 1
+_KIND_NAMES = {START: "inicio", END: "fim"}
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, int, str, int]] = []
+        # id -> (leilão, geração)
+        self._leiloes: dict[str, tuple[Leilao, int]] = {}
+        self._generation = 0
+        self._started: set[str] = set()
+
+    def _entries(self, leilao: Leilao) -> tuple[tuple, tuple]:
+        self._generation += 1
+        self._leiloes[leilao.id] = (leilao, self._generation)
+        self._started.discard(leilao.id)
+
+        return (
+            (leilao.start.timestamp(), START, leilao.id, self._generation),
+            (leilao.end.timestamp(), END, leilao.id, self._generation),
+        )
+
+    def add(self, leilao: Leilao) -> None:
+        for entry in self._entries(leilao):
+            heapq.heappush(self._heap, entry)
+
+    def add_many(self, leiloes) -> int:
+        # Para lotes grandes em relação ao heap é mais barato estender a lista e refazer
+        # o heap (O(n)); lotes pequenos são inseridos um a um (O(k log n))
+        # O lote é materializado antes, para que um erro de leitura não deixe leilões
+        # registrados sem eventos no heap
+        leiloes = list(leiloes)
+        entries = [entry for leilao in leiloes for entry in self._entries(leilao)]
+
+        if len(entries) >= len(self._heap):
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+        return len(leiloes)
+
+    def cancel(self, leilao_id: str) -> tuple[Leilao, bool] | None:
+        # Retorna o leilão cancelado e se ele já tinha sido iniciado
+        entry = self._leiloes.pop(leilao_id, None)
+
+        if entry is None:
+            return None
+
+        started = leilao_id in self._started
+        self._started.discard(leilao_id)
+
+        return entry[0], started
+
+    def _is_stale(self, entry: tuple[float, int, str, int]) -> bool:
+        current = self._leiloes.get(entry[2])
+        return current is None or current[1] != entry[3]
+
+    def next_deadline(self) -> float | None:
+        heap = self._heap
+
+        while heap and self._is_stale(heap[0]):
+            heapq.heappop(heap)
+
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now: datetime) -> list[tuple[str, Leilao]]:
+        # Retorna todos os eventos vencidos, em ordem de prazo
+        now_ts = now.timestamp()
+        heap = self._heap
+        due: list[tuple[str, Leilao]] = []
+
+        while heap and heap[0][0] <= now_ts:
+            entry = heapq.heappop(heap)
+
+            if self._is_stale(entry):
+                continue
+
+            leilao = self._leiloes[entry[2]][0]
+
+            if entry[1] == END:
+                del self._leiloes[entry[2]]
+                self._started.discard(entry[2])
+            else:
+                self._started.add(entry[2])
+
+            due.append((_KIND_NAMES[entry[1]], leilao))
+
+        return due
+
+    def __len__(self) -> int:
+        # Leilões que ainda vão iniciar ou finalizar
+        return len(self._leiloes)
+
+    def __contains__(self, leilao_id: str) -> bool:
+        return leilao_id in self._leiloes
@@ -1,6 +1,10 @@
+import base64
+import binascii
 import json
+import struct
 from datetime import datetime
 
+
 def serialize_dict(d: dict) -> bytes:
     return json.dumps(d).encode("utf-8")
 
@@ -9,52 +13,422 @@ def deserialize_dict(b: bytes) -> dict:
     return json.loads(b.decode("utf-8"))
 
 
-def serialize_leilao(leilao: dict[str, str | datetime]) -> bytes:
-    # Verifica se as chaves existem
-    assert "id" in leilao, "Key 'id' does not exist in the dictionary."
-    assert (
-        "description" in leilao
-    ), "Key 'description' does not exist in the dictionary."
-    assert "start" in leilao, "Key 'start' does not exist in the dictionary."
-    assert "end" in leilao, "Key 'end' does not exist in the dictionary."
-
-    # Verifica os tipos
-    assert isinstance(leilao["id"], str), "Key 'id' must be a string."
-    assert isinstance(leilao["description"], str), "Key 'description' must be a string."
-    assert isinstance(leilao["start"], datetime), "Key 'start' must be a datetime."
-    assert isinstance(leilao["end"], datetime), "Key 'end' must be a datetime."
-
-    el = leilao.copy()
-
-    # Converte datetime.datetime para número
-    el["start"] = el["start"].timestamp()
-    el["end"] = el["end"].timestamp()
-
-    # Serializa um JSON para uma lista de bytes
-    serialized = json.dumps(el).encode("utf-8")
-    return serialized
-
-
-def deserialize_leilao(leilao: bytes) -> dict[str, str | datetime]:
-    dict_el = json.loads(leilao.decode("utf-8"))
-
-    # Verifica se as chaves existem
-    assert "id" in dict_el, "Key 'id' does not exist in the dictionary."
-    assert (
-        "description" in dict_el
-    ), "Key 'description' does not exist in the dictionary."
-    assert "start" in dict_el, "Key 'start' does not exist in the dictionary."
-    assert "end" in dict_el, "Key 'end' does not exist in the dictionary."
-
-    # Verifica os tipos
-    assert isinstance(dict_el["id"], str), "Key 'id' must be a string."
-    assert isinstance(
-        dict_el["description"], str
-    ), "Key 'description' must be a string."
-    assert isinstance(dict_el["start"], float), "Key 'start' must be a float."
-    assert isinstance(dict_el["end"], float), "Key 'end' must be a float."
-
-    # Converte número para datetime.datetime
-    dict_el["start"] = datetime.fromtimestamp(dict_el["start"])
-    dict_el["end"] = datetime.fromtimestamp(dict_el["end"])
-    return dict_el
+# Eventos trocados entre os serviços, em registros com __slots__ (sem o __dict__ de
+# cada instância). Os campos de cada evento ficam em FIELDS (nome -> tipo), e a partir
+# deles são gerados, uma vez por classe, o __init__ que valida os tipos e as
+# conversões de/para o JSON. A validação lança ValueError e roda também com
+# `python -O`, ao contrário de um assert.
+#
+# No JSON as datas são timestamps e os bytes vão em base64.
+_CHECKS = {
+    str: "type({name}) is not str",
+    int: "type({name}) is not int",
+    bytes: "type({name}) is not bytes",
+    datetime: "not isinstance({name}, datetime)",
+}
+_TO_JSON = {
+    datetime: "self.{name}.timestamp()",
+    bytes: "base64.b64encode(self.{name}).decode()",
+}
+_FROM_JSON = {
+    datetime: "datetime.fromtimestamp(d[{name!r}])",
+    bytes: "base64.b64decode(d[{name!r}])",
+}
+
+
+def _compile(source: str, name: str):
+    namespace = {}
+    exec(source, {"datetime": datetime, "base64": base64}, namespace)
+    return namespace[name]
+
+
+class Record:
+    __slots__ = ()
+
+    KIND: str = ""
+    FIELDS: dict[str, type] = {}
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+
+        names = tuple(cls.FIELDS)
+        init = [f"def __init__(self, {', '.join(names)}):"]
+        for name, kind in cls.FIELDS.items():
+            check = _CHECKS[kind].format(name=name)
+            message = f"Field '{name}' of '{cls.KIND}' must be {kind.__name__}."
+            init.append(f"    if {check}: raise ValueError({message!r})")
+            init.append(f"    self.{name} = {name}")
+        cls.__init__ = _compile("\n".join(init), "__init__")
+
+        fields = ", ".join(
+            f"{name!r}: " + _TO_JSON.get(kind, "self.{name}").format(name=name)
+            for name, kind in cls.FIELDS.items()
+        )
+        cls.to_json = _compile(
+            f"def to_json(self):\n    return {{{fields}}}", "to_json"
+        )
+
+        arguments = ", ".join(
+            _FROM_JSON.get(kind, "d[{name!r}]").format(name=name)
+            for name, kind in cls.FIELDS.items()
+        )
+        cls._from_json = _compile(
+            f"def _from_json(cls, d):\n    return cls({arguments})", "_from_json"
+        )
+
+    @classmethod
+    def from_json(cls, d: dict) -> "Record":
+        # Campos a mais (ex.: "type") são ignorados
+        try:
+            return cls._from_json(cls, d)
+        except (KeyError, TypeError, OverflowError, binascii.Error) as e:
+            raise ValueError(f"Invalid '{cls.KIND}' event: {e!r}.") from e
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.FIELDS
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+
+class Leilao(Record):
+    __slots__ = ("id", "description", "start", "end")
+
+    KIND = "leilao"
+    FIELDS = {"id": str, "description": str, "start": datetime, "end": datetime}
+
+
+class Lance(Record):
+    __slots__ = ("user_id", "leilao_id", "value")
+
+    KIND = "lance"
+    FIELDS = {"user_id": str, "leilao_id": str, "value": str}
+
+
+class LanceValidado(Record):
+    __slots__ = ("user_id", "leilao_id", "value")
+
+    KIND = "lance_validado"
+    FIELDS = {"user_id": str, "leilao_id": str, "value": str}
+
+
+class LanceAgregado(Record):
+    # Lances validados agregados pelo MS-Notificacao: o mais recente (maior) e
+    # quantos foram agregados nele
+    __slots__ = ("user_id", "leilao_id", "value", "count")
+
+    KIND = "lance_agregado"
+    FIELDS = {"user_id": str, "leilao_id": str, "value": str, "count": int}
+
+
+class LeilaoVencedor(Record):
+    __slots__ = ("leilao_id", "lance_vencedor", "cliente_vencedor")
+
+    KIND = "leilao_vencedor"
+    FIELDS = {"leilao_id": str, "lance_vencedor": str, "cliente_vencedor": str}
+
+
+class ChavePublica(Record):
+    # Registro da chave pública (DER) de um usuário
+    __slots__ = ("user_id", "public_key")
+
+    KIND = "chave"
+    FIELDS = {"user_id": str, "public_key": bytes}
+
+
+RECORDS: dict[str, type[Record]] = {
+    record.KIND: record
+    for record in (
+        Leilao,
+        Lance,
+        LanceValidado,
+        LanceAgregado,
+        LeilaoVencedor,
+        ChavePublica,
+    )
+}
+
+
+def serialize_leilao(leilao: Leilao) -> bytes:
+    return serialize_dict(leilao.to_json())
+
+
+def deserialize_leilao(leilao: bytes) -> Leilao:
+    return Leilao.from_json(deserialize_dict(leilao))
+
+
+# Formato binário versionado dos eventos. O tipo de conteúdo vai na propriedade
+# content_type da mensagem AMQP; mensagens sem ela (ou em JSON) usam o formato antigo.
+#
+# Cabeçalho: versão (u8) + tipo do evento (u8). IDs (uuid4 em hexadecimal) ocupam 16
+# bytes, datas são timestamps em float64 e textos/assinaturas têm tamanho em u16.
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/x-leilao"
+WIRE_VERSION = 1
+
+_HEADER = struct.Struct(">BB")
+_ID = struct.Struct(">16s")
+_TIMESTAMPS = struct.Struct(">dd")
+_LENGTH = struct.Struct(">H")
+_COUNT = struct.Struct(">I")
+
+EVENT_KINDS = {
+    "leilao": 1,
+    "lance": 2,
+    "lance_validado": 3,
+    "leilao_vencedor": 4,
+    "lance_assinado": 5,
+    "lance_agregado": 6,
+    "chave": 7,
+}
+_KIND_NAMES = {code: kind for kind, code in EVENT_KINDS.items()}
+
+# Os eventos publicados pelo MS-Lance levam o tipo na propriedade `type` da mensagem
+# AMQP e o ID do leilão neste cabeçalho, para que o MS-Notificacao os encaminhe sem
+# decodificar o corpo
+HEADER_LEILAO_ID = "leilao_id"
+
+
+def _pack_id(id: str) -> bytes:
+    # Só a forma canônica (hex minúsculo, como o uuid4().hex) volta igual da
+    # decodificação; outros IDs seguem em JSON (encode_event), para que o ID usado na
+    # partição e nas filas seja o mesmo em todos os eventos
+    data = bytes.fromhex(id) if len(id) == 32 else b""
+
+    if data.hex() != id:
+        raise ValueError(f"Id '{id}' is not a 32 digit lowercase hex string.")
+
+    return data
+
+
+def _pack_bytes(data: bytes) -> bytes:
+    return _LENGTH.pack(len(data)) + data
+
+
+def _unpack_bytes(body: bytes, offset: int) -> tuple[bytes, int]:
+    (length,) = _LENGTH.unpack_from(body, offset)
+    offset += _LENGTH.size
+    data = body[offset : offset + length]
+
+    if len(data) != length:
+        raise ValueError("Truncated message.")
+
+    return data, offset + length
+
+
+def _unpack_id(body: bytes, offset: int) -> tuple[str, int]:
+    (raw,) = _ID.unpack_from(body, offset)
+    return raw.hex(), offset + _ID.size
+
+
+def _encode_binary(event: Record) -> bytes:
+    header = _HEADER.pack(WIRE_VERSION, EVENT_KINDS[event.KIND])
+    kind = type(event)
+
+    if kind is Leilao:
+        return b"".join(
+            (
+                header,
+                _pack_id(event.id),
+                _TIMESTAMPS.pack(event.start.timestamp(), event.end.timestamp()),
+                _pack_bytes(event.description.encode("utf-8")),
+            )
+        )
+
+    if kind is Lance or kind is LanceValidado:
+        return b"".join(
+            (
+                header,
+                _pack_id(event.user_id),
+                _pack_id(event.leilao_id),
+                _pack_bytes(event.value.encode("utf-8")),
+            )
+        )
+
+    if kind is LanceAgregado:
+        return b"".join(
+            (
+                header,
+                _pack_id(event.user_id),
+                _pack_id(event.leilao_id),
+                _pack_bytes(event.value.encode("utf-8")),
+                _COUNT.pack(event.count),
+            )
+        )
+
+    if kind is ChavePublica:
+        return b"".join(
+            (header, _pack_id(event.user_id), _pack_bytes(event.public_key))
+        )
+
+    if kind is LeilaoVencedor:
+        return b"".join(
+            (
+                header,
+                _pack_id(event.leilao_id),
+                _pack_id(event.cliente_vencedor),
+                _pack_bytes(event.lance_vencedor.encode("utf-8")),
+            )
+        )
+
+    raise ValueError(f"Unknown event kind '{event.KIND}'.")
+
+
+def _decode_binary(body: bytes) -> Record:
+    version, code = _HEADER.unpack_from(body, 0)
+
+    if version != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire version {version}.")
+    if code not in _KIND_NAMES:
+        raise ValueError(f"Unknown event kind code {code}.")
+
+    kind = _KIND_NAMES[code]
+    offset = _HEADER.size
+
+    if kind == "leilao":
+        id, offset = _unpack_id(body, offset)
+        start, end = _TIMESTAMPS.unpack_from(body, offset)
+        description, offset = _unpack_bytes(body, offset + _TIMESTAMPS.size)
+
+        return Leilao(
+            id,
+            description.decode("utf-8"),
+            datetime.fromtimestamp(start),
+            datetime.fromtimestamp(end),
+        )
+
+    if kind == "lance_assinado":
+        raise ValueError("Signed envelopes must be read with decode_signed.")
+
+    if kind == "chave":
+        user_id, offset = _unpack_id(body, offset)
+        public_key, offset = _unpack_bytes(body, offset)
+
+        return ChavePublica(user_id, public_key)
+
+    if kind == "leilao_vencedor":
+        leilao_id, offset = _unpack_id(body, offset)
+        cliente_vencedor, offset = _unpack_id(body, offset)
+        lance_vencedor, offset = _unpack_bytes(body, offset)
+
+        return LeilaoVencedor(
+            leilao_id, lance_vencedor.decode("utf-8"), cliente_vencedor
+        )
+
+    # lance, lance_validado e lance_agregado
+    user_id, offset = _unpack_id(body, offset)
+    leilao_id, offset = _unpack_id(body, offset)
+    value, offset = _unpack_bytes(body, offset)
+    value = value.decode("utf-8")
+
+    if kind == "lance_agregado":
+        (count,) = _COUNT.unpack_from(body, offset)
+        return LanceAgregado(user_id, leilao_id, value, count)
+
+    return RECORDS[kind](user_id, leilao_id, value)
+
+
+def encode_event(event: Record, binary: bool = True) -> tuple[bytes, str]:
+    # Retorna o corpo e o content_type. Eventos que não cabem no formato binário
+    # (ex.: um ID que não é uuid4, como o vencedor "ninguem") seguem em JSON.
+    if binary:
+        try:
+            return _encode_binary(event), CONTENT_TYPE_BINARY
+        except (ValueError, struct.error):
+            pass
+
+    return serialize_dict(event.to_json()), CONTENT_TYPE_JSON
+
+
+def decode_event(kind: str, body: bytes, content_type: str | None) -> Record:
+    # Lança ValueError (ou struct.error, no formato binário) se o corpo não for um
+    # evento `kind` válido
+    if content_type == CONTENT_TYPE_BINARY:
+        event = _decode_binary(body)
+
+        if event.KIND != kind:
+            raise ValueError(f"Expected a '{kind}' event, got '{event.KIND}'.")
+
+        return event
+
+    record = RECORDS.get(kind)
+
+    if record is None:
+        raise ValueError(f"Unknown event kind '{kind}'.")
+
+    return record.from_json(deserialize_dict(body))
+
+
+def encode_typed_json(event: Record) -> bytes:
+    # JSON com o tipo do evento na chave "type", para mensagens cujo tipo não é
+    # conhecido pela routing key (ex.: leilao_{id})
+    return serialize_dict(event.to_json() | {"type": event.KIND})
+
+
+def decode_typed_event(body: bytes, content_type: str | None) -> Record:
+    # No formato binário o tipo vem no cabeçalho; em JSON, na chave "type"
+    if content_type == CONTENT_TYPE_BINARY:
+        return _decode_binary(body)
+
+    event = deserialize_dict(body)
+
+    if not isinstance(event, dict):
+        raise ValueError("Event must be a JSON object.")
+
+    kind = event.get("type")
+    record = RECORDS.get(kind) if isinstance(kind, str) else None
+
+    if record is None:
+        raise ValueError(f"Unknown event kind '{kind}'.")
+
+    return record.from_json(event)
+
+
+# Envelope de um lance assinado: carrega exatamente os bytes que foram assinados
+# (o evento "lance" já codificado) e a assinatura destacada. Quem verifica não
+# precisa reconstruir a mensagem, basta verificar o payload e decodificá-lo uma vez.
+# O payload usa o mesmo formato (content_type) do envelope.
+def encode_signed(payload: bytes, signature: bytes, content_type: str) -> bytes:
+    if content_type == CONTENT_TYPE_BINARY:
+        return b"".join(
+            (
+                _HEADER.pack(WIRE_VERSION, EVENT_KINDS["lance_assinado"]),
+                _pack_bytes(payload),
+                _pack_bytes(signature),
+            )
+        )
+
+    return serialize_dict(
+        {
+            "payload": payload.decode("utf-8"),
+            "signature": base64.b64encode(signature).decode("utf-8"),
+        }
+    )
+
+
+def decode_signed(body: bytes, content_type: str | None) -> tuple[bytes, bytes]:
+    if content_type == CONTENT_TYPE_BINARY:
+        version, code = _HEADER.unpack_from(body, 0)
+
+        if version != WIRE_VERSION:
+            raise ValueError(f"Unsupported wire version {version}.")
+        if code != EVENT_KINDS["lance_assinado"]:
+            raise ValueError("Message is not a signed envelope.")
+
+        payload, offset = _unpack_bytes(body, _HEADER.size)
+        signature, offset = _unpack_bytes(body, offset)
+        return payload, signature
+
+    envelope = deserialize_dict(body)
+
+    if (
+        not isinstance(envelope, dict)
+        or not isinstance(envelope.get("payload"), str)
+        or not isinstance(envelope.get("signature"), str)
+    ):
+        raise ValueError("Signed envelope must have str 'payload' and 'signature'.")
+
+    return envelope["payload"].encode("utf-8"), base64.b64decode(envelope["signature"])
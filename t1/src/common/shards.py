@@ -0,0 +1,192 @@
+import hashlib
+import os
+import uuid
+import zlib
+
+from common.store import LeilaoStore
+from common.wal import WriteAheadLog
+
+# Particionamento do MS-Lance por ID de leilão.
+#
+# Os eventos que o MS-Lance consome (lance_realizado, leilao_iniciado e
+# leilao_finalizado) são publicados também com a routing key "<evento>.<partição>",
+# e cada partição tem uma fila própria (ms_lance.p<partição>). Assim todos os eventos
+# de um leilão chegam, em ordem, na mesma fila.
+#
+# Cada fila usa single active consumer: todas as instâncias do MS-Lance consomem
+# todas as filas, mas o broker entrega cada fila a uma só instância por vez. A
+# instância ativa é a de maior prioridade (x-priority), e a prioridade de cada
+# instância em cada partição vem de um hash de rendezvous (instância, partição). Com
+# isso as partições se distribuem entre as instâncias, e quando uma instância entra
+# ou sai o broker move apenas as partições em que ela tem (ou tinha) a maior
+# prioridade. A troca para uma instância que entrou só acontece depois que a anterior
+# confirma as mensagens que recebeu.
+#
+# PARTITIONS precisa ser o mesmo em todos os serviços e não pode mudar com filas
+# já existentes.
+PARTITIONS = 16
+
+QUEUE_PREFIX = "ms_lance.p"
+PARTITIONED_EVENTS = ("lance_realizado", "leilao_iniciado", "leilao_finalizado")
+
+# Filas quorum: sobrevivem a reinícios do broker e suportam single active consumer
+# com prioridade de consumidores (RabbitMQ 3.13+)
+QUEUE_ARGUMENTS = {"x-queue-type": "quorum", "x-single-active-consumer": True}
+
+
+def partition_of(leilao_id: str) -> int:
+    return zlib.crc32(leilao_id.encode("utf-8")) % PARTITIONS
+
+
+def partition_routing_key(routing_key: str, leilao_id: str) -> str:
+    return f"{routing_key}.{partition_of(leilao_id)}"
+
+
+def split_routing_key(routing_key: str) -> tuple[str, int | None]:
+    # "lance_realizado.3" -> ("lance_realizado", 3)
+    event, _, partition = routing_key.rpartition(".")
+
+    if not event or not partition.isdigit():
+        return routing_key, None
+
+    return event, int(partition)
+
+
+def partition_queue(partition: int) -> str:
+    return f"{QUEUE_PREFIX}{partition}"
+
+
+def consumer_priority(instance_id: str, partition: int) -> int:
+    # Peso do rendezvous hashing, limitado ao intervalo positivo do x-priority
+    digest = hashlib.blake2b(
+        f"{instance_id}:{partition}".encode("utf-8"), digest_size=4
+    ).digest()
+
+    return int.from_bytes(digest, "big") & 0x7FFFFFFF
+
+
+class Shard:
+    # Estado de uma partição no MS-Lance: os leilões dela e o seu log de estado, em
+    # <diretório>/p<partição>. Para que o estado acompanhe a partição quando ela muda
+    # de instância, o diretório precisa ser compartilhado entre as instâncias (mesma
+    # máquina ou volume compartilhado). Sem diretório o estado fica só em memória.
+    #
+    # A instância que recebe eventos de uma partição grava o seu ID no arquivo "owner"
+    # do diretório. Se o arquivo mudou desde a última carga, outra instância foi dona
+    # da partição nesse meio tempo, e o estado em memória é recarregado do log.
+    #
+    # O arquivo não é conferido a cada entrega. O broker só passa a partição para
+    # outra instância depois que a atual confirma todas as entregas dela (ou perde a
+    # conexão), então a partição só pode ter mudado de dono se a entrega chega quando
+    # esta instância não tem nenhuma outra da partição em andamento. `begin` e `end`
+    # contam as entregas em andamento, e `reset` (a cada nova conexão) força a
+    # conferência na próxima entrega.
+    def __init__(
+        self,
+        partition: int,
+        instance_id: str,
+        directory: str | None = None,
+        snapshot_every: int = 100_000,
+        fsync: bool = True,
+        min_increment: int = 1,
+        reserve: int = 0,
+        retain_bids: int = 0,
+    ):
+        self.partition = partition
+        self.instance_id = instance_id
+        self.directory = (
+            os.path.join(directory, f"p{partition}") if directory is not None else None
+        )
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        # Regras dos lances e retenção do histórico dos leilões encerrados (LeilaoStore)
+        self.min_increment = min_increment
+        self.reserve = reserve
+        self.retain_bids = retain_bids
+
+        self.leiloes = self._new_store()
+        self.log: WriteAheadLog | None = None
+        self.loads = 0
+        self.in_flight = 0
+
+        # (inode, mtime) do arquivo "owner" gravado por esta instância
+        self._owner: tuple[int, int] | None = None
+
+    def _new_store(self) -> LeilaoStore:
+        return LeilaoStore(self.min_increment, self.reserve, self.retain_bids)
+
+    def _owner_path(self) -> str:
+        return os.path.join(self.directory, "owner")
+
+    def _read_owner(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self._owner_path())
+        except FileNotFoundError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns
+
+    def begin(self) -> None:
+        # Chamado a cada entrega da partição, antes de aplicá-la
+        if self.in_flight == 0:
+            self.ensure_owned()
+
+        self.in_flight += 1
+
+    def end(self) -> None:
+        # A entrega foi aplicada (ou descartada). Entregas de uma conexão anterior
+        # podem terminar depois do reset; contar a menos só antecipa a conferência
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def reset(self) -> None:
+        # As entregas em andamento na conexão anterior voltaram para a fila
+        self.in_flight = 0
+
+    def ensure_owned(self) -> bool:
+        # Retorna True se o estado foi (re)carregado do log
+        if self.directory is None:
+            return False
+        if self.log is not None and self._read_owner() == self._owner:
+            return False
+
+        self._load()
+        return True
+
+    def _load(self) -> None:
+        # Registros não gravados pertencem a entregas que não foram confirmadas, e
+        # que o broker já entregou para a outra instância
+        if self.log is not None:
+            self.log.close(commit=False)
+
+        self.leiloes = self._new_store()
+        self.log = WriteAheadLog(self.directory, self.snapshot_every, self.fsync)
+        replayed = self.log.recover(self.leiloes)
+
+        # Um arquivo novo a cada carga (tmp + rename) muda o inode, mesmo que o mtime
+        # não mude
+        tmp_path = f"{self._owner_path()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.instance_id)
+
+        os.replace(tmp_path, self._owner_path())
+        self._owner = self._read_owner()
+        self.loads += 1
+
+        print(
+            f"[Shard {self.partition}] Estado carregado: {len(self.leiloes)} leilões, {replayed} registros reaplicados."
+        )
+
+    def sync(self) -> None:
+        # Commit em grupo do log e, de tempos em tempos, um snapshot
+        if self.log is None:
+            return
+
+        self.log.commit()
+        self.log.maybe_snapshot(self.leiloes)
+
+    def close(self) -> None:
+        if self.log is None:
+            return
+
+        self.log.close()
+        self.log = None
@@ -0,0 +1,100 @@
+import hashlib
+from typing import Callable
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+# Algoritmos de assinatura dos lances. "ed25519" é bem mais rápido para gerar chaves,
+# assinar e verificar; "rsa" (RSA-PSS/SHA-256, 2048 bits) é o formato original.
+SIGNATURE_ALGORITHMS = ("ed25519", "rsa")
+
+_PSS = padding.PSS(
+    mgf=padding.MGF1(hashes.SHA256()),
+    salt_length=padding.PSS.MAX_LENGTH,
+)
+
+
+def generate_private_key(algorithm: str):
+    if algorithm == "ed25519":
+        return ed25519.Ed25519PrivateKey.generate()
+
+    if algorithm == "rsa":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    raise ValueError(f"Unknown signature algorithm '{algorithm}'.")
+
+
+def public_key_pem(private_key) -> bytes:
+    # O mesmo formato (SubjectPublicKeyInfo) serve para ambos os algoritmos
+    return private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+
+
+def public_key_der(private_key) -> bytes:
+    # Formato compacto (DER) da chave pública, usado no registro de chaves
+    return private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+
+
+def private_key_pem(private_key) -> bytes:
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+
+
+def load_private_key_pem(data: bytes):
+    return serialization.load_pem_private_key(data, password=None)
+
+
+def user_id_of(public_key_der: bytes) -> str:
+    # O ID do usuário é a impressão digital da sua chave pública (32 dígitos hex,
+    # como um uuid4). Assim ninguém consegue registrar outra chave para um ID que
+    # não é o seu.
+    return hashlib.blake2b(public_key_der, digest_size=16).hexdigest()
+
+
+# O tipo da chave é identificado uma única vez, ao criar o assinador/verificador,
+# e não a cada lance
+def make_signer(private_key) -> Callable[[bytes], bytes]:
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return private_key.sign
+
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return lambda data: private_key.sign(data, _PSS, hashes.SHA256())
+
+    raise ValueError(f"Unsupported private key type {type(private_key).__name__}.")
+
+
+def make_verifier(public_key) -> Callable[[bytes, bytes], bool]:
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+
+        def verify(signature: bytes, data: bytes) -> bool:
+            try:
+                public_key.verify(signature, data)
+            except InvalidSignature:
+                return False
+
+            return True
+
+        return verify
+
+    if isinstance(public_key, rsa.RSAPublicKey):
+
+        def verify(signature: bytes, data: bytes) -> bool:
+            try:
+                public_key.verify(signature, data, _PSS, hashes.SHA256())
+            except InvalidSignature:
+                return False
+
+            return True
+
+        return verify
+
+    raise ValueError(f"Unsupported public key type {type(public_key).__name__}.")
@@ -0,0 +1,280 @@
+import bisect
+from array import array
+from collections import OrderedDict
+
+# Estado dos leilões do MS-Lance, indexado pelo ID do leilão.
+# Cada leilão guarda o necessário para validar e liquidar lances, em registros com
+# __slots__ (sem o __dict__ de cada instância).
+
+# Maior valor de lance aceito: os valores ficam em um array de int64
+MAX_BID = 2**63 - 1
+
+
+class BidLedger:
+    # Livro de lances de um leilão.
+    #
+    # - Histórico: todos os lances aceitos, na ordem de chegada, em arrays compactos
+    #   (valor em int64 e índice do usuário em uint32, 12 bytes por lance).
+    # - Ranking: o maior lance de cada usuário, em uma lista ordenada de (valor,
+    #   índice do usuário). Um lance novo tira a entrada anterior do usuário e insere a
+    #   nova com bisect. A busca é O(log n), mas a lista é um array: inserir e remover
+    #   movem as entradas acima da posição. Como um lance aceito supera o líder, a
+    #   inserção é no fim (só os desclassificados ficam acima dele), e a entrada
+    #   anterior do usuário só tem acima dela os usuários que o superaram depois. O
+    #   custo é O(log n) enquanto essas entradas forem poucas, e O(n) no pior caso.
+    #   O líder, os k maiores e o próximo colocado quando o líder é desclassificado
+    #   saem do fim da lista, pulando só os desclassificados.
+    #
+    # Regras: um lance precisa superar o maior lance válido em pelo menos
+    # `min_increment` (e não passar de MAX_BID), e o leilão só tem vencedor se o maior
+    # lance válido atingir o preço de reserva (`reserve`). Lances abaixo da reserva
+    # são aceitos.
+    __slots__ = (
+        "min_increment",
+        "reserve",
+        "_values",
+        "_bidder_of",
+        "_bidders",
+        "_index",
+        "_best",
+        "_ranking",
+        "_disqualified",
+    )
+
+    def __init__(self, min_increment: int = 1, reserve: int = 0):
+        self.min_increment = min_increment
+        self.reserve = reserve
+
+        self._values = array("q")
+        self._bidder_of = array("I")
+        # Usuários do leilão (índice -> ID, ID -> índice) e o maior lance de cada um
+        self._bidders: list[str] = []
+        self._index: dict[str, int] = {}
+        self._best: list[int] = []
+        self._ranking: list[tuple[int, int]] = []
+        self._disqualified: set[int] | None = None
+
+    def _leader(self) -> tuple[int, int] | None:
+        # (valor, índice do usuário) do maior lance válido
+        for entry in reversed(self._ranking):
+            if self._disqualified is None or entry[1] not in self._disqualified:
+                return entry
+
+        return None
+
+    def minimum_bid(self) -> int:
+        leader = self._leader()
+        return (leader[0] if leader is not None else 0) + self.min_increment
+
+    def accepts(self, value: int) -> bool:
+        return self.minimum_bid() <= value <= MAX_BID
+
+    def add(self, user_id: str, value: int) -> None:
+        # Registra um lance já validado (accepts), sem conferir as regras: o log de
+        # estado reaplica os lances com este método. O histórico é gravado antes do
+        # ranking, e um valor fora do int64 (OverflowError) não altera nada.
+        bidder = self._index.get(user_id)
+        new = bidder is None
+
+        if new:
+            bidder = len(self._bidders)
+
+        self._values.append(value)
+        self._bidder_of.append(bidder)
+
+        if new:
+            self._index[user_id] = bidder
+            self._bidders.append(user_id)
+            self._best.append(value)
+        else:
+            previous = (self._best[bidder], bidder)
+
+            if value <= previous[0]:
+                # O ranking guarda só o maior lance do usuário
+                return
+
+            del self._ranking[bisect.bisect_left(self._ranking, previous)]
+            self._best[bidder] = value
+
+        bisect.insort(self._ranking, (value, bidder))
+
+    def highest(self) -> tuple[str, int] | None:
+        # (usuário, valor) do maior lance válido
+        leader = self._leader()
+        return (self._bidders[leader[1]], leader[0]) if leader is not None else None
+
+    def winner(self) -> tuple[str, int] | None:
+        # O maior lance válido, se atingir o preço de reserva
+        highest = self.highest()
+
+        if highest is None or highest[1] < self.reserve:
+            return None
+
+        return highest
+
+    def top(self, k: int) -> list[tuple[str, int]]:
+        # Os k maiores lances válidos, um por usuário, do maior para o menor
+        top = []
+
+        for value, bidder in reversed(self._ranking):
+            if len(top) >= k:
+                break
+            if self._disqualified is None or bidder not in self._disqualified:
+                top.append((self._bidders[bidder], value))
+
+        return top
+
+    def disqualify(self, user_id: str) -> tuple[str, int] | None:
+        # Desconsidera os lances do usuário e retorna o novo líder
+        bidder = self._index.get(user_id)
+
+        if bidder is not None:
+            if self._disqualified is None:
+                self._disqualified = set()
+
+            self._disqualified.add(bidder)
+
+        return self.highest()
+
+    def contains(self, user_id: str, value: int) -> bool:
+        # Se o usuário tem um lance aceito com esse valor (ex.: uma reentrega de um
+        # lance já aplicado). Percorre o histórico do fim para o início.
+        bidder = self._index.get(user_id)
+
+        if bidder is None or value > self._best[bidder]:
+            return False
+        if value == self._best[bidder]:
+            return True
+
+        for i in range(len(self._values) - 1, -1, -1):
+            if self._values[i] == value and self._bidder_of[i] == bidder:
+                return True
+
+        return False
+
+    def best_bids(self) -> list[tuple[str, int]]:
+        # (usuário, maior lance) de cada usuário, na ordem do primeiro lance
+        return list(zip(self._bidders, self._best))
+
+    def disqualified(self) -> list[str]:
+        return [self._bidders[bidder] for bidder in self._disqualified or ()]
+
+    def history(self, start: int = 0, stop: int | None = None) -> list[tuple[str, int]]:
+        # Lances aceitos, na ordem de chegada: (usuário, valor)
+        bidders = self._bidders
+        return [
+            (bidders[bidder], value)
+            for bidder, value in zip(
+                self._bidder_of[start:stop], self._values[start:stop]
+            )
+        ]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class LeilaoState:
+    __slots__ = ("id", "ledger")
+
+    def __init__(self, id: str, min_increment: int = 1, reserve: int = 0):
+        self.id = id
+        self.ledger = BidLedger(min_increment, reserve)
+
+    @property
+    def highest_bid(self) -> int:
+        highest = self.ledger.highest()
+        return highest[1] if highest is not None else 0
+
+    def __repr__(self) -> str:
+        return f"LeilaoState(id={self.id!r}, lances={len(self.ledger)}, maior={self.ledger.highest()!r})"
+
+
+class LeilaoStore:
+    # Leilões ativos e, para consultas, os livros de lances dos leilões encerrados
+    # mais recentes, até somarem `retain_bids` lances (os mais antigos saem primeiro).
+    # O vencedor dos `retain_results` leilões encerrados mais recentes fica guardado à
+    # parte, para que um leilao_finalizado reentregue publique o mesmo resultado.
+    def __init__(
+        self,
+        min_increment: int = 1,
+        reserve: int = 0,
+        retain_bids: int = 0,
+        retain_results: int = 10_000,
+    ):
+        self.min_increment = min_increment
+        self.reserve = reserve
+        self.retain_bids = retain_bids
+        self.retain_results = retain_results
+
+        self._leiloes: dict[str, LeilaoState] = {}
+        self._ended: OrderedDict[str, LeilaoState] = OrderedDict()
+        self._ended_bids = 0
+        # id -> (usuário, valor) do vencedor, ou None se o leilão não teve vencedor
+        self._results: OrderedDict[str, tuple[str, int] | None] = OrderedDict()
+
+    def add(self, leilao_id: str) -> LeilaoState:
+        # Um leilao_iniciado repetido não deve zerar o lance já registrado
+        state = self._leiloes.get(leilao_id)
+
+        if state is None:
+            state = LeilaoState(leilao_id, self.min_increment, self.reserve)
+            self._leiloes[leilao_id] = state
+
+        return state
+
+    def get(self, leilao_id: str) -> LeilaoState | None:
+        return self._leiloes.get(leilao_id)
+
+    def remove(self, leilao_id: str) -> LeilaoState | None:
+        state = self._leiloes.pop(leilao_id, None)
+
+        if state is None:
+            return None
+
+        self.add_result(leilao_id, state.ledger.winner())
+
+        if self.retain_bids > 0:
+            self._retain(state)
+
+        return state
+
+    def add_result(self, leilao_id: str, winner: tuple[str, int] | None) -> None:
+        self._results.pop(leilao_id, None)
+        self._results[leilao_id] = winner
+
+        while len(self._results) > self.retain_results:
+            self._results.popitem(last=False)
+
+    def winner_of(self, leilao_id: str) -> tuple[str, int] | None:
+        # Vencedor de um leilão encerrado recentemente (None se não teve vencedor).
+        # KeyError se o leilão não está entre os encerrados guardados.
+        return self._results[leilao_id]
+
+    def results(self) -> list[tuple[str, tuple[str, int] | None]]:
+        # Resultados guardados, do mais antigo para o mais recente
+        return list(self._results.items())
+
+    def _retain(self, state: LeilaoState) -> None:
+        previous = self._ended.pop(state.id, None)
+        if previous is not None:
+            self._ended_bids -= len(previous.ledger)
+
+        self._ended[state.id] = state
+        self._ended_bids += len(state.ledger)
+
+        while self._ended_bids > self.retain_bids:
+            _, evicted = self._ended.popitem(last=False)
+            self._ended_bids -= len(evicted.ledger)
+
+    def ended(self, leilao_id: str) -> LeilaoState | None:
+        # Leilão encerrado, se o seu histórico ainda estiver retido
+        return self._ended.get(leilao_id)
+
+    def __contains__(self, leilao_id: str) -> bool:
+        return leilao_id in self._leiloes
+
+    def __len__(self) -> int:
+        return len(self._leiloes)
+
+    def __iter__(self):
+        return iter(self._leiloes.values())
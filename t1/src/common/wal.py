@@ -0,0 +1,430 @@
+import os
+import struct
+import zlib
+
+from common.store import LeilaoStore
+
+# Log de escrita antecipada (WAL) e snapshots do estado do MS-Lance.
+#
+# Cada evento aplicado ao estado (leilão iniciado, lance aceito, leilão finalizado)
+# vira um registro no segmento de log atual. Os registros ficam em memória até o
+# commit, que grava e sincroniza (fsync) todos de uma vez: o commit em grupo é feito
+# antes de cada ack em lote, então uma mensagem só é confirmada depois que o seu
+# efeito está em disco. Se o serviço cair antes do commit, o broker reentrega as
+# mensagens não confirmadas e elas são aplicadas de novo. O commit também grava os
+# registros de entregas aplicadas cujos eventos gerados ainda não foram confirmados;
+# se o serviço cair antes disso, a reentrega encontra o efeito já aplicado, e o
+# MS-Lance publica o evento de novo a partir do estado (services/lance.py).
+#
+# A cada `snapshot_every` registros o log troca de segmento e o estado é gravado em
+# um snapshot (arquivo temporário + rename, que é atômico). Os segmentos anteriores
+# ao snapshot são apagados, então a recuperação lê um snapshot e no máximo
+# `snapshot_every` registros. O snapshot guarda só o resumo de cada livro de lances
+# (o maior lance de cada usuário e os desclassificados), não o histórico: o seu
+# tamanho, e o tempo que ele leva no caminho do ack, dependem da quantidade de
+# usuários dos leilões ativos e não da quantidade de lances. O histórico de um
+# leilão recuperado começa nesse resumo.
+#
+# Formatos:
+# - Registro: tamanho (u32) + crc32 (u32) + tipo (u8) + campos (texto com tamanho u16).
+#   Um registro incompleto ou com crc inválido no fim do último segmento é uma
+#   escrita interrompida e é descartado.
+# - Snapshot: SNAPSHOT_MAGIC + primeiro segmento a reaplicar (u64) + quantidade (u32)
+#   + resultados dos leilões encerrados recentes + livro de lances de cada leilão
+#   + crc32 (u32) do conteúdo. Os resultados são a quantidade e, para cada um, o id,
+#   o vencedor ("" sem vencedor) e o valor; a versão 2 não os tem. O livro é o id, a
+#   quantidade de lances, (usuário, valor) de cada lance, a quantidade de
+#   desclassificados e os seus IDs. Os lances gravados são o maior de cada usuário,
+#   na ordem do primeiro lance dele; snapshots anteriores com o histórico inteiro
+#   têm o mesmo formato e são lidos do mesmo jeito. A versão 1 do snapshot guardava
+#   só (id, maior lance, vencedor) e ainda é lida, como um livro com um lance.
+#
+# Não é thread-safe: deve ser usado na thread da conexão, junto do estado.
+
+SNAPSHOT_MAGIC = b"LSNP\x03"
+_SNAPSHOT_MAGIC_V2 = b"LSNP\x02"
+_SNAPSHOT_MAGIC_V1 = b"LSNP\x01"
+
+RECORD_INICIADO = 1
+RECORD_LANCE = 2
+RECORD_FINALIZADO = 3
+
+_RECORD_HEADER = struct.Struct(">IIB")
+_LENGTH = struct.Struct(">H")
+_SNAPSHOT_HEADER = struct.Struct(">QI")
+_CRC = struct.Struct(">I")
+
+_SEGMENT_PREFIX = "wal-"
+_SEGMENT_SUFFIX = ".log"
+_SNAPSHOT_NAME = "snapshot"
+
+
+def _pack_fields(fields: tuple[str, ...]) -> bytes:
+    parts = []
+
+    for field in fields:
+        data = field.encode("utf-8")
+        parts.append(_LENGTH.pack(len(data)))
+        parts.append(data)
+
+    return b"".join(parts)
+
+
+def _unpack_fields(data: bytes, offset: int = 0) -> list[str]:
+    fields = []
+
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        field = data[offset : offset + length]
+
+        if len(field) != length:
+            raise ValueError("Truncated field.")
+
+        fields.append(field.decode("utf-8"))
+        offset += length
+
+    return fields
+
+
+def _apply(store: LeilaoStore, kind: int, fields: list[str]) -> None:
+    if kind == RECORD_INICIADO:
+        store.add(fields[0])
+    elif kind == RECORD_LANCE:
+        state = store.get(fields[0])
+
+        if state is not None:
+            state.ledger.add(fields[1], int(fields[2]))
+    elif kind == RECORD_FINALIZADO:
+        store.remove(fields[0])
+    else:
+        raise ValueError(f"Unknown record kind {kind}.")
+
+
+class WriteAheadLog:
+    def __init__(
+        self,
+        directory: str = "./wal",
+        snapshot_every: int = 100_000,
+        fsync: bool = True,
+    ):
+        assert snapshot_every > 0, "snapshot_every must be positive."
+
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+
+        self.records = 0
+        self.commits = 0
+        self.snapshots = 0
+
+        self._file = None
+        self._segment = 0
+        self._buffer = bytearray()
+        self._since_snapshot = 0
+
+    # Arquivos
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(
+            self.directory, f"{_SEGMENT_PREFIX}{segment:010d}{_SEGMENT_SUFFIX}"
+        )
+
+    def _segments(self) -> list[int]:
+        segments = []
+
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                number = name[len(_SEGMENT_PREFIX) : -len(_SEGMENT_SUFFIX)]
+                segments.append(int(number))
+
+        return sorted(segments)
+
+    def _sync_directory(self) -> None:
+        # Garante que criações, renomeações e remoções de arquivos estejam em disco
+        if not self.fsync or os.name != "posix":
+            return
+
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _open_segment(self, segment: int) -> None:
+        if self._file is not None:
+            self._file.close()
+
+        self._segment = segment
+        self._file = open(self._segment_path(segment), "ab")
+        self._sync_directory()
+
+    # Recuperação
+
+    def recover(self, store: LeilaoStore) -> int:
+        # Reconstrói o estado a partir do snapshot e dos segmentos seguintes, e abre
+        # um segmento novo para os próximos registros. Retorna quantos registros foram
+        # reaplicados.
+        os.makedirs(self.directory, exist_ok=True)
+
+        first_segment = self._load_snapshot(store)
+        segments = [s for s in self._segments() if s >= first_segment]
+        replayed = 0
+
+        for i, segment in enumerate(segments):
+            replayed += self._replay(
+                store, self._segment_path(segment), last=i == len(segments) - 1
+            )
+
+        self._since_snapshot = replayed
+        self._open_segment(max(segments, default=first_segment - 1) + 1)
+
+        return replayed
+
+    def _load_snapshot(self, store: LeilaoStore) -> int:
+        path = os.path.join(self.directory, _SNAPSHOT_NAME)
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        content, trailer = data[: -_CRC.size], data[-_CRC.size :]
+
+        magic = content[: len(SNAPSHOT_MAGIC)]
+
+        if (
+            magic not in (SNAPSHOT_MAGIC, _SNAPSHOT_MAGIC_V2, _SNAPSHOT_MAGIC_V1)
+            or len(trailer) != _CRC.size
+            or _CRC.unpack(trailer)[0] != zlib.crc32(content)
+        ):
+            raise ValueError(f"Corrupted snapshot '{path}'.")
+
+        first_segment, count = _SNAPSHOT_HEADER.unpack_from(content, len(magic))
+        fields = _unpack_fields(content, len(magic) + _SNAPSHOT_HEADER.size)
+
+        try:
+            if magic == _SNAPSHOT_MAGIC_V1:
+                loaded = self._load_snapshot_v1(store, fields)
+            elif magic == _SNAPSHOT_MAGIC_V2:
+                loaded = self._load_ledgers(store, fields)
+            else:
+                loaded = self._load_ledgers(
+                    store, fields[self._load_results(store, fields) :]
+                )
+        except (IndexError, ValueError):
+            loaded = None
+
+        if loaded != count:
+            raise ValueError(f"Corrupted snapshot '{path}'.")
+
+        return first_segment
+
+    @staticmethod
+    def _load_results(store: LeilaoStore, fields: list[str]) -> int:
+        # Retorna quantos campos foram lidos
+        count = int(fields[0])
+        end = 1 + 3 * count
+
+        if end > len(fields):
+            raise ValueError("Truncated results.")
+
+        for i in range(1, end, 3):
+            user_id, value = fields[i + 1], int(fields[i + 2])
+            store.add_result(fields[i], (user_id, value) if user_id else None)
+
+        return end
+
+    @staticmethod
+    def _load_ledgers(store: LeilaoStore, fields: list[str]) -> int:
+        loaded = 0
+        i = 0
+
+        while i < len(fields):
+            ledger = store.add(fields[i]).ledger
+            bids = int(fields[i + 1])
+            i += 2
+
+            for j in range(i, i + 2 * bids, 2):
+                ledger.add(fields[j], int(fields[j + 1]))
+            i += 2 * bids
+
+            disqualified = int(fields[i])
+            for user_id in fields[i + 1 : i + 1 + disqualified]:
+                ledger.disqualify(user_id)
+            i += 1 + disqualified
+
+            loaded += 1
+
+        if i != len(fields):
+            raise ValueError("Truncated ledger.")
+
+        return loaded
+
+    @staticmethod
+    def _load_snapshot_v1(store: LeilaoStore, fields: list[str]) -> int:
+        if len(fields) % 3:
+            raise ValueError("Truncated snapshot.")
+
+        for i in range(0, len(fields), 3):
+            state = store.add(fields[i])
+
+            if fields[i + 2] != "ninguem":
+                state.ledger.add(fields[i + 2], int(fields[i + 1]))
+
+        return len(fields) // 3
+
+    def _replay(self, store: LeilaoStore, path: str, last: bool) -> int:
+        with open(path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        replayed = 0
+
+        while offset < len(data):
+            try:
+                length, crc, kind = _RECORD_HEADER.unpack_from(data, offset)
+            except struct.error:
+                length, crc, kind = None, None, None
+
+            start = offset + _RECORD_HEADER.size
+            payload = data[start : start + length] if length is not None else b""
+
+            if (
+                length is None
+                or len(payload) != length
+                or zlib.crc32(bytes((kind,)) + payload) != crc
+            ):
+                # Só o fim do último segmento pode ter uma escrita interrompida
+                if not last:
+                    raise ValueError(f"Corrupted log segment '{path}'.")
+
+                print(f"[WAL] Descartando registro incompleto no fim de '{path}'.")
+                os.truncate(path, offset)
+                break
+
+            _apply(store, kind, _unpack_fields(payload))
+            offset = start + length
+            replayed += 1
+
+        return replayed
+
+    # Escrita
+
+    def append(self, kind: int, *fields: str) -> None:
+        payload = _pack_fields(fields)
+
+        self._buffer += _RECORD_HEADER.pack(
+            len(payload), zlib.crc32(bytes((kind,)) + payload), kind
+        )
+        self._buffer += payload
+
+        self.records += 1
+        self._since_snapshot += 1
+
+    def log_iniciado(self, leilao_id: str) -> None:
+        self.append(RECORD_INICIADO, leilao_id)
+
+    def log_lance(self, leilao_id: str, user_id: str, value: str) -> None:
+        self.append(RECORD_LANCE, leilao_id, user_id, value)
+
+    def log_finalizado(self, leilao_id: str) -> None:
+        self.append(RECORD_FINALIZADO, leilao_id)
+
+    def commit(self) -> None:
+        # Commit em grupo: uma escrita e um fsync para todos os registros pendentes
+        if not self._buffer:
+            return
+
+        self._file.write(self._buffer)
+        self._file.flush()
+
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+        self._buffer.clear()
+        self.commits += 1
+
+    # Snapshot
+
+    def maybe_snapshot(self, store: LeilaoStore) -> bool:
+        if self._since_snapshot < self.snapshot_every:
+            return False
+
+        self.snapshot(store)
+        return True
+
+    def snapshot(self, store: LeilaoStore) -> None:
+        # O snapshot cobre todos os segmentos até o atual; os registros seguintes vão
+        # para um segmento novo
+        self.commit()
+        self._open_segment(self._segment + 1)
+
+        results = store.results()
+        fields = [str(len(results))]
+        for leilao_id, winner in results:
+            user_id, value = winner if winner is not None else ("", 0)
+            fields += (leilao_id, user_id, str(value))
+
+        for state in store:
+            ledger = state.ledger
+            best_bids = ledger.best_bids()
+            fields += (state.id, str(len(best_bids)))
+
+            for user_id, value in best_bids:
+                fields += (user_id, str(value))
+
+            disqualified = ledger.disqualified()
+            fields.append(str(len(disqualified)))
+            fields += disqualified
+
+        content = b"".join(
+            (
+                SNAPSHOT_MAGIC,
+                _SNAPSHOT_HEADER.pack(self._segment, len(store)),
+                _pack_fields(tuple(fields)),
+            )
+        )
+
+        path = os.path.join(self.directory, _SNAPSHOT_NAME)
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.write(_CRC.pack(zlib.crc32(content)))
+            f.flush()
+
+            if self.fsync:
+                os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+        self._sync_directory()
+
+        # Os segmentos anteriores já estão no snapshot
+        for segment in self._segments():
+            if segment < self._segment:
+                os.remove(self._segment_path(segment))
+
+        self._since_snapshot = 0
+        self.snapshots += 1
+
+    def close(self, commit: bool = True) -> None:
+        # commit=False descarta os registros ainda não gravados
+        if self._file is None:
+            return
+
+        if commit:
+            self.commit()
+
+        self._buffer.clear()
+        self._file.close()
+        self._file = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "records": self.records,
+            "commits": self.commits,
+            "snapshots": self.snapshots,
+            "pending": self._since_snapshot,
+        }
@@ -1,188 +1,808 @@
 import pika
-import base64
-import json
+import asyncio
 import functools
-import datetime
 import sys
 import os
+import struct
+import time
+import uuid
 
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
 
 # Adiciona o diretório raiz do projeto ao sys.path para importar 'common'
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from common.serial import deserialize_dict, deserialize_leilao, serialize_dict
+from common.aio import AsyncBroker
+from common.broker import Broker, connection_parameters
+from common.keys import KeyStore
+from common.metrics import REGISTRY, start_exporter, trace_log, trace_of
+from common.pipeline import (
+    OrderedPipeline,
+    init_worker,
+    verify_lance,
+    worker_cache,
+    VERIFY_NO_KEY,
+    VERIFY_OK,
+)
+from common.store import MAX_BID
+from common.shards import (
+    PARTITIONED_EVENTS,
+    PARTITIONS,
+    QUEUE_ARGUMENTS,
+    Shard,
+    consumer_priority,
+    partition_queue,
+    split_routing_key,
+)
+from common.serial import (
+    HEADER_LEILAO_ID,
+    Lance,
+    LanceValidado,
+    Leilao,
+    LeilaoVencedor,
+    decode_event,
+    decode_signed,
+    encode_event,
+)
 
 # Variáveis globais
-
-leiloes: list[dict[str, str | datetime.datetime]] = []
+KEY_CACHE_SIZE = 4096
+
+# Índice das chaves públicas dos usuários (common/keys.py), recebidas pelo evento
+# "chave_registrada" e gravadas em KEY_STORE_DIRECTORY para a próxima inicialização
+# (um arquivo por instância, lido por todas). Um lance de um usuário cuja chave ainda
+# não chegou espera por ela até KEY_WAIT_S (os lances seguintes do mesmo leilão
+# esperam junto), e a instância pede ao cliente que registre a chave de novo
+# ("chave_solicitada.<usuário>").
+KEY_STORE_DIRECTORY = "./chaves"
+KEY_WAIT_S = 2.0
+
+# Verificação das assinaturas: "process" usa um processo por núcleo, "thread" usa
+# threads no mesmo processo (compartilhando o cache de chaves)
+VERIFY_MODE = "process"
+VERIFY_WORKERS = os.cpu_count() or 1
+
+# Runtime dos serviços: False usa o BlockingConnection, True usa o runtime asyncio
+# (publicações em pipeline com publisher confirms)
+ASYNC_RUNTIME = False
+
+# Janela de mensagens não confirmadas e confirmação em lote
+PREFETCH_COUNT = 256
+ACK_BATCH_SIZE = 64
+ACK_MAX_DELAY_S = 0.05
+
+# Publicadores (conexões) usados para os eventos gerados
+PUBLISHERS = 2
+
+# Log de estado (WAL + snapshots) de cada partição em WAL_DIRECTORY/p<partição>. Com
+# ele o estado dos leilões sobrevive a reinícios e acompanha a partição quando ela
+# muda de instância: cada ack em lote é precedido pelo commit em grupo do log, e um
+# snapshot é gravado a cada WAL_SNAPSHOT_EVERY registros. WAL_FSYNC=False troca a
+# durabilidade em quedas do sistema operacional por commits mais baratos.
+#
+# O commit grava também os efeitos de entregas cujos eventos gerados (lance_validado,
+# leilao_vencedor) ainda não foram confirmados pelo broker. Se a publicação não
+# chega a acontecer (queda do serviço, ou publicação recusada e entrega devolvida à
+# fila), a reentrega encontra o efeito já aplicado: um lance reentregue que já está
+# no livro e um leilao_finalizado reentregue de um leilão já encerrado publicam o
+# evento de novo a partir do estado, sem alterá-lo.
+#
+# Todas as instâncias precisam usar o mesmo WAL_DIRECTORY (mesma máquina ou volume
+# compartilhado com rename atômico). Com diretórios separados cada instância só vê o
+# próprio log, e uma partição que muda de instância perde os leilões e lances
+# aplicados pela anterior.
+WAL_ENABLED = True
+WAL_DIRECTORY = "./wal"
+WAL_SNAPSHOT_EVERY = 100_000
+WAL_FSYNC = True
+
+# Regras dos lances (common/store.py): um lance precisa superar o maior lance válido
+# em pelo menos MIN_INCREMENT, e o leilão só tem vencedor se o maior lance atingir
+# RESERVE_PRICE. O histórico dos leilões encerrados fica em memória para consultas
+# até somar ENDED_HISTORY_BIDS lances por partição (0 descarta ao encerrar).
+MIN_INCREMENT = 1
+RESERVE_PRICE = 0
+ENDED_HISTORY_BIDS = 1_000_000
+
+# ID desta instância (python src/services/lance.py <id>). Define a prioridade da
+# instância em cada partição (common/shards.py); um ID fixo mantém as mesmas
+# partições entre reinícios.
+INSTANCE_ID = sys.argv[1] if len(sys.argv) > 1 else uuid.uuid4().hex
+
+shards = [
+    Shard(
+        partition,
+        INSTANCE_ID,
+        WAL_DIRECTORY if WAL_ENABLED else None,
+        WAL_SNAPSHOT_EVERY,
+        WAL_FSYNC,
+        MIN_INCREMENT,
+        RESERVE_PRICE,
+        ENDED_HISTORY_BIDS,
+    )
+    for partition in range(PARTITIONS)
+]
 
 EXCHANGE_NAME = "exchange"
+# Usa o formato binário de common/serial.py (False para JSON)
+WIRE_BINARY = True
+
+# Métricas (common/metrics.py) de cada estágio de um lance: decodificação, tempo no
+# pipeline (fila do pool, verificação e espera pelos eventos anteriores do leilão),
+# os estágios medidos no worker e a aplicação ao estado
+DECODE_TIME = REGISTRY.histogram("lance_decodificacao_seconds")
+PIPELINE_TIME = REGISTRY.histogram("lance_pipeline_seconds")
+WORKER_TIMES = {
+    stage: REGISTRY.histogram(f"lance_{stage}_seconds")
+    for stage in ("chave_der", "verificacao")
+}
+STATE_TIME = REGISTRY.histogram("lance_estado_seconds")
+
+VALIDATED = REGISTRY.counter("lance_validados")
+REFUSED = REGISTRY.counter("lance_recusados")
+INVALID_SIGNATURES = REGISTRY.counter("lance_assinaturas_invalidas")
+MISSING_KEYS = REGISTRY.counter("lance_sem_chave")
+MALFORMED = REGISTRY.counter("lance_mal_formados")
+KEY_CACHE_HITS = REGISTRY.counter("lance_cache_chaves_acertos")
+KEY_CACHE_MISSES = REGISTRY.counter("lance_cache_chaves_faltas")
+HELD_LANCES = REGISTRY.counter("lance_aguardaram_chave")
+KEY_REGISTRATIONS = REGISTRY.counter("lance_chaves_registradas")
+REJECTED_KEYS = REGISTRY.counter("lance_chaves_recusadas")
+REPUBLISHED = REGISTRY.counter("lance_eventos_republicados")
+
+keys = KeyStore(KEY_STORE_DIRECTORY, INSTANCE_ID, WAL_FSYNC)
+
+
+def create_executor():
+    if VERIFY_MODE == "thread":
+        return ThreadPoolExecutor(
+            max_workers=VERIFY_WORKERS,
+            initializer=init_worker,
+            initargs=(KEY_CACHE_SIZE,),
+        )
+
+    return ProcessPoolExecutor(
+        max_workers=VERIFY_WORKERS,
+        initializer=init_worker,
+        initargs=(KEY_CACHE_SIZE,),
+    )
 
 
-def main():
-    # Realiza a conexao com o RabbitMQ
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host="localhost"))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="direct")
+class HeldLances:
+    # Lances à espera da chave do seu usuário, com a vez reservada no pipeline
+    # (OrderedPipeline.hold). Todos os métodos rodam na thread da conexão.
+    def __init__(
+        self,
+        pipeline: OrderedPipeline,
+        call_later: Callable[[float, Callable[[], None]], Any],
+        request_key: Callable[[str], None],
+        timeout_s: float = KEY_WAIT_S,
+    ):
+        self.pipeline = pipeline
+        self.timeout_s = timeout_s
+
+        self._call_later = call_later
+        self._request_key = request_key
+        # user_id -> [(future, assinatura, lance assinado)]
+        self._held: dict[str, list[tuple[Future, bytes, bytes]]] = {}
+
+    def hold(self, user_id: str, future: Future, signature: bytes, payload: bytes):
+        waiting = self._held.get(user_id)
+
+        if waiting is None:
+            waiting = self._held[user_id] = []
+            self._request_key(user_id)
+
+        entry = (future, signature, payload)
+        waiting.append(entry)
+        HELD_LANCES.inc()
+
+        self._call_later(
+            self.timeout_s, functools.partial(self._expire, user_id, entry)
+        )
+
+    def release(self, user_id: str, public_key: bytes) -> None:
+        for future, signature, payload in self._held.pop(user_id, ()):
+            self.pipeline.resolve(
+                future, verify_lance, user_id, public_key, signature, payload
+            )
 
-    # Cria uma fila com nome aleatória
-    result = channel.queue_declare(queue="", exclusive=True)
-    queue_name = result.method.queue
+    def expire_all(self) -> None:
+        # Ex.: a conexão caiu, e os lances serão entregues de novo
+        for user_id in list(self._held):
+            for entry in list(self._held.get(user_id, ())):
+                self._expire(user_id, entry)
 
-    # Conecta a fila criada com o exchange, aceitando apenas mensagens com o identificador "lance_realizado", "leilao_iniciado" e "leilao_finalizado"
-    # Requisito 4.2 - Escuta os eventos das filas lance_realizado, leilao_iniciado e leilao_finalizado.
-    channel.queue_bind(
-        exchange=EXCHANGE_NAME, queue=queue_name, routing_key="lance_realizado"
+    def _expire(self, user_id: str, entry: tuple[Future, bytes, bytes]) -> None:
+        waiting = self._held.get(user_id)
+
+        if waiting is None or not any(held is entry for held in waiting):
+            return
+
+        waiting.remove(entry)
+
+        if not waiting:
+            del self._held[user_id]
+
+        if not entry[0].done():
+            entry[0].set_result((VERIFY_NO_KEY, ()))
+
+    def __len__(self) -> int:
+        return sum(len(waiting) for waiting in self._held.values())
+
+
+# Mensagem a ser publicada depois de aplicar um evento: (routing key, corpo, propriedades)
+Outgoing = tuple[str, bytes, pika.BasicProperties]
+
+
+def make_outgoing(
+    kind: str,
+    leilao_id: str,
+    message: bytes,
+    content_type: str,
+    trace: dict | None = None,
+) -> Outgoing:
+    # O tipo e o leilão vão nas propriedades, e o MS-Notificacao não precisa
+    # decodificar o corpo para encaminhá-lo. O rastreamento do lance segue junto.
+    properties = pika.BasicProperties(
+        content_type=content_type,
+        type=kind,
+        headers={HEADER_LEILAO_ID: leilao_id, **(trace or {})},
     )
-    channel.queue_bind(
-        exchange=EXCHANGE_NAME, queue=queue_name, routing_key="leilao_iniciado"
+
+    return kind, message, properties
+
+
+def lance_validado(lance: Lance, value: int, trace: dict | None) -> list[Outgoing]:
+    message, content_type = encode_event(
+        LanceValidado(lance.user_id, lance.leilao_id, str(value)), binary=WIRE_BINARY
     )
-    channel.queue_bind(
-        exchange=EXCHANGE_NAME, queue=queue_name, routing_key="leilao_finalizado"
+
+    return [
+        make_outgoing("lance_validado", lance.leilao_id, message, content_type, trace)
+    ]
+
+
+def leilao_vencedor(leilao_id: str, winner: tuple[str, int] | None) -> list[Outgoing]:
+    # Sem lance válido que atinja o preço de reserva, o leilão não tem vencedor
+    user_id, value = winner if winner is not None else ("ninguem", 0)
+
+    message, content_type = encode_event(
+        LeilaoVencedor(leilao_id, str(value), user_id), binary=WIRE_BINARY
     )
 
-    # Requisito 4.3 - Recebe lances de usuários (ID do leilão; ID do usuário, valor do lance) e checa a assinatura digital da mensagem utilizando a
-    # chave pública correspondente. Somente aceitará o lance se: A assinatura for válida
+    return [make_outgoing("leilao_vencedor", leilao_id, message, content_type)]
 
-    def on_message(ch, method, properties, body):
-        if method.routing_key == "lance_realizado":
-            lance = deserialize_dict(body)
 
-            # necessario converter a assinatura e valor para bytes pra permitir o processo de verificacao
-            b_signature = base64.b64decode(lance["signature"])
-            # b_value = lance['value'].encode('utf-8')
-            b_message = json.dumps(
-                {
-                    "user_id": lance["user_id"],
-                    "leilao_id": lance["leilao_id"],
-                    "value": lance["value"],
-                }
-            ).encode("utf-8")
+# Requisito 4.3 - Recebe lances de usuários (ID do leilão; ID do usuário, valor do lance) e checa a assinatura digital da mensagem utilizando a
+# chave pública correspondente. Somente aceitará o lance se: A assinatura for válida
+def apply_lance(
+    shard: Shard,
+    lance: Lance,
+    status: str,
+    trace: dict | None = None,
+    redelivered: bool = False,
+) -> list[Outgoing]:
+    if status != VERIFY_OK:
+        if status == VERIFY_NO_KEY:
+            MISSING_KEYS.inc()
+        else:
+            INVALID_SIGNATURES.inc()
 
-            # esses blocos try catch estavam mais para encontrar os erros que estavam aparecendo, se achar feio pode retirar
+        print(f"[MS-Lance] Assinatura rejeitada: {status}")
+        return []
 
-            # Requisito 4.1 - Possui as chaves públicas de todos os clientes.
-            try:
-                with open(f"./keys/{lance['user_id']}.pem", "rb") as f:
-                    public_key_data = f.read()
-            except:
-                print("[MS-Lance] abertura de arquivo falhou!")
+    print("[MS-Lance] Assinatura valida!")
 
-            try:
-                public_key = load_pem_public_key(public_key_data)
-            except:
-                print("[MS-Lance] carregamento da chave falhou!")
+    # checa se id do leilao existe em leiloes
+    state = shard.leiloes.get(lance.leilao_id)
+
+    if state is None:
+        REFUSED.inc()
+        print("[MS-Lance] leilao nao existe!")
+        return []
 
+    try:
+        value = int(lance.value)
+    except ValueError:
+        value = None
+
+    # O livro de lances guarda os valores em int64
+    if value is None or value > MAX_BID:
+        MALFORMED.inc()
+        print(f"[MS-Lance] Valor de lance invalido: {lance.value!r}")
+        return []
+
+    # checa se eh maior lance (com o incremento minimo)
+    if not state.ledger.accepts(value):
+        # Reentrega de um lance já aplicado cujo lance_validado pode não ter saído
+        if redelivered and state.ledger.contains(lance.user_id, value):
+            REPUBLISHED.inc()
+            print("[MS-Lance] lance reentregue ja validado, publicando de novo")
+            return lance_validado(lance, value, trace)
+
+        REFUSED.inc()
+        print("[MS-Lance] lance nao eh maior que atual!")
+        return []
+
+    # Requisito 4.4 - Se o lance for válido, o MS Lance publica o evento na fila lance_validado.
+    state.ledger.add(lance.user_id, value)
+
+    if shard.log is not None:
+        shard.log.log_lance(lance.leilao_id, lance.user_id, str(value))
+
+    print("[MS-Lance] lance validado!")
+    VALIDATED.inc()
+
+    return lance_validado(lance, value, trace)
+
+
+def apply_leilao_iniciado(shard: Shard, leilao: Leilao) -> list[Outgoing]:
+    # Somente aceitará o lance se: ID do leilão existir e se o leilão estiver ativo;
+    if leilao.id not in shard.leiloes:
+        shard.leiloes.add(leilao.id)
+
+        if shard.log is not None:
+            shard.log.log_iniciado(leilao.id)
+
+    return []
+
+
+def apply_leilao_finalizado(
+    shard: Shard, leilao_id: str, redelivered: bool = False
+) -> list[Outgoing]:
+    # Requisito 4.5 - Ao finalizar um leilão, deve publicar na fila leilao_vencedor,
+    # informando o ID do leilão, o ID do vencedor do leilão e o valor
+    # negociado. O vencedor é o que efetuou o maior lance válido até o
+    # encerramento.
+
+    # Remove o leilão finalizado dos leilões ativos
+    state = shard.leiloes.remove(leilao_id)
+
+    if state is None:
+        # Reentrega de um leilão já encerrado cujo leilao_vencedor pode não ter saído
+        if redelivered:
             try:
-                public_key.verify(
-                    b_signature,
-                    b_message,
-                    padding.PSS(
-                        mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH,
-                    ),
-                    hashes.SHA256(),
-                )
-            except Exception as e:
-                print("[MS-Lance] Exception: ", type(e))
+                winner = shard.leiloes.winner_of(leilao_id)
+            except KeyError:
+                pass
             else:
-                print("[MS-Lance] Assinatura valida!")
-
-                # checa se id do leilao existe em leiloes
-                if any(lance["leilao_id"] in d["id"] for d in leiloes):
-                    print("[MS-Lance] leilao existe!")
-                    # checa se eh maior lance
-                    lance_vencedor = [
-                        d.get("highest_bid")
-                        for d in leiloes
-                        if lance["leilao_id"] in d["id"]
-                    ]
-                    if int(lance["value"]) > int(lance_vencedor[0]):
-                        # Requisito 4.4 - Se o lance for válido, o MS Lance publica o evento na fila lance_validado.
-                        [
-                            d.update(highest_bid=lance["value"])
-                            for d in leiloes
-                            if lance["leilao_id"] in d["id"]
-                        ]
-                        [
-                            d.update(winner=lance["user_id"])
-                            for d in leiloes
-                            if lance["leilao_id"] in d["id"]
-                        ]
-                        channel.basic_publish(
-                            exchange=EXCHANGE_NAME,
-                            body=body,
-                            routing_key="lance_validado",
-                        )
-                        print("[MS-Lance] lance validado!")
-                    else:
-                        print("[MS-Lance] lance nao eh maior que atual!")
-                else:
-                    print("[MS-Lance] leilao nao existe!")
-
-        if method.routing_key == "leilao_iniciado":
-            # Somente aceitará o lance se: ID do leilão existir e se o leilão estiver ativo;
-            leilao = deserialize_leilao(body)
-            leilao["highest_bid"] = "0"
-            leilao["winner"] = "ninguem"
-            leiloes.append(leilao)
-
-        if method.routing_key == "leilao_finalizado":
-            # Requisito 4.5 - Ao finalizar um leilão, deve publicar na fila leilao_vencedor,
-            # informando o ID do leilão, o ID do vencedor do leilão e o valor
-            # negociado. O vencedor é o que efetuou o maior lance válido até o
-            # encerramento.
-
-            print("pacote recebido: ", body)
+                REPUBLISHED.inc()
+                print(
+                    f"[MS-Lance] leilao {leilao_id} ja finalizado, publicando de novo"
+                )
+                return leilao_vencedor(leilao_id, winner)
+
+        print("[MS-Lance] leilao finalizado nao existe!")
+        return []
+
+    if shard.log is not None:
+        shard.log.log_finalizado(leilao_id)
+
+    print(
+        f"[MS-Lance] leilao {leilao_id} finalizado com {len(state.ledger)} lances, "
+        f"maiores: {state.ledger.top(3)}"
+    )
+
+    return leilao_vencedor(leilao_id, state.ledger.winner())
+
+
+def record_verification(result, trace: dict) -> str | Exception:
+    # Registra os estágios medidos no worker e retorna o status da verificação. Uma
+    # falha no pool chega como exceção e segue como status.
+    if isinstance(result, Exception):
+        return result
+
+    status, timings = result
+
+    for stage, seconds in timings:
+        WORKER_TIMES[stage].record(seconds)
+        trace_log(trace, f"lance.{stage}", seconds)
+
+    if status != VERIFY_NO_KEY:
+        if any(stage == "chave_der" for stage, _ in timings):
+            KEY_CACHE_MISSES.inc()
+        else:
+            KEY_CACHE_HITS.inc()
+
+    return status
+
+
+def register_key(held: HeldLances, properties: pika.BasicProperties, body: bytes):
+    # Requisito 4.1 - Possui as chaves públicas de todos os clientes.
+    # O ID do usuário é a impressão digital da chave, e uma chave que não corresponde
+    # ao ID é recusada
+    try:
+        event = decode_event("chave", body, properties.content_type)
+    except (ValueError, struct.error):
+        MALFORMED.inc()
+        print("[MS-Lance] registro de chave mal formado!")
+        return
+
+    if keys.register(event.user_id, event.public_key):
+        KEY_REGISTRATIONS.inc()
+
+    public_key = keys.get(event.user_id)
+
+    if public_key is None:
+        REJECTED_KEYS.inc()
+        print("[MS-Lance] chave recusada!")
+        return
+
+    held.release(event.user_id, public_key)
+
+
+def submit_event(
+    pipeline: OrderedPipeline,
+    held: HeldLances,
+    shard: Shard,
+    routing_key: str,
+    properties: pika.BasicProperties,
+    body: bytes,
+    on_applied,
+    redelivered: bool = False,
+) -> None:
+    # Decodifica o evento e o envia ao pipeline. `on_applied` recebe as mensagens a
+    # publicar quando o evento for aplicado, na ordem de chegada do seu leilão.
+    # `redelivered` é o flag da entrega AMQP (ver o commit do log de estado acima).
+    if routing_key == "lance_realizado":
+        trace = trace_of(properties.headers)
+        start = time.perf_counter()
+
+        # A assinatura é verificada sobre os bytes recebidos, e o lance é
+        # decodificado uma única vez
+        try:
+            payload, signature = decode_signed(body, properties.content_type)
+            lance = decode_event("lance", payload, properties.content_type)
+        except (ValueError, struct.error):
+            MALFORMED.inc()
+            print("[MS-Lance] lance mal formado!")
+            on_applied([])
+            return
+
+        trace_log(trace, "lance.decodificacao", DECODE_TIME.record_since(start))
+        submitted = time.perf_counter()
+
+        def on_verified(result):
+            trace_log(trace, "lance.pipeline", PIPELINE_TIME.record_since(submitted))
+            status = record_verification(result, trace)
+
+            start = time.perf_counter()
+            outgoing = apply_lance(shard, lance, status, trace, redelivered)
+            trace_log(trace, "lance.estado", STATE_TIME.record_since(start))
+
+            on_applied(outgoing)
+
+        # A verificação roda no pool; o lance é aplicado quando todos os eventos
+        # anteriores do mesmo leilão já tiverem sido aplicados
+        public_key = keys.get(lance.user_id)
+
+        if public_key is None:
+            future = pipeline.hold(lance.leilao_id, on_verified)
+            held.hold(lance.user_id, future, signature, payload)
+            return
+
+        pipeline.submit(
+            lance.leilao_id,
+            on_verified,
+            verify_lance,
+            lance.user_id,
+            public_key,
+            signature,
+            payload,
+        )
+
+    elif routing_key == "leilao_iniciado":
+        try:
+            leilao = decode_event("leilao", body, properties.content_type)
+        except (ValueError, struct.error):
+            MALFORMED.inc()
+            print("[MS-Lance] leilao mal formado!")
+            on_applied([])
+            return
+
+        pipeline.submit(
+            leilao.id, lambda _: on_applied(apply_leilao_iniciado(shard, leilao))
+        )
+
+    elif routing_key == "leilao_finalizado":
+        try:
             leilao_id = body.decode("utf-8")
-            print("leilao id: ", leilao_id)
+        except UnicodeDecodeError:
+            MALFORMED.inc()
+            print("[MS-Lance] leilao finalizado mal formado!")
+            on_applied([])
+            return
 
-            lance_vencedor = next(
-                (d.get("highest_bid") for d in leiloes if leilao_id in d["id"]), None
-            )
+        pipeline.submit(
+            leilao_id,
+            lambda _: on_applied(
+                apply_leilao_finalizado(shard, leilao_id, redelivered)
+            ),
+        )
 
-            cliente_vencedor = next(
-                (d.get("winner") for d in leiloes if leilao_id in d["id"]), None
-            )
+    else:
+        on_applied([])
 
-            message = serialize_dict(
-                {
-                    "leilao_id": leilao_id,
-                    "lance_vencedor": lance_vencedor,
-                    "cliente_vencedor": cliente_vencedor,
-                }
-            )
 
-            # Remove o leilão finalizado da lista de leilões ativos
-            leiloes.remove(next(d for d in leiloes if leilao_id in d["id"]))
+def shard_for(routing_key: str) -> tuple[str, Shard | None]:
+    # "lance_realizado.3" -> ("lance_realizado", estado da partição 3)
+    event, partition = split_routing_key(routing_key)
 
-            cb = functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag)
-            connection.add_callback_threadsafe(cb)
+    if partition is None or partition >= PARTITIONS:
+        return event, None
+
+    shard = shards[partition]
+
+    # Recarrega o estado se outra instância foi dona da partição desde a última carga
+    shard.begin()
+
+    return event, shard
+
+
+def reset_shards() -> None:
+    # Nova conexão: as entregas em andamento voltaram para a fila, e a próxima
+    # entrega de cada partição confere o dono
+    for shard in shards:
+        shard.reset()
+
+
+def sync_state() -> None:
+    # Chamado antes de cada ack em lote: grava os registros dos eventos que serão
+    # confirmados, e de tempos em tempos um snapshot
+    for shard in shards:
+        shard.sync()
+
+
+def close_state() -> None:
+    loaded = [shard.partition for shard in shards if shard.log is not None]
+    print(f"[MS-Lance] Partições atendidas por {INSTANCE_ID}: {loaded}")
+
+    for shard in shards:
+        shard.close()
+
+    keys.close()
+
+
+def load_keys() -> None:
+    start = time.perf_counter()
+    loaded = keys.load()
+    print(
+        f"[MS-Lance] {loaded} chaves carregadas em {(time.perf_counter() - start) * 1000:.1f} ms"
+    )
 
-            channel.basic_publish(
-                exchange=EXCHANGE_NAME, body=message, routing_key="leilao_vencedor"
-            )
 
-    channel.basic_consume(
-        queue=queue_name, on_message_callback=on_message, auto_ack=False
+def main():
+    # Realiza a conexao com o RabbitMQ. Os eventos gerados saem pelos publicadores
+    # do Broker, com confirmação, e a conexão é refeita se cair
+    broker = Broker(exchange=EXCHANGE_NAME, publishers=PUBLISHERS)
+
+    # Requisito 4.2 - Escuta os eventos das filas lance_realizado, leilao_iniciado e leilao_finalizado.
+    # Uma fila compartilhada por partição, com os eventos "<evento>.<partição>"
+    queues = [
+        broker.declare_queue(
+            partition_queue(partition),
+            routing_keys=tuple(f"{event}.{partition}" for event in PARTITIONED_EVENTS),
+            durable=True,
+            arguments=QUEUE_ARGUMENTS,
+        )
+        for partition in range(PARTITIONS)
+    ]
+
+    # Registros de chaves: cada instância recebe todos, em uma fila própria
+    key_queue = broker.declare_queue(
+        "", routing_keys=("chave_registrada",), exclusive=True
     )
 
+    broker.set_qos(
+        PREFETCH_COUNT, ACK_BATCH_SIZE, ACK_MAX_DELAY_S, before_ack=sync_state
+    )
+
+    load_keys()
+
+    # As assinaturas são verificadas em paralelo, e os resultados voltam para a thread
+    # da conexão na ordem de chegada de cada leilão
+    pipeline = OrderedPipeline(create_executor(), broker.call_threadsafe)
+    held = HeldLances(
+        pipeline,
+        lambda delay, callback: broker.connection.call_later(delay, callback),
+        lambda user_id: broker.publish(f"chave_solicitada.{user_id}", b""),
+    )
+
+    # Os lances à espera de chave de uma conexão que caiu são descartados; eles
+    # voltam para a fila e são entregues de novo
+    broker.on_connect(held.expire_all)
+    broker.on_connect(reset_shards)
+
+    REGISTRY.gauge("lance_pipeline_pendentes", lambda: pipeline.pending)
+    REGISTRY.gauge("lance_chaves", lambda: len(keys))
+    REGISTRY.gauge("lance_aguardando_chave", lambda: len(held))
+    REGISTRY.gauge(
+        "lance_acks_pendentes",
+        lambda: broker.acker.stats()["waiting"] if broker.acker is not None else 0,
+    )
+    start_exporter("MS-Lance")
+
+    def publish_and_ack(
+        method, generation: int, shard: Shard, outgoing: list[Outgoing]
+    ):
+        # O evento só é confirmado depois de aplicado ao estado do leilão e de o
+        # broker confirmar os eventos gerados por ele. Os eventos de uma partição
+        # saem pelo mesmo publicador (ex.: o último lance_validado antes do
+        # leilao_vencedor)
+        shard.end()
+        broker.publish_then_ack(
+            [method.delivery_tag], generation, outgoing, order_key=str(shard.partition)
+        )
+
+    def on_message(method, properties, body):
+        event, shard = shard_for(method.routing_key)
+
+        if shard is None:
+            broker.done(method.delivery_tag, broker.generation)
+            return
+
+        submit_event(
+            pipeline,
+            held,
+            shard,
+            event,
+            properties,
+            body,
+            functools.partial(publish_and_ack, method, broker.generation, shard),
+            method.redelivered,
+        )
+
+    def on_key(method, properties, body):
+        register_key(held, properties, body)
+        broker.done(method.delivery_tag, broker.generation)
+
+    broker.consume(key_queue, on_key)
+
+    # Todas as instâncias consomem todas as partições; o broker entrega cada uma
+    # apenas à instância de maior prioridade
+    for partition, queue in enumerate(queues):
+        broker.consume(
+            queue,
+            on_message,
+            arguments={"x-priority": consumer_priority(INSTANCE_ID, partition)},
+        )
+
     print("[MS-Lance] Waiting for messages. To exit press CTRL+C")
 
     try:
-        channel.start_consuming()
+        broker.run()
     except KeyboardInterrupt:
         print("[MS-Lance] Exiting...")
-        connection.close()
 
-    if connection.is_open:
-        connection.close()
+    if worker_cache() is not None:
+        print(f"[MS-Lance] Cache de chaves: {worker_cache().stats()}")
+    print(f"[MS-Lance] Chaves: {keys.stats()}")
+    if broker.acker is not None:
+        print(f"[MS-Lance] Confirmações: {broker.acker.stats()}")
+    print(f"[MS-Lance] Métricas:\n{REGISTRY.summary()}")
+
+    broker.close()
+    close_state()
+    pipeline.shutdown(wait=False)
+
+    return 1
+
+
+async def main_async():
+    # Realiza a conexao com o RabbitMQ
+    broker = AsyncBroker(connection_parameters())
+    await broker.connect()
+    await broker.exchange_declare(EXCHANGE_NAME, "direct")
+
+    # Requisito 4.2 - Escuta os eventos das filas lance_realizado, leilao_iniciado e leilao_finalizado.
+    # Uma fila compartilhada por partição, com os eventos "<evento>.<partição>"
+    for partition in range(PARTITIONS):
+        queue_name = await broker.queue_declare(
+            partition_queue(partition), durable=True, arguments=QUEUE_ARGUMENTS
+        )
+
+        for event in PARTITIONED_EVENTS:
+            await broker.queue_bind(queue_name, EXCHANGE_NAME, f"{event}.{partition}")
+
+    # Registros de chaves: cada instância recebe todos, em uma fila própria
+    key_queue = await broker.queue_declare("", exclusive=True)
+    await broker.queue_bind(key_queue, EXCHANGE_NAME, "chave_registrada")
+
+    load_keys()
+
+    loop = asyncio.get_running_loop()
+    pipeline = OrderedPipeline(create_executor(), loop.call_soon_threadsafe)
+    held = HeldLances(
+        pipeline,
+        loop.call_later,
+        lambda user_id: broker.publish_nowait(
+            EXCHANGE_NAME,
+            f"chave_solicitada.{user_id}",
+            b"",
+            pika.BasicProperties(),
+        ),
+    )
+
+    REGISTRY.gauge("lance_pipeline_pendentes", lambda: pipeline.pending)
+    REGISTRY.gauge("lance_chaves", lambda: len(keys))
+    REGISTRY.gauge("lance_aguardando_chave", lambda: len(held))
+    start_exporter("MS-Lance")
+
+    def publish_and_ack(method, shard: Shard, outgoing: list[Outgoing]):
+        # As publicações saem na ordem de aplicação, sem esperar confirmação; o
+        # evento é confirmado quando o broker confirmar todas elas
+        shard.end()
+        confirms = [
+            broker.publish_nowait(EXCHANGE_NAME, routing_key, message, properties)
+            for routing_key, message, properties in outgoing
+        ]
+        broker.ack_after(method.delivery_tag, confirms)
+
+    def on_message(method, properties, body):
+        event, shard = shard_for(method.routing_key)
+
+        if shard is None:
+            broker.ack(method.delivery_tag)
+            return
+
+        submit_event(
+            pipeline,
+            held,
+            shard,
+            event,
+            properties,
+            body,
+            functools.partial(publish_and_ack, method, shard),
+            method.redelivered,
+        )
+
+    def on_key(method, properties, body):
+        register_key(held, properties, body)
+        broker.ack(method.delivery_tag)
+
+    # Todas as instâncias consomem todas as partições; o broker entrega cada uma
+    # apenas à instância de maior prioridade
+    for partition in range(PARTITIONS):
+        await broker.consume(
+            partition_queue(partition),
+            on_message,
+            PREFETCH_COUNT,
+            ACK_BATCH_SIZE,
+            ACK_MAX_DELAY_S,
+            before_ack=sync_state,
+            arguments={"x-priority": consumer_priority(INSTANCE_ID, partition)},
+        )
+    await broker.consume(
+        key_queue,
+        on_key,
+        PREFETCH_COUNT,
+        ACK_BATCH_SIZE,
+        ACK_MAX_DELAY_S,
+        before_ack=sync_state,
+    )
+    broker.install_signal_handlers()
+
+    print("[MS-Lance] Waiting for messages. To exit press CTRL+C")
+    await broker.wait_stopped()
+
+    print("[MS-Lance] Exiting...")
+    await broker.close(drained=lambda: pipeline.pending == 0)
+    pipeline.shutdown()
+    close_state()
+
+    if worker_cache() is not None:
+        print(f"[MS-Lance] Cache de chaves: {worker_cache().stats()}")
+    print(f"[MS-Lance] Chaves: {keys.stats()}")
+    print(f"[MS-Lance] Confirmações: {broker.acker.stats()}")
+    print(f"[MS-Lance] Métricas:\n{REGISTRY.summary()}")
 
     return 1
 
 
 if __name__ == "__main__":
-    main()
+    if ASYNC_RUNTIME:
+        asyncio.run(main_async())
+    else:
+        main()
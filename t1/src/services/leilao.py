@@ -1,5 +1,7 @@
 import pika
 import datetime
+import itertools
+import struct
 import uuid
 from faker import Faker
 
@@ -9,16 +11,34 @@ import os
 # Adiciona o diretório raiz do projeto ao sys.path para importar 'common'
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from common.serial import serialize_leilao
+from common.broker import Broker
+from common.catalog import parse_catalog, read_catalog
+from common.scheduler import DeadlineScheduler
+from common.serial import Leilao, encode_event
+from common.shards import partition_routing_key
 
 # Variáveis globais
+# Quantidade de leilões aleatórios quando nenhum catálogo é informado
 LEILOES = 3
+# Catálogo de leilões (python src/services/leilao.py <catalogo>)
+CATALOG_PATH = sys.argv[1] if len(sys.argv) > 1 else None
+# O catálogo é lido aos poucos: no máximo MAX_SCHEDULED leilões ficam agendados em
+# memória, lidos em blocos de CATALOG_CHUNK. Para isso o catálogo deve estar ordenado
+# pelo início dos leilões.
+MAX_SCHEDULED = 500_000
+CATALOG_CHUNK = 10_000
 EXCHANGE_NAME = "exchange"
+# Publicadores (conexões) usados para os eventos dos leilões
+PUBLISHERS = 1
 ID_SUMMARY_LENGTH = 8
+# Usa o formato binário de common/serial.py (False para JSON)
+WIRE_BINARY = True
 
 
-def generate_random_leilao():
-    fake = Faker()
+fake = Faker()
+
+
+def generate_random_leilao() -> Leilao:
     random_id = str(uuid.uuid4().hex)
     random_description = fake.sentence(5)
     random_start: datetime.datetime = fake.future_datetime(
@@ -26,91 +46,164 @@ def generate_random_leilao():
     )
     random_end: datetime.datetime = random_start + datetime.timedelta(seconds=20)
 
-    return {
-        "id": random_id,
-        "description": random_description,
-        "start": random_start,
-        "end": random_end,
-    }
+    return Leilao(random_id, random_description, random_start, random_end)
 
 
-def main():
-    # Requisito 3.1 - Mantém internamente uma lista pré-configurada (hardcoded) de leilões com: ID do leilão, descrição, data e hora de início e fim, status (ativo, encerrado).
-    leiloes: list[dict[str, any]] = []
-    for _ in range(LEILOES):
-        leiloes.append(generate_random_leilao())
+def publish_leilao_iniciado(broker: Broker, leilao: Leilao) -> None:
+    message, content_type = encode_event(leilao, binary=WIRE_BINARY)
+
+    # Requisito 3.2 - O leilão de um determinado produto deve ser iniciado quando o tempo definido para esse leilão for atingido. Quando um leilão começa, ele publica o evento na fila: leilao_iniciado.
+    # O início e o fim de um leilão saem pelo mesmo publicador, em ordem
+    properties = pika.BasicProperties(content_type=content_type)
+    broker.publish("leilao_iniciado", message, properties, order_key=leilao.id)
+
+    # Cópia para a partição do MS-Lance que atende o leilão
+    broker.publish(
+        partition_routing_key("leilao_iniciado", leilao.id),
+        message,
+        properties,
+        order_key=leilao.id,
+    )
+
+    print(
+        f"[MS-Leilao] Leilao com o id {leilao.id[:ID_SUMMARY_LENGTH]} foi iniciado."
+    )
+
 
-    # Realiza a conexao com o RabbitMQ
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host="localhost"))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="direct")
+def publish_leilao_finalizado(broker: Broker, leilao: Leilao) -> None:
+    message = leilao.id.encode("utf-8")
 
-    # Elabora uma lista das datas de inicio e fim
-    starts: list[datetime.datetime] = [leilao["start"] for leilao in leiloes]
-    ends: list[datetime.datetime] = [leilao["end"] for leilao in leiloes]
+    # Requisito 3.3 - O leilão de um determinado produto deve ser finalizado quando o tempo definido para esse leilão expirar. Quando um leilão termina, ele publica o evento na fila: leilao_finalizado.
+    broker.publish("leilao_finalizado", message, order_key=leilao.id)
 
-    sorted_starts: list[tuple[int, datetime.datetime]] = sorted(
-        enumerate(starts), key=lambda i: i[1]
+    # Cópia para a partição do MS-Lance que atende o leilão
+    broker.publish(
+        partition_routing_key("leilao_finalizado", leilao.id),
+        message,
+        order_key=leilao.id,
     )
-    sorted_ends: list[tuple[int, datetime.datetime]] = sorted(
-        enumerate(ends), key=lambda i: i[1]
+
+    print(
+        f"[MS-Leilao] Leilao com o id {leilao.id[:ID_SUMMARY_LENGTH]} foi finalizado."
+    )
+
+
+def skip_invalid(error: Exception) -> None:
+    print(f"[MS-Leilao] Leilão mal formado no catálogo, ignorado: {error}")
+
+
+def main():
+    # Requisito 3.1 - Mantém internamente uma lista pré-configurada (hardcoded) de leilões com: ID do leilão, descrição, data e hora de início e fim, status (ativo, encerrado).
+    if CATALOG_PATH is not None:
+        catalog = read_catalog(CATALOG_PATH, on_invalid=skip_invalid)
+    else:
+        catalog = (generate_random_leilao() for _ in range(LEILOES))
+
+    scheduler = DeadlineScheduler()
+    catalog_done = False
+
+    # Realiza a conexao com o RabbitMQ. Os eventos saem pelos publicadores do Broker,
+    # e a conexão é refeita se cair
+    broker = Broker(exchange=EXCHANGE_NAME, publishers=PUBLISHERS)
+
+    # Cadastro de leilões em lote durante a execução: cada mensagem em
+    # "leilao_cadastro" é um trecho de catálogo (JSONL ou binário), e cada mensagem
+    # em "leilao_cancelado" é o ID (UTF-8) de um leilão a cancelar
+    queue = broker.declare_queue(
+        "", routing_keys=("leilao_cadastro", "leilao_cancelado"), exclusive=True
     )
 
+    def on_cadastro(method, properties, body):
+        try:
+            count = scheduler.add_many(parse_catalog(body))
+        except (ValueError, struct.error):
+            print("[MS-Leilao] Lote de leilões mal formado!")
+            return
+
+        print(f"[MS-Leilao] {count} leilões cadastrados.")
+
+    def on_cancelado(method, properties, body):
+        try:
+            leilao_id = body.decode("utf-8")
+        except UnicodeDecodeError:
+            print("[MS-Leilao] Cancelamento mal formado!")
+            return
+
+        cancelled = scheduler.cancel(leilao_id)
+
+        if cancelled is None:
+            print(
+                f"[MS-Leilao] Leilao {leilao_id[:ID_SUMMARY_LENGTH]} não está agendado."
+            )
+            return
+
+        # Um leilão já iniciado é finalizado na hora, para que o MS-Lance o encerre e
+        # os clientes sejam notificados; um leilão que não começou só sai da agenda
+        leilao, started = cancelled
+
+        if started:
+            publish_leilao_finalizado(broker, leilao)
+
+        print(f"[MS-Leilao] Leilao {leilao_id[:ID_SUMMARY_LENGTH]} cancelado.")
+
+    def on_message(method, properties, body):
+        if method.routing_key == "leilao_cancelado":
+            on_cancelado(method, properties, body)
+        else:
+            on_cadastro(method, properties, body)
+
+    broker.consume(queue, on_message, auto_ack=True)
+
+    def step() -> float | None:
+        nonlocal catalog_done
+
+        # Lê mais um bloco do catálogo enquanto houver espaço na agenda
+        room = MAX_SCHEDULED - len(scheduler)
+
+        if not catalog_done and room > 0:
+            size = min(CATALOG_CHUNK, room)
+            chunk = []
+
+            # Os leilões mal formados são pulados; um registro truncado encerra a
+            # leitura, mas os leilões lidos antes dele são agendados
+            try:
+                chunk.extend(itertools.islice(catalog, size))
+            except (ValueError, struct.error, OSError) as e:
+                print(f"[MS-Leilao] Leitura do catálogo interrompida: {e}")
+                catalog_done = True
+
+            scheduler.add_many(chunk)
+            catalog_done = catalog_done or len(chunk) < size
+
+        # Dispara de uma vez todos os inícios e fins que já venceram
+        for kind, leilao in scheduler.pop_due(datetime.datetime.now()):
+            if kind == "inicio":
+                publish_leilao_iniciado(broker, leilao)
+            else:
+                publish_leilao_finalizado(broker, leilao)
+
+        # Dorme até o próximo prazo. O process_data_events mantém os heartbeats
+        # da conexão, recebe os cadastros e retorna antes se algum callback for
+        # agendado na conexão (ex.: um leilão adicionado por outra thread)
+        deadline = scheduler.next_deadline()
+
+        if not catalog_done and len(scheduler) < MAX_SCHEDULED:
+            return 0
+        if deadline is None:
+            # Nenhum leilão pendente: espera por novos cadastros
+            return None
+
+        return max(0.0, deadline - datetime.datetime.now().timestamp())
+
+    print("[MS-Leilao] Waiting for auctions. To exit press CTRL+C")
+
     try:
-        while True:
-            now = datetime.datetime.now()
-
-            has_elements_in_starts = len(sorted_starts) > 0
-            has_elements_in_ends = len(sorted_ends) > 0
-
-            # Verifica se há algum leilão pendente ou, em andamento
-            if not has_elements_in_starts and not has_elements_in_ends:
-                break
-
-            if has_elements_in_starts:
-                already_passed_start = sorted_starts[0][1] < now
-                start_element: dict[str, any] = leiloes[sorted_starts[0][0]]
-
-                if already_passed_start:
-                    message = serialize_leilao(start_element)
-
-                    # Requisito 3.2 - O leilão de um determinado produto deve ser iniciado quando o tempo definido para esse leilão for atingido. Quando um leilão começa, ele publica o evento na fila: leilao_iniciado.
-                    channel.basic_publish(
-                        exchange=EXCHANGE_NAME,
-                        routing_key="leilao_iniciado",
-                        body=message,
-                    )
-                    sorted_starts.pop(0)
-
-                    print(
-                        f"[MS-Leilao] Leilao com o id {start_element['id'][:ID_SUMMARY_LENGTH]} foi iniciado."
-                    )
-
-            if has_elements_in_ends:
-                already_passed_end = sorted_ends[0][1] < now
-                end_element: str = leiloes[sorted_ends[0][0]]["id"]
-
-                if already_passed_end:
-                    message = end_element.encode("utf-8")
-
-                    # Requisito 3.3 - O leilão de um determinado produto deve ser finalizado quando o tempo definido para esse leilão expirar. Quando um leilão termina, ele publica o evento na fila: leilao_finalizado.
-                    channel.basic_publish(
-                        exchange=EXCHANGE_NAME,
-                        routing_key="leilao_finalizado",
-                        body=message,
-                    )
-                    sorted_ends.pop(0)
-
-                    print(
-                        f"[MS-Leilao] Leilao com o id {end_element[:ID_SUMMARY_LENGTH]} foi finalizado."
-                    )
+        broker.run(step)
     except KeyboardInterrupt:
         print("[MS-Leilao] Exiting...")
-        connection.close()
 
-    if connection.is_open:
-        connection.close()
-        
+    broker.close()
+
     return 1
 
 
@@ -1,79 +1,344 @@
 import pika
+import asyncio
+import struct
 import sys
-import functools
 import os
+import time
 
 # Adiciona o diretório raiz do projeto ao sys.path para importar 'common'
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from common.serial import serialize_dict, deserialize_dict
+from common.aio import AsyncBroker
+from common.broker import Broker, connection_parameters
+from common.conflation import Conflator
+from common.metrics import (
+    REGISTRY,
+    start_exporter,
+    trace_age,
+    trace_log,
+    trace_of,
+)
+from common.serial import (
+    CONTENT_TYPE_BINARY,
+    HEADER_LEILAO_ID,
+    LanceAgregado,
+    decode_event,
+    encode_event,
+    encode_typed_json,
+)
 
 # Variáveis globais
 EXCHANGE_NAME = "exchange"
 
+# Runtime dos serviços: False usa o BlockingConnection, True usa o runtime asyncio
+# (publicações em pipeline com publisher confirms)
+ASYNC_RUNTIME = False
 
-def main():
-    # Realiza a conexao com o RabbitMQ
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host="localhost"))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type="direct")
+# Janela de mensagens não confirmadas e confirmação em lote
+PREFETCH_COUNT = 512
+ACK_BATCH_SIZE = 128
+ACK_MAX_DELAY_S = 0.05
 
-    # Cria uma fila com nome aleatória
-    result = channel.queue_declare(queue="", exclusive=True)
-    queue_name = result.method.queue
+# Publicadores (conexões) usados para as notificações
+PUBLISHERS = 2
 
-    # Conecta a fila criada com o exchange, aceitando apenas mensagens com o identificador "lance_validado" e "leilao_vencedor"
-    # Requisito 5.1 - Escuta os eventos das filas lance_validado e leilao_vencedor.
-    channel.queue_bind(
-        exchange=EXCHANGE_NAME, queue=queue_name, routing_key="lance_validado"
+# Agregação de lances: os lances validados de um mesmo leilão recebidos dentro da
+# janela são publicados como um único "lance_agregado", com o lance mais recente (o
+# maior, já que o MS-Lance só valida lances maiores) e a quantidade agregada. O
+# leilao_vencedor é sempre entregue na hora, depois do último estado do leilão.
+# 0 desativa. As entregas agregadas só são confirmadas no fim da janela, então a
+# vazão fica limitada a cerca de PREFETCH_COUNT / CONFLATION_WINDOW_S mensagens/s.
+CONFLATION_WINDOW_S = 0.0
+
+# Métricas (common/metrics.py): roteamento de cada entrega e idade do lance ao chegar
+# ao MS-Notificacao (desde o envio pelo cliente, medida pelos relógios das máquinas)
+ROUTE_TIME = REGISTRY.histogram("notificacao_roteamento_seconds")
+BID_AGE = REGISTRY.histogram("notificacao_idade_lance_seconds")
+RECEIVED = REGISTRY.counter("notificacao_recebidas")
+CONFLATED = REGISTRY.counter("notificacao_lances_agregados")
+MALFORMED = REGISTRY.counter("notificacao_mal_formadas")
+
+
+# Requisito 5.2 - Publica esses eventos nas filas específicas para cada leilão, de acordo com o seu ID (leilao_1, leilao_2, ...), de modo que somente os consumidores interessados nesses leilões recebam as notificações correspondentes.
+def route(
+    routing_key: str, properties: pika.BasicProperties, body: bytes
+) -> tuple[str, bytes, str]:
+    # Retorna a routing key do leilão, o corpo a publicar e o tipo do evento, que
+    # segue na propriedade `type` da notificação
+    leilao_id = (properties.headers or {}).get(HEADER_LEILAO_ID)
+
+    # O tipo e o leilão vêm nas propriedades: o corpo é repassado sem decodificar
+    if leilao_id is not None and properties.type == routing_key:
+        return f"leilao_{leilao_id}", body, routing_key
+
+    # Eventos sem as propriedades são decodificados (e validados) para descobrir o
+    # leilão
+    event = decode_event(routing_key, body, properties.content_type)
+
+    # No formato binário o tipo já vem no cabeçalho, e o corpo segue inalterado; em
+    # JSON o tipo vai na chave "type"
+    if properties.content_type != CONTENT_TYPE_BINARY:
+        body = encode_typed_json(event)
+
+    return f"leilao_{event.leilao_id}", body, routing_key
+
+
+def route_or_drop(
+    routing_key: str, properties: pika.BasicProperties, body: bytes
+) -> tuple[str, bytes, str] | None:
+    # Um evento que não pode ser decodificado é descartado (e confirmado por quem
+    # chamou), sem derrubar o consumidor
+    try:
+        return route(routing_key, properties, body)
+    except (ValueError, struct.error) as e:
+        MALFORMED.inc()
+        print(f"[MS-Notificacao] Evento mal formado descartado: {e}")
+        return None
+
+
+def observe(properties: pika.BasicProperties, start: float) -> dict:
+    # Registra as métricas de uma entrega roteada e retorna o rastreamento a repassar
+    trace = trace_of(properties.headers)
+    trace_log(trace, "notificacao.roteamento", ROUTE_TIME.record_since(start))
+
+    age = trace_age(trace)
+    if age is not None:
+        BID_AGE.record(age)
+
+    RECEIVED.inc()
+
+    return trace
+
+
+def aggregate(
+    body: bytes, content_type: str | None, count: int
+) -> tuple[bytes, str | None, str]:
+    # Monta o lance agregado a partir do lance validado mais recente. Se ele não
+    # puder ser decodificado, segue como um lance validado comum, sem decodificar
+    try:
+        event = decode_event("lance_validado", body, content_type)
+    except (ValueError, struct.error) as e:
+        MALFORMED.inc()
+        print(f"[MS-Notificacao] Lance validado mal formado, não agregado: {e}")
+        return body, content_type, "lance_validado"
+
+    aggregated = LanceAgregado(event.user_id, event.leilao_id, event.value, count)
+
+    body, content_type = encode_event(
+        aggregated, binary=content_type == CONTENT_TYPE_BINARY
     )
-    channel.queue_bind(
-        exchange=EXCHANGE_NAME, queue=queue_name, routing_key="leilao_vencedor"
+
+    # Em JSON o tipo também segue no corpo
+    if content_type != CONTENT_TYPE_BINARY:
+        body = encode_typed_json(aggregated)
+
+    return body, content_type, "lance_agregado"
+
+
+def main():
+    # Realiza a conexao com o RabbitMQ. As notificações saem pelos publicadores do
+    # Broker, com confirmação, e a conexão é refeita se cair
+    broker = Broker(exchange=EXCHANGE_NAME, publishers=PUBLISHERS)
+
+    # Requisito 5.1 - Escuta os eventos das filas lance_validado e leilao_vencedor.
+    queue = broker.declare_queue(
+        "", routing_keys=("lance_validado", "leilao_vencedor"), exclusive=True
     )
+    broker.set_qos(PREFETCH_COUNT, ACK_BATCH_SIZE, ACK_MAX_DELAY_S)
+
+    def publish(
+        delivery_tags: list[int],
+        routing_key: str,
+        body: bytes,
+        content_type: str | None,
+        kind: str,
+        trace: dict,
+    ) -> None:
+        # As entregas são confirmadas quando a notificação for confirmada
+        properties = pika.BasicProperties(
+            content_type=content_type, type=kind, headers=trace or None
+        )
+        broker.publish_then_ack(
+            delivery_tags, broker.generation, [(routing_key, body, properties)]
+        )
+
+    def on_flush(routing_key, item, count, delivery_tags):
+        body, content_type, trace = item
+        kind = "lance_validado"
+
+        if count > 1:
+            body, content_type, kind = aggregate(body, content_type, count)
+            CONFLATED.inc(count - 1)
+
+        publish(delivery_tags, routing_key, body, content_type, kind, trace)
+
+    conflator = None
+
+    def on_connect():
+        nonlocal conflator
+
+        # As janelas abertas na conexão anterior têm entregas que o broker já
+        # devolveu para a fila
+        if CONFLATION_WINDOW_S > 0:
+            conflator = Conflator(
+                broker.connection.call_later, CONFLATION_WINDOW_S, on_flush
+            )
 
-    # Requisito 5.2 - Publica esses eventos nas filas específicas para cada leilão, de acordo com o seu ID (leilao_1, leilao_2, ...), de modo que somente os consumidores interessados nesses leilões recebam as notificações correspondentes.
-    def on_message(ch, method, properties, body):
-        json_body = deserialize_dict(body)
-
-        if method.routing_key == "lance_validado":
-            assert json_body["user_id"]
-            assert json_body["leilao_id"]
-            assert json_body["value"]
-
-            json_body["type"] = "lance_validado"
-        elif method.routing_key == "leilao_vencedor":
-            assert json_body["leilao_id"]
-            assert json_body["lance_vencedor"]
-            assert json_body["cliente_vencedor"]
-
-            json_body["type"] = "leilao_vencedor"
-
-        routing_key = f"leilao_{json_body['leilao_id']}"
-        print(f"[debug] Mensagem recebida com a routing key |{routing_key}|")
-        channel.basic_publish(
-            exchange=EXCHANGE_NAME,
-            routing_key=routing_key,
-            body=serialize_dict(json_body),
+    broker.on_connect(on_connect)
+
+    def on_message(method, properties, body):
+        start = time.perf_counter()
+        routed = route_or_drop(method.routing_key, properties, body)
+
+        if routed is None:
+            broker.done(method.delivery_tag, broker.generation)
+            return
+
+        routing_key, body, kind = routed
+        trace = observe(properties, start)
+
+        if conflator is not None:
+            if kind == "lance_validado":
+                conflator.add(
+                    routing_key,
+                    (body, properties.content_type, trace),
+                    method.delivery_tag,
+                )
+                return
+
+            conflator.flush(routing_key)
+
+        publish(
+            [method.delivery_tag],
+            routing_key,
+            body,
+            properties.content_type,
+            kind,
+            trace,
         )
 
-        cb = functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag)
-        connection.add_callback_threadsafe(cb)
+    broker.consume(queue, on_message)
 
-    channel.basic_consume(queue=queue_name, on_message_callback=on_message)
+    REGISTRY.gauge(
+        "notificacao_janelas_abertas",
+        lambda: conflator.pending if conflator is not None else 0,
+    )
+    start_exporter("MS-Notificacao")
 
     print("[MS-Notificacao] Waiting for messages. To exit press CTRL+C")
-    
+
     try:
-        channel.start_consuming()
+        broker.run()
     except KeyboardInterrupt:
+        if conflator is not None and broker.is_connected:
+            conflator.flush_all()
+
         print("[MS-Notificacao] Exiting...")
-        connection.close()
-        
-    if connection.is_open:
-        connection.close()
-        
+
+    print(f"[MS-Notificacao] Métricas:\n{REGISTRY.summary()}")
+    broker.close()
+
+    return 1
+
+
+async def main_async():
+    # Realiza a conexao com o RabbitMQ
+    broker = AsyncBroker(connection_parameters())
+    await broker.connect()
+    await broker.exchange_declare(EXCHANGE_NAME, "direct")
+
+    # Requisito 5.1 - Escuta os eventos das filas lance_validado e leilao_vencedor.
+    queue_name = await broker.queue_declare("", exclusive=True)
+    await broker.queue_bind(queue_name, EXCHANGE_NAME, "lance_validado")
+    await broker.queue_bind(queue_name, EXCHANGE_NAME, "leilao_vencedor")
+
+    def publish(
+        routing_key: str,
+        body: bytes,
+        content_type: str | None,
+        kind: str,
+        trace: dict,
+    ):
+        return broker.publish_nowait(
+            EXCHANGE_NAME,
+            routing_key,
+            body,
+            pika.BasicProperties(
+                content_type=content_type, type=kind, headers=trace or None
+            ),
+        )
+
+    def on_flush(routing_key, item, count, delivery_tags):
+        body, content_type, trace = item
+        kind = "lance_validado"
+
+        if count > 1:
+            body, content_type, kind = aggregate(body, content_type, count)
+            CONFLATED.inc(count - 1)
+
+        confirm = publish(routing_key, body, content_type, kind, trace)
+
+        for delivery_tag in delivery_tags:
+            broker.ack_after(delivery_tag, [confirm])
+
+    conflator = None
+    if CONFLATION_WINDOW_S > 0:
+        conflator = Conflator(
+            asyncio.get_running_loop().call_later, CONFLATION_WINDOW_S, on_flush
+        )
+
+    def on_message(method, properties, body):
+        # Não espera a confirmação do broker para seguir para a próxima entrega;
+        # a entrega é confirmada quando a notificação for confirmada
+        start = time.perf_counter()
+        routed = route_or_drop(method.routing_key, properties, body)
+
+        if routed is None:
+            broker.ack(method.delivery_tag)
+            return
+
+        routing_key, body, kind = routed
+        trace = observe(properties, start)
+
+        if conflator is not None:
+            if kind == "lance_validado":
+                conflator.add(
+                    routing_key,
+                    (body, properties.content_type, trace),
+                    method.delivery_tag,
+                )
+                return
+
+            conflator.flush(routing_key)
+
+        confirm = publish(routing_key, body, properties.content_type, kind, trace)
+        broker.ack_after(method.delivery_tag, [confirm])
+
+    def drained() -> bool:
+        # Publica o que ainda está na janela de agregação
+        if conflator is not None:
+            conflator.flush_all()
+
+        return True
+
+    await broker.consume(
+        queue_name, on_message, PREFETCH_COUNT, ACK_BATCH_SIZE, ACK_MAX_DELAY_S
+    )
+    broker.install_signal_handlers()
+    start_exporter("MS-Notificacao")
+
+    print("[MS-Notificacao] Waiting for messages. To exit press CTRL+C")
+    await broker.wait_stopped()
+
+    print("[MS-Notificacao] Exiting...")
+    await broker.close(drained)
+    print(f"[MS-Notificacao] Métricas:\n{REGISTRY.summary()}")
+
     return 1
 
 
 if __name__ == "__main__":
-    main()
+    if ASYNC_RUNTIME:
+        asyncio.run(main_async())
+    else:
+        main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Adiciona o diretório src ao sys.path para importar 'common'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
@@ -0,0 +1,114 @@
+from common.acks import BatchAcker
+
+
+class FakeChannel:
+    def __init__(self):
+        self.calls = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.calls.append(("ack", delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+class FakeTimers:
+    def __init__(self):
+        self.pending = []
+
+    def call_later(self, delay, callback):
+        self.pending.append(callback)
+        return callback
+
+    def fire(self):
+        pending, self.pending = self.pending, []
+        for callback in pending:
+            callback()
+
+
+def make_acker(batch_size=3, before_ack=None):
+    channel = FakeChannel()
+    timers = FakeTimers()
+    acker = BatchAcker(
+        channel, timers.call_later, batch_size=batch_size, before_ack=before_ack
+    )
+
+    return acker, channel, timers
+
+
+def test_acks_contiguous_prefix():
+    acker, channel, _ = make_acker(batch_size=3)
+
+    # A tag 1 ainda não terminou: nada pode ser confirmado
+    for tag in (2, 3, 4):
+        acker.done(tag)
+
+    assert channel.calls == []
+
+    acker.done(1)
+
+    assert channel.calls == [("ack", 4, True)]
+    assert acker.stats()["messages_acked"] == 4
+    assert acker.stats()["waiting"] == 0
+
+
+def test_timer_flushes_partial_batch():
+    acker, channel, timers = make_acker(batch_size=10)
+    acker.done(1)
+    acker.done(3)
+
+    timers.fire()
+
+    assert channel.calls == [("ack", 1, True)]
+    assert acker.stats()["waiting"] == 1
+
+
+def test_before_ack_runs_before_each_batch():
+    commits = []
+    acker, channel, _ = make_acker(
+        batch_size=2, before_ack=lambda: commits.append(len(channel.calls))
+    )
+
+    for tag in (1, 2, 3, 4):
+        acker.done(tag)
+
+    assert commits == [0, 1]
+    assert channel.calls == [("ack", 2, True), ("ack", 4, True)]
+
+
+def test_rejected_tag_is_never_acked():
+    acker, channel, _ = make_acker(batch_size=3)
+    acker.done(1)
+    acker.done(2)
+    acker.reject(3)
+
+    # O ack em lote para antes da tag recusada
+    assert channel.calls == [("nack", 3, True), ("ack", 2, True)]
+
+    stats = acker.stats()
+    assert stats["messages_acked"] == 2
+    assert stats["messages_rejected"] == 1
+
+
+def test_only_rejected_tags_send_no_ack():
+    acker, channel, timers = make_acker(batch_size=10)
+    acker.reject(1, requeue=False)
+    acker.reject(2)
+
+    timers.fire()
+
+    assert channel.calls == [("nack", 1, False), ("nack", 2, True)]
+    assert acker.stats()["waiting"] == 0
+
+
+def test_reset_restarts_tags():
+    acker, channel, timers = make_acker(batch_size=10)
+    acker.done(1)
+    acker.done(3)
+
+    acker.reset()
+    acker.done(1)
+    timers.fire()
+
+    assert channel.calls == [("ack", 1, True)]
+    assert acker.stats()["waiting"] == 0
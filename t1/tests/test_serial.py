@@ -0,0 +1,114 @@
+import struct
+import uuid
+from datetime import datetime
+
+import pytest
+
+from common.serial import (
+    CONTENT_TYPE_BINARY,
+    CONTENT_TYPE_JSON,
+    Lance,
+    LanceValidado,
+    Leilao,
+    LeilaoVencedor,
+    decode_event,
+    decode_signed,
+    decode_typed_event,
+    encode_event,
+    encode_signed,
+    encode_typed_json,
+)
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex
+
+
+EVENTS = [
+    Leilao(new_id(), "Um leilão", datetime(2025, 1, 1, 12), datetime(2025, 1, 1, 13)),
+    Lance(new_id(), new_id(), "150"),
+    LanceValidado(new_id(), new_id(), "200"),
+    LeilaoVencedor(new_id(), "200", new_id()),
+]
+
+
+@pytest.mark.parametrize("binary", [True, False])
+@pytest.mark.parametrize("event", EVENTS, ids=lambda event: event.KIND)
+def test_event_round_trip(event, binary):
+    body, content_type = encode_event(event, binary=binary)
+
+    assert content_type == (CONTENT_TYPE_BINARY if binary else CONTENT_TYPE_JSON)
+    assert decode_event(event.KIND, body, content_type) == event
+
+
+def test_binary_falls_back_to_json():
+    # "ninguem" não é um uuid4 e não cabe no formato binário
+    event = LeilaoVencedor(new_id(), "0", "ninguem")
+    body, content_type = encode_event(event, binary=True)
+
+    assert content_type == CONTENT_TYPE_JSON
+    assert decode_event("leilao_vencedor", body, content_type) == event
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_typed_round_trip(binary):
+    event = LanceValidado(new_id(), new_id(), "10")
+
+    if binary:
+        body, content_type = encode_event(event, binary=True)
+    else:
+        body, content_type = encode_typed_json(event), CONTENT_TYPE_JSON
+
+    assert decode_typed_event(body, content_type) == event
+
+
+def test_decode_wrong_kind():
+    body, content_type = encode_event(EVENTS[1], binary=True)
+
+    with pytest.raises(ValueError):
+        decode_event("leilao", body, content_type)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b"[]", b'{"user_id": "u"}', b'{"user_id": 1, "leilao_id": "l", "value": "1"}'],
+)
+def test_decode_invalid_json(body):
+    with pytest.raises(ValueError):
+        decode_event("lance", body, CONTENT_TYPE_JSON)
+
+
+def test_decode_truncated_binary():
+    body, content_type = encode_event(EVENTS[0], binary=True)
+
+    with pytest.raises((ValueError, struct.error)):
+        decode_event("leilao", body[:-3], content_type)
+
+
+@pytest.mark.parametrize("body", [b"[]", b'{"type": "desconhecido"}', b'{"type": 1}'])
+def test_decode_typed_invalid(body):
+    with pytest.raises(ValueError):
+        decode_typed_event(body, CONTENT_TYPE_JSON)
+
+
+@pytest.mark.parametrize("content_type", [CONTENT_TYPE_BINARY, CONTENT_TYPE_JSON])
+def test_signed_round_trip(content_type):
+    payload, _ = encode_event(EVENTS[1], binary=content_type == CONTENT_TYPE_BINARY)
+    body = encode_signed(payload, b"\x00assinatura\xff", content_type)
+
+    assert decode_signed(body, content_type) == (payload, b"\x00assinatura\xff")
+
+
+@pytest.mark.parametrize(
+    "body", [b"[]", b'{"payload": "x"}', b'{"payload": 1, "signature": ""}']
+)
+def test_decode_signed_invalid_json(body):
+    with pytest.raises(ValueError):
+        decode_signed(body, CONTENT_TYPE_JSON)
+
+
+def test_decode_signed_not_an_envelope():
+    body, content_type = encode_event(EVENTS[1], binary=True)
+
+    with pytest.raises(ValueError):
+        decode_signed(body, content_type)
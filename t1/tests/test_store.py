@@ -0,0 +1,112 @@
+import pytest
+
+from common.store import MAX_BID, BidLedger, LeilaoStore
+
+
+def test_accepts_min_increment():
+    ledger = BidLedger(min_increment=10)
+
+    assert ledger.minimum_bid() == 10
+    assert not ledger.accepts(9)
+    assert ledger.accepts(10)
+
+    ledger.add("a", 10)
+
+    assert not ledger.accepts(19)
+    assert ledger.accepts(20)
+
+
+def test_rejects_values_outside_int64():
+    ledger = BidLedger()
+
+    assert ledger.accepts(MAX_BID)
+    assert not ledger.accepts(MAX_BID + 1)
+
+
+def test_add_overflow_leaves_ledger_unchanged():
+    ledger = BidLedger()
+    ledger.add("a", 5)
+
+    with pytest.raises(OverflowError):
+        ledger.add("b", MAX_BID + 1)
+
+    assert len(ledger) == 1
+    assert ledger.highest() == ("a", 5)
+    assert ledger.best_bids() == [("a", 5)]
+
+
+def test_ranking_keeps_best_bid_per_user():
+    ledger = BidLedger()
+
+    for user_id, value in [("a", 1), ("b", 2), ("a", 3), ("c", 4), ("b", 5)]:
+        ledger.add(user_id, value)
+
+    assert ledger.highest() == ("b", 5)
+    assert ledger.top(3) == [("b", 5), ("c", 4), ("a", 3)]
+    assert ledger.best_bids() == [("a", 3), ("b", 5), ("c", 4)]
+    assert ledger.history() == [("a", 1), ("b", 2), ("a", 3), ("c", 4), ("b", 5)]
+    assert len(ledger) == 5
+
+
+def test_disqualify_promotes_next_bidder():
+    ledger = BidLedger()
+
+    for user_id, value in [("a", 1), ("b", 2), ("c", 3)]:
+        ledger.add(user_id, value)
+
+    assert ledger.disqualify("c") == ("b", 2)
+    assert ledger.top(5) == [("b", 2), ("a", 1)]
+    assert ledger.disqualified() == ["c"]
+    # O próximo lance precisa superar o novo líder, e não o desclassificado
+    assert ledger.minimum_bid() == 3
+
+
+def test_winner_needs_reserve():
+    ledger = BidLedger(reserve=100)
+    ledger.add("a", 99)
+
+    assert ledger.winner() is None
+
+    ledger.add("b", 100)
+
+    assert ledger.winner() == ("b", 100)
+
+
+def test_contains():
+    ledger = BidLedger()
+
+    for user_id, value in [("a", 1), ("b", 2), ("a", 3)]:
+        ledger.add(user_id, value)
+
+    assert ledger.contains("a", 1)
+    assert ledger.contains("a", 3)
+    assert not ledger.contains("a", 2)
+    assert not ledger.contains("b", 3)
+    assert not ledger.contains("c", 1)
+
+
+def test_store_keeps_recent_results():
+    store = LeilaoStore(retain_results=2)
+
+    for leilao_id, bid in [("l1", 10), ("l2", None), ("l3", 30)]:
+        ledger = store.add(leilao_id).ledger
+
+        if bid is not None:
+            ledger.add("u", bid)
+
+        store.remove(leilao_id)
+
+    assert store.results() == [("l2", None), ("l3", ("u", 30))]
+    assert store.winner_of("l3") == ("u", 30)
+    assert store.winner_of("l2") is None
+
+    with pytest.raises(KeyError):
+        store.winner_of("l1")
+
+
+def test_repeated_add_keeps_state():
+    store = LeilaoStore()
+    store.add("l").ledger.add("u", 10)
+
+    assert store.add("l").highest_bid == 10
+    assert "l" in store and len(store) == 1
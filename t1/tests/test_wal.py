@@ -0,0 +1,179 @@
+import os
+import zlib
+
+import pytest
+
+from common.store import LeilaoStore
+from common.wal import _CRC, _SNAPSHOT_HEADER, WriteAheadLog, _pack_fields
+
+
+def open_log(directory, **kwargs) -> tuple[LeilaoStore, WriteAheadLog, int]:
+    store = LeilaoStore()
+    log = WriteAheadLog(str(directory), fsync=False, **kwargs)
+    replayed = log.recover(store)
+
+    return store, log, replayed
+
+
+def bid(store, log, leilao_id, user_id, value):
+    store.get(leilao_id).ledger.add(user_id, value)
+    log.log_lance(leilao_id, user_id, str(value))
+
+
+def start(store, log, leilao_id):
+    store.add(leilao_id)
+    log.log_iniciado(leilao_id)
+
+
+def finish(store, log, leilao_id):
+    store.remove(leilao_id)
+    log.log_finalizado(leilao_id)
+
+
+def segments(directory) -> list[str]:
+    return sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+
+
+def test_replay(tmp_path):
+    store, log, _ = open_log(tmp_path)
+    start(store, log, "a")
+    start(store, log, "b")
+    bid(store, log, "a", "u", 5)
+    bid(store, log, "a", "v", 7)
+    finish(store, log, "b")
+    log.close()
+
+    store, log, replayed = open_log(tmp_path)
+
+    assert replayed == 5
+    assert store.get("a").ledger.history() == [("u", 5), ("v", 7)]
+    assert "b" not in store
+    assert store.winner_of("b") is None
+
+
+def test_uncommitted_records_are_lost(tmp_path):
+    store, log, _ = open_log(tmp_path)
+    start(store, log, "a")
+    log.commit()
+    bid(store, log, "a", "u", 5)
+    log.close(commit=False)
+
+    store, log, replayed = open_log(tmp_path)
+
+    assert replayed == 1
+    assert len(store.get("a").ledger) == 0
+
+
+def test_truncates_interrupted_write(tmp_path):
+    store, log, _ = open_log(tmp_path)
+    start(store, log, "a")
+    bid(store, log, "a", "u", 5)
+    log.close()
+
+    path = os.path.join(tmp_path, segments(tmp_path)[-1])
+    size = os.path.getsize(path)
+    os.truncate(path, size - 2)
+
+    store, log, replayed = open_log(tmp_path)
+
+    assert replayed == 1
+    assert len(store.get("a").ledger) == 0
+    # O registro incompleto sai do segmento, e a recuperação seguinte é igual
+    assert os.path.getsize(path) < size - 2
+
+    log.close()
+    store, log, replayed = open_log(tmp_path)
+
+    assert replayed == 1
+
+
+def test_corrupted_middle_segment(tmp_path):
+    store, log, _ = open_log(tmp_path)
+    start(store, log, "a")
+    log.close()
+
+    store, log, _ = open_log(tmp_path)
+    bid(store, log, "a", "u", 5)
+    log.close()
+
+    path = os.path.join(tmp_path, segments(tmp_path)[0])
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"\x00")
+
+    with pytest.raises(ValueError):
+        open_log(tmp_path)
+
+
+def test_snapshot_keeps_summary_and_results(tmp_path):
+    store, log, _ = open_log(tmp_path)
+    start(store, log, "a")
+    start(store, log, "b")
+
+    for user_id, value in [("u", 1), ("v", 2), ("u", 3), ("w", 4)]:
+        bid(store, log, "a", user_id, value)
+
+    store.get("a").ledger.disqualify("w")
+    bid(store, log, "b", "u", 9)
+    finish(store, log, "b")
+    log.snapshot(store)
+
+    # Registros depois do snapshot vão para um segmento novo
+    bid(store, log, "a", "v", 10)
+    log.close()
+
+    assert len(segments(tmp_path)) == 1
+
+    store, log, replayed = open_log(tmp_path)
+    ledger = store.get("a").ledger
+
+    assert replayed == 1
+    assert ledger.best_bids() == [("u", 3), ("v", 10), ("w", 4)]
+    assert ledger.disqualified() == ["w"]
+    assert ledger.highest() == ("v", 10)
+    assert store.winner_of("b") == ("u", 9)
+
+
+def test_maybe_snapshot(tmp_path):
+    store, log, _ = open_log(tmp_path, snapshot_every=3)
+    start(store, log, "a")
+    bid(store, log, "a", "u", 1)
+
+    assert not log.maybe_snapshot(store)
+
+    bid(store, log, "a", "u", 2)
+
+    assert log.maybe_snapshot(store)
+    assert log.stats()["snapshots"] == 1
+
+
+def write_snapshot(directory, magic: bytes, count: int, fields: tuple) -> None:
+    content = magic + _SNAPSHOT_HEADER.pack(1, count) + _pack_fields(fields)
+
+    with open(os.path.join(directory, "snapshot"), "wb") as f:
+        f.write(content + _CRC.pack(zlib.crc32(content)))
+
+
+def test_reads_snapshot_v1(tmp_path):
+    write_snapshot(tmp_path, b"LSNP\x01", 2, ("a", "7", "u", "b", "0", "ninguem"))
+
+    store, log, _ = open_log(tmp_path)
+
+    assert store.get("a").ledger.highest() == ("u", 7)
+    assert store.get("b").ledger.highest() is None
+
+
+def test_reads_snapshot_v2(tmp_path):
+    write_snapshot(tmp_path, b"LSNP\x02", 1, ("a", "2", "u", "1", "v", "2", "1", "v"))
+
+    store, log, _ = open_log(tmp_path)
+
+    assert store.get("a").ledger.highest() == ("u", 1)
+    assert store.results() == []
+
+
+def test_corrupted_snapshot(tmp_path):
+    write_snapshot(tmp_path, b"LSNP\x02", 2, ("a", "0", "0"))
+
+    with pytest.raises(ValueError):
+        open_log(tmp_path)
@@ -1,11 +1,19 @@
+import heapq
+import math
 import random
+import sys
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from collections import deque
 from datetime import datetime
 from time import sleep
 from PyThreadKiller import PyThreadKiller
 
 import Pyro5
 from Pyro5.api import locate_ns, Proxy
+from Pyro5.errors import CommunicationError, NamingError
 from Pyro5.server import Daemon
 from simple_term_menu import TerminalMenu
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -20,12 +28,511 @@ def print_with_time(message: str) -> None:
     print(f" [{formatted_time}] {message}")
 
 
+class PeerDirectory(object):
+    # Cache dos URIs dos peers e proxies persistentes para cada um, reutilizados entre
+    # heartbeats e requisicoes (uma conexao TCP por proxy, e nao uma por chamada).
+    #
+    # Um proxy do Pyro pertence a uma thread por vez: cada chamada tira um proxy livre
+    # do conjunto do peer (ou cria um), assume a posse dele e o devolve no fim. Uma
+    # falha de comunicacao descarta o URI e as conexoes do peer, e a proxima chamada
+    # consulta o servidor de nomes de novo. refresh() compara o cache com o servidor
+    # de nomes, para detectar peers que se registraram de novo com outro URI.
+
+    # Proxies livres mantidos por peer. Cada conexao aberta ocupa uma thread do daemon
+    # do outro peer enquanto existir (THREADPOOL_SIZE do Pyro, 80 por padrao)
+    pool_size: int = 2
+    # Intervalo minimo entre comparacoes do cache com o servidor de nomes
+    refresh_s: int = 10
+
+    def __init__(self):
+        # _lock protege o cache e os proxies livres e nunca e segurado durante uma
+        # chamada remota; o proxy do servidor de nomes tem o seu proprio lock, para que
+        # um servidor de nomes lento so atrase quem precisa dele (URI fora do cache)
+        self._lock = threading.Lock()
+        self._name_server_lock = threading.Lock()
+        self._name_server = None
+        self._uris: dict[str, Pyro5.core.URI] = {}
+        self._idle: dict[str, list[Proxy]] = {}
+        self._last_refresh: float = 0
+
+    def _name_server_call(self, method: str, *args):
+        with self._name_server_lock:
+            try:
+                if self._name_server is None:
+                    self._name_server = locate_ns()
+
+                self._name_server._pyroClaimOwnership()
+                return getattr(self._name_server, method)(*args)
+            except CommunicationError:
+                # O servidor de nomes caiu ou mudou de endereco: localiza de novo
+                self._name_server = None
+                raise
+
+    def lookup(self, peer_name: str) -> Pyro5.core.URI:
+        uri = self._uris.get(peer_name)
+
+        if uri is None:
+            uri = self._name_server_call("lookup", peer_name)
+
+            with self._lock:
+                self._uris[peer_name] = uri
+
+        return uri
+
+    def _acquire(self, peer_name: str) -> Proxy:
+        uri = self.lookup(peer_name)
+
+        with self._lock:
+            idle = self._idle.get(peer_name)
+            proxy = idle.pop() if idle else None
+
+        if proxy is None:
+            proxy = Proxy(uri)
+
+        proxy._pyroClaimOwnership()
+        return proxy
+
+    def _release(self, peer_name: str, proxy: Proxy) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(peer_name, [])
+
+            # O URI pode ter sido invalidado enquanto o proxy estava em uso
+            if (
+                str(self._uris.get(peer_name)) == str(proxy._pyroUri)
+                and len(idle) < PeerDirectory.pool_size
+            ):
+                idle.append(proxy)
+                return
+
+        PeerDirectory._close(proxy)
+
+    @staticmethod
+    def _close(proxy: Proxy) -> None:
+        try:
+            proxy._pyroClaimOwnership()
+            proxy._pyroRelease()
+        except Exception as e:
+            pass
+
+    def call(self, peer_name: str, method: str, *args, timeout: float | None = None):
+        proxy = self._acquire(peer_name)
+
+        try:
+            proxy._pyroTimeout = timeout
+            result = getattr(proxy, method)(*args)
+        except (CommunicationError, NamingError):
+            PeerDirectory._close(proxy)
+            self.invalidate(peer_name)
+            raise
+        except Exception:
+            self._release(peer_name, proxy)
+            raise
+
+        self._release(peer_name, proxy)
+        return result
+
+    def invalidate(self, peer_name: str) -> None:
+        # Descarta o URI e as conexoes livres do peer
+        with self._lock:
+            self._uris.pop(peer_name, None)
+            idle = self._idle.pop(peer_name, [])
+
+        for proxy in idle:
+            PeerDirectory._close(proxy)
+
+    def refresh(self) -> None:
+        # Uma consulta ao servidor de nomes (list) a cada refresh_s, em vez de um lookup
+        # por peer a cada operacao
+        now = datetime.now().timestamp()
+        if now - self._last_refresh < PeerDirectory.refresh_s:
+            return
+
+        self._last_refresh = now
+
+        try:
+            registered = self._name_server_call("list")
+        except Exception as e:
+            return
+
+        with self._lock:
+            cached = list(self._uris.items())
+
+        for peer_name, uri in cached:
+            if registered.get(peer_name) != str(uri):
+                self.invalidate(peer_name)
+
+
+directory = PeerDirectory()
+
+
+class PhiAccrualDetector(object):
+    # Detector de falhas phi accrual (Hayashibara et al.): em vez de um timeout fixo,
+    # guarda os intervalos entre as noticias de cada peer e calcula phi, o quao
+    # improvavel e ainda nao ter chegado noticia nova (phi = -log10 dessa
+    # probabilidade, com os intervalos aproximados por uma normal). O peer e suspeito
+    # quando phi passa de `threshold`, entao o tempo de deteccao acompanha o ritmo real
+    # das mensagens de cada peer.
+
+    # Suspeita a partir de phi = 8 (probabilidade de 1e-8 de ser um falso positivo)
+    threshold: float = 8.0
+    # Intervalos guardados por peer
+    window: int = 100
+    # Desvio padrao minimo, para que intervalos muito regulares nao deixem o detector
+    # sensivel demais
+    min_std_s: float = 0.2
+    # Atraso tolerado alem da media (pausas de GC, rede)
+    acceptable_pause_s: float = 1.0
+    # Estimativa do intervalo antes da primeira medida
+    first_interval_s: float = 2.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._intervals: dict[str, deque[float]] = {}
+        self._last: dict[str, float] = {}
+
+    def heartbeat(self, peer_name: str, now: float, sample: bool = True) -> None:
+        # sample=False so marca o peer como vivo agora (contato direto fora do
+        # ritmo da fofoca), sem entrar na estatistica dos intervalos
+        with self._lock:
+            last = self._last.get(peer_name)
+            self._last[peer_name] = now
+
+            if sample and last is not None:
+                intervals = self._intervals.get(peer_name)
+                if intervals is None:
+                    intervals = self._intervals[peer_name] = deque(
+                        maxlen=PhiAccrualDetector.window
+                    )
+
+                intervals.append(now - last)
+
+    def phi(self, peer_name: str, now: float) -> float:
+        with self._lock:
+            last = self._last.get(peer_name)
+            if last is None:
+                return 0.0
+
+            intervals = self._intervals.get(peer_name)
+            if intervals:
+                mean = sum(intervals) / len(intervals)
+                variance = sum((i - mean) ** 2 for i in intervals) / len(intervals)
+                std = max(math.sqrt(variance), PhiAccrualDetector.min_std_s)
+            else:
+                mean = PhiAccrualDetector.first_interval_s
+                std = max(mean / 4, PhiAccrualDetector.min_std_s)
+
+        # phi = -log10(1 - F(t)), com a aproximacao logistica da normal usada pelo Akka,
+        # escrita como log10(1 + e^z) para nao estourar com z grande
+        y = (now - last - mean - PhiAccrualDetector.acceptable_pause_s) / std
+        z = y * (1.5976 + 0.070566 * y * y)
+
+        if z > 0:
+            return (z + math.log1p(math.exp(-z))) / math.log(10)
+
+        return math.log1p(math.exp(z)) / math.log(10)
+
+    def remove(self, peer_name: str) -> None:
+        with self._lock:
+            self._last.pop(peer_name, None)
+            self._intervals.pop(peer_name, None)
+
+
+detector = PhiAccrualDetector()
+
+
+def grid_quorum(members: list[str], peer_name: str) -> set[str]:
+    # Quorum em grade: os membros (ordenados) preenchem uma grade de ceil(sqrt(N))
+    # colunas, e o quorum de um peer e a sua linha mais a sua coluna (~2*sqrt(N)
+    # peers). Dois quoruns sempre se cruzam, mesmo com a ultima linha incompleta: se um
+    # dos peers esta numa linha completa, ela cruza a coluna do outro.
+    columns = math.ceil(math.sqrt(len(members)))
+    row, column = divmod(members.index(peer_name), columns)
+
+    return set(members[row * columns : (row + 1) * columns]) | set(
+        members[column::columns]
+    )
+
+
+class MaekawaMutex(object):
+    # Exclusao mutua de Maekawa: para entrar na SC basta o voto de todos os peers do
+    # quorum (grid_quorum), e cada peer vota em um pedido por vez. Os pedidos sao
+    # ordenados por (timestamp, nome); o impasse e evitado com inquire/relinquish
+    # (Sanders): quem votou e recebe um pedido de prioridade maior pergunta (inquire) ao
+    # dono do voto se ele pode devolve-lo, e o dono devolve (relinquish) se ja sabe que
+    # nao vai entrar agora (recebeu failed de algum votante).
+    #
+    # O algoritmo supoe canais FIFO. As chamadas oneway do Pyro podem ser executadas
+    # fora de ordem no destino, entao cada destino tem uma fila de saida com uma unica
+    # thread, que envia uma mensagem por vez e espera o destino processa-la. As
+    # mensagens para o proprio peer passam pela mesma fila, sem o Pyro.
+    #
+    # Todos os peers precisam usar o mesmo modo, e os quoruns so se cruzam se os peers
+    # concordarem sobre os membros: durante uma entrada ou saida de peer eles podem
+    # divergir por alguns instantes.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outboxes: dict[str, ThreadPoolExecutor] = {}
+
+        # Votante: pedido que recebeu o voto, pedidos em espera (heap) e se o dono do
+        # voto ja foi consultado (inquire)
+        self.voted_for: tuple[float, str] | None = None
+        self.waiting: list[tuple[float, str]] = []
+        self.inquired: bool = False
+
+        # Requisitante
+        self.request: tuple[float, str] | None = None
+        self.quorum: set[str] = set()
+        self.asked: set[str] = set()
+        self.granted: set[str] = set()
+        self.failed: bool = False
+        self.deferred_inquiries: set[str] = set()
+
+    # Mensagens
+
+    def _send(self, messages: list[tuple]) -> None:
+        # messages: (destino, mensagem, *argumentos); enviadas fora do lock
+        for peer_name, *message in messages:
+            with self._lock:
+                outbox = self._outboxes.get(peer_name)
+                if outbox is None:
+                    outbox = self._outboxes[peer_name] = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix=f"maekawa-{peer_name}"
+                    )
+
+            outbox.submit(self._deliver, peer_name, *message)
+
+    def _deliver(self, peer_name: str, message: str, *args) -> None:
+        if peer_name == Peer.name:
+            self.receive(Peer.name, message, *args)
+            return
+
+        try:
+            directory.call(
+                peer_name, "maekawa", Peer.name, message, *args,
+                timeout=Peer.request_timeout_s,
+            )
+        except Exception as e:
+            if peer_name in Peer.peer_dict:
+                print_with_time(f"{peer_name} has expired.")
+                Peer.forget_peer(peer_name)
+
+    def receive(self, peer_name: str, message: str, *args) -> None:
+        handler = getattr(self, f"_on_{message}", None)
+        if handler is None:
+            return
+
+        with self._lock:
+            messages = handler(peer_name, *args)
+
+        self._send(messages)
+
+    # Requisitante
+
+    def enter(self) -> None:
+        with self._lock:
+            members = sorted(set(Peer.peer_dict) | {Peer.name})
+
+            self.request = (Peer.request_timestamp, Peer.name)
+            self.quorum = grid_quorum(members, Peer.name)
+            self.asked = set(self.quorum)
+            self.granted = set()
+            self.failed = False
+            self.deferred_inquiries = set()
+            self._update_counts()
+
+            messages = [
+                (peer_name, "request", Peer.request_timestamp)
+                for peer_name in sorted(self.asked)
+            ]
+
+        self._send(messages)
+
+    def exit(self) -> None:
+        with self._lock:
+            messages = [(peer_name, "release") for peer_name in sorted(self.asked)]
+
+            self.request = None
+            self.quorum = set()
+            self.asked = set()
+            self.granted = set()
+            self.deferred_inquiries = set()
+
+        self._send(messages)
+
+    def _update_counts(self) -> None:
+        Peer.reply_count = len(self.granted & self.quorum)
+        Peer.maximum_count = len(self.quorum)
+
+    def _check_held(self) -> None:
+        if Peer.state == "WANTED" and self.quorum <= self.granted:
+            Peer.hold()
+
+    def _on_grant(self, peer_name: str) -> list:
+        if self.request is None:
+            return []
+
+        self.granted.add(peer_name)
+        self._update_counts()
+        self._check_held()
+        return []
+
+    def _on_failed(self, peer_name: str) -> list:
+        if self.request is None:
+            return []
+
+        # Nao vai entrar agora: devolve os votos que foram consultados
+        self.failed = True
+        messages = [(k, "relinquish") for k in sorted(self.deferred_inquiries)]
+
+        self.granted -= self.deferred_inquiries
+        self.deferred_inquiries = set()
+        self._update_counts()
+        return messages
+
+    def _on_inquire(self, peer_name: str) -> list:
+        if (
+            self.request is None
+            or Peer.state == "HELD"
+            or peer_name not in self.granted
+        ):
+            return []
+
+        if not self.failed:
+            # Responde quando souber se vai entrar ou nao
+            self.deferred_inquiries.add(peer_name)
+            return []
+
+        self.granted.discard(peer_name)
+        self._update_counts()
+        return [(peer_name, "relinquish")]
+
+    # Votante
+
+    def _grant_next(self) -> list:
+        self.inquired = False
+        self.voted_for = heapq.heappop(self.waiting) if self.waiting else None
+
+        return [(self.voted_for[1], "grant")] if self.voted_for is not None else []
+
+    def _on_request(self, peer_name: str, timestamp: float) -> list:
+        request = (timestamp, peer_name)
+
+        # Um pedido repetido do mesmo peer substitui o anterior
+        self.waiting = [r for r in self.waiting if r[1] != peer_name]
+        heapq.heapify(self.waiting)
+
+        if self.voted_for is None or self.voted_for[1] == peer_name:
+            self.voted_for = request
+            self.inquired = False
+            return [(peer_name, "grant")]
+
+        previous_head = self.waiting[0] if self.waiting else None
+        heapq.heappush(self.waiting, request)
+
+        if request > self.voted_for or self.waiting[0] != request:
+            return [(peer_name, "failed")]
+
+        # Maior prioridade que o voto atual: consulta o dono do voto (uma vez) e avisa
+        # o pedido que deixou de ser o primeiro da fila
+        messages = []
+        if previous_head is not None:
+            messages.append((previous_head[1], "failed"))
+        if not self.inquired:
+            self.inquired = True
+            messages.append((self.voted_for[1], "inquire"))
+
+        return messages
+
+    def _on_relinquish(self, peer_name: str) -> list:
+        if self.voted_for is None or self.voted_for[1] != peer_name:
+            return []
+
+        heapq.heappush(self.waiting, self.voted_for)
+        return self._grant_next()
+
+    def _on_release(self, peer_name: str) -> list:
+        self.waiting = [r for r in self.waiting if r[1] != peer_name]
+        heapq.heapify(self.waiting)
+
+        if self.voted_for is None or self.voted_for[1] != peer_name:
+            return []
+
+        return self._grant_next()
+
+    # Falhas
+
+    def peer_failed(self, peer_name: str) -> None:
+        # Chamado depois que o peer saiu de peer_dict: o voto dele volta a ficar livre
+        # e, se ele estava no quorum do pedido atual, o quorum e recalculado sem ele
+        with self._lock:
+            messages = self._on_release(peer_name)
+
+            self.asked.discard(peer_name)
+            self.granted.discard(peer_name)
+            self.deferred_inquiries.discard(peer_name)
+
+            if self.request is not None and peer_name in self.quorum:
+                members = sorted(set(Peer.peer_dict) | {Peer.name})
+                self.quorum = grid_quorum(members, Peer.name)
+
+                new_members = self.quorum - self.asked
+                self.asked |= new_members
+                messages += [
+                    (k, "request", self.request[0]) for k in sorted(new_members)
+                ]
+
+                self._update_counts()
+                self._check_held()
+
+            outbox = self._outboxes.pop(peer_name, None)
+
+        # As mensagens ainda na fila do peer morto sao descartadas
+        if outbox is not None:
+            outbox.shutdown(wait=False, cancel_futures=True)
+
+        self._send(messages)
+
+
+maekawa = MaekawaMutex()
+
+# Envia os pedidos de entrada na SC para todos os peers em paralelo. O timeout da
+# rodada so vale se todos os pedidos saem juntos: com menos threads que peers, os
+# ultimos pedidos esperariam na fila e expirariam com o peer vivo. Por isso o pool
+# cresce junto com o grupo (get_request_executor)
+request_workers = 32
+request_executor = ThreadPoolExecutor(
+    max_workers=request_workers, thread_name_prefix="request"
+)
+
+
+def get_request_executor(peer_count: int) -> ThreadPoolExecutor:
+    # Chamado so por Peer.enter_section, que nao roda duas rodadas ao mesmo tempo
+    global request_executor, request_workers
+
+    if peer_count > request_workers:
+        previous = request_executor
+        request_workers = max(peer_count, 2 * request_workers)
+        request_executor = ThreadPoolExecutor(
+            max_workers=request_workers, thread_name_prefix="request"
+        )
+        previous.shutdown(wait=False)
+
+    return request_executor
+
+
 class Peer(object):
     name: str
-    # Tempo para heartbeat
-    heartbeat_s: int = 2
-    # Timeout para considerar um peer perdido - caso queira ruido no timeout
-    timeout_s: int = 10 * heartbeat_s # + random.uniform(0.0, 10.0)
+    # Algoritmo de exclusao mutua, escolhido na inicializacao (python peer.py
+    # [ricart|maekawa]): "ricart" (Ricart-Agrawala) pede a todos os peers, "maekawa"
+    # (MaekawaMutex) so ao quorum, O(sqrt(N)) mensagens por entrada
+    algorithm: str = "ricart"
+    # Periodo da fofoca (gossip): a cada rodada o peer incrementa o seu contador de
+    # heartbeat e envia a tabela de contadores conhecidos para gossip_fanout peers
+    # sorteados. Cada peer envia gossip_fanout mensagens por rodada, independente do
+    # tamanho do grupo, e um contador novo chega a todos em O(log N) rodadas.
+    heartbeat_s: int = 1
+    gossip_fanout: int = 2
     # Timeout para monopolizacao do SC
     monopoly_timeout_s: int = 10
     
@@ -34,70 +541,211 @@ class Peer(object):
     request_timestamp: float = -1
     reply_count: int = -1
     maximum_count: int = -1
+    # Votantes da rodada atual (ricart) e os que ja votaram. Cada votante conta uma
+    # vez, e o voto atrasado de um peer que expirou na rodada nao conta mais
+    voters: set[str] = set()
+    replied: set[str] = set()
 
     timeout_job = None
     state: str = "RELEASED"
+    # Protege state, reply_count, maximum_count, voters, replied, timeout_job e
+    # queued_request_list: os votos chegam pela thread que pede a SC (respostas de
+    # request) e pelas threads do Pyro (release)
+    vote_lock = threading.RLock()
 
     # Guarda as requisições pendentes, que serão respondidas no momento em que o SC for liberado
-    queued_request_list: set[str] = set()
+    # (nome do peer -> timestamp do pedido, devolvido no release)
+    queued_request_list: dict[str, float] = {}
 
     # Guarda todos os pares ativos, e seus respectivos tempos do último heartbeat/interação
     peer_dict: dict[str, float] = {}
 
+    # Maior contador de heartbeat conhecido de cada peer (inclusive deste). O contador
+    # comeca no horario de inicio em ms, entao um peer reiniciado (ou um nome
+    # reutilizado) sempre tem contadores maiores que os da execucao anterior.
+    heartbeat_counter: int = int(datetime.now().timestamp() * 1000)
+    gossip_table: dict[str, int] = {}
+    # Quando cada contador da tabela aumentou pela ultima vez
+    gossip_updated: dict[str, float] = {}
+    # Lapides dos peers dados como mortos: nome -> (maior contador conhecido, quando).
+    # Tabelas antigas que ainda circulam com um contador ate esse valor nao trazem o
+    # peer de volta; so um contador maior (ele voltou a fofocar) ou um contato direto
+    tombstones: dict[str, tuple[int, float]] = {}
+    # Entradas da tabela sem novidade e lapides mais antigas que o horizonte sao
+    # descartadas. Deve ser bem maior que o tempo para uma noticia chegar a todos
+    gossip_horizon_s: int = 60
+    gossip_lock = threading.Lock()
+
+    def gossip_snapshot() -> dict[str, int]:
+        with Peer.gossip_lock:
+            Peer.gossip_table[Peer.name] = Peer.heartbeat_counter
+            return dict(Peer.gossip_table)
+
+    def merge_gossip(t_peer_name: str, table: dict[str, int] | None) -> None:
+        # Junta a tabela recebida (pela fofoca ou junto de request/release) com a
+        # local. Cada contador maior que o conhecido e uma noticia nova do peer; a
+        # propria mensagem mostra que o remetente esta vivo.
+        now = datetime.now().timestamp()
+
+        with Peer.gossip_lock:
+            if t_peer_name != Peer.name:
+                Peer.tombstones.pop(t_peer_name, None)
+
+            for peer_name, counter in (table or {}).items():
+                known = Peer.gossip_table.get(peer_name, -1)
+                if peer_name == Peer.name or counter <= known:
+                    continue
+
+                tombstone = Peer.tombstones.get(peer_name)
+                if tombstone is not None:
+                    if counter <= tombstone[0]:
+                        continue
+
+                    del Peer.tombstones[peer_name]
+
+                Peer.gossip_table[peer_name] = counter
+                Peer.gossip_updated[peer_name] = now
+                Peer.peer_dict[peer_name] = now
+                detector.heartbeat(peer_name, now)
+
+        if t_peer_name != Peer.name:
+            Peer.peer_dict[t_peer_name] = now
+            detector.heartbeat(t_peer_name, now, sample=False)
+
+    def prune_gossip(now: float) -> None:
+        horizon = now - Peer.gossip_horizon_s
+
+        with Peer.gossip_lock:
+            for peer_name, updated in list(Peer.gossip_updated.items()):
+                if updated < horizon:
+                    del Peer.gossip_updated[peer_name]
+                    Peer.gossip_table.pop(peer_name, None)
+
+            for peer_name, (_, buried) in list(Peer.tombstones.items()):
+                if buried < horizon:
+                    del Peer.tombstones[peer_name]
+
     @Pyro5.api.expose
     @Pyro5.api.oneway
-    def heartbeat(self, t_peer_name):
-        Peer.peer_dict[t_peer_name] = datetime.now().timestamp()
+    def gossip(self, t_peer_name: str, table: dict[str, int]):
+        Peer.merge_gossip(t_peer_name, table)
 
     def reply_all_requests():
-        for peer_name in Peer.queued_request_list:
-            name_server = locate_ns()
-            t_uri = name_server.lookup(peer_name)
+        # Os pedidos que chegarem durante o envio ficam para a proxima liberacao
+        with Peer.vote_lock:
+            queued, Peer.queued_request_list = Peer.queued_request_list, {}
 
+        for peer_name, timestamp in queued.items():
             try:
-                t_peer = Proxy(t_uri)
-                t_peer.release()
+                directory.call(
+                    peer_name, "release", Peer.name, Peer.gossip_snapshot(),
+                    timestamp, timeout=Peer.request_timeout_s,
+                )
             except Exception as e:
                 continue
-        Peer.queued_request_list.clear()
+
+    def count_vote(peer_name: str, timestamp: float) -> None:
+        # So conta o voto de um votante da rodada do pedido `timestamp`
+        with Peer.vote_lock:
+            if (
+                Peer.state != "WANTED"
+                or Peer.request_timestamp != timestamp
+                or peer_name not in Peer.voters
+            ):
+                return None
+
+            Peer.replied.add(peer_name)
+            Peer.reply_count = len(Peer.replied)
+
+            if Peer.replied >= Peer.voters:
+                Peer.hold()
 
     def enter_section():
-        if Peer.state != "RELEASED":
-            return None
+        with Peer.vote_lock:
+            if Peer.state != "RELEASED":
+                return None
 
-        Peer.state = "WANTED"
-        print_with_time(f"State: {Peer.state}")
+            Peer.state = "WANTED"
+            print_with_time(f"State: {Peer.state}")
 
-        peer_name_list = list(Peer.peer_dict.keys())
+            Peer.request_timestamp = datetime.now().timestamp()
 
-        Peer.maximum_count = len(peer_name_list)
-        Peer.reply_count = 0
-        Peer.request_timestamp = datetime.now().timestamp()
+            peer_name_list = list(Peer.peer_dict.keys())
 
-        removed_keys: list[str] = []
-        for peer_name in peer_name_list:
-            name_server = locate_ns()
-            t_uri = name_server.lookup(peer_name)
-            
-            try:
-                t_peer = Proxy(t_uri)
-                t_peer._pyroTimeout = Peer.request_timeout_s
-                
-                t_timestamp = datetime.now().timestamp()
-                answer: bool = t_peer.request(Peer.name, t_timestamp)
+            if Peer.algorithm != "maekawa":
+                Peer.voters = set(peer_name_list)
+                Peer.replied = set()
+                Peer.maximum_count = len(Peer.voters)
+                Peer.reply_count = 0
+
+            timestamp = Peer.request_timestamp
+
+        if Peer.algorithm == "maekawa":
+            maekawa.enter()
+            return None
+
+        table = Peer.gossip_snapshot()
+        executor = get_request_executor(len(peer_name_list))
+        futures = {
+            executor.submit(
+                directory.call, peer_name, "request", Peer.name,
+                timestamp, table, timeout=Peer.request_timeout_s,
+            ): peer_name
+            for peer_name in peer_name_list
+        }
+
+        # Os votos sao contados conforme chegam, e o timeout vale para a rodada inteira:
+        # a entrada leva o maior tempo de resposta, e nao a soma deles
+        expired_keys: list[str] = []
+        try:
+            for future in as_completed(futures, timeout=Peer.request_timeout_s):
+                try:
+                    answer: bool = future.result()
+                except Exception as e:
+                    expired_keys.append(futures[future])
+                    continue
+
+                # A resposta tambem e noticia de que o peer esta vivo
+                detector.heartbeat(
+                    futures[future], datetime.now().timestamp(), sample=False
+                )
 
                 if answer:
-                    Peer.reply_count += 1
-            except Exception as e:
-                print_with_time(f"{peer_name} has expired.")
-                
-                removed_keys.append(peer_name)
-                Peer.maximum_count -= 1
+                    Peer.count_vote(futures[future], timestamp)
+        except FuturesTimeoutError:
+            expired_keys += [
+                peer_name for future, peer_name in futures.items() if not future.done()
+            ]
+
+        removed_keys: list[str] = []
+        for peer_name in expired_keys:
+            print_with_time(f"{peer_name} has expired.")
+
+            removed_keys.append(peer_name)
 
         for removed_key in removed_keys:
-            Peer.peer_dict.pop(removed_key)
+            Peer.forget_peer(removed_key)
+
+        with Peer.vote_lock:
+            # A rodada pode ter sido refeita (ex.: um peer morreu durante ela)
+            if Peer.request_timestamp != timestamp:
+                return None
+
+            Peer.voters.difference_update(removed_keys)
+            Peer.replied &= Peer.voters
+            Peer.maximum_count = len(Peer.voters)
+            Peer.reply_count = len(Peer.replied)
+
+            if Peer.replied >= Peer.voters:
+                Peer.hold()
+
+    def hold():
+        # Um release que chega durante a rodada e a propria rodada podem ver todos os
+        # votos; so o primeiro entra na SC
+        with Peer.vote_lock:
+            if Peer.state != "WANTED":
+                return None
 
-        if Peer.reply_count == Peer.maximum_count:
             Peer.state = "HELD"
             print_with_time(f"State: {Peer.state}")
 
@@ -105,39 +753,79 @@ class Peer(object):
                 Peer.exit_section, trigger="interval", seconds=Peer.monopoly_timeout_s
             )
 
+    def forget_peer(peer_name: str):
+        # A entrada sai da tabela (e das proximas fofocas) e vira lapide
+        with Peer.gossip_lock:
+            counter = Peer.gossip_table.pop(peer_name, -1)
+            Peer.gossip_updated.pop(peer_name, None)
+            Peer.tombstones[peer_name] = (counter, datetime.now().timestamp())
+
+        Peer.peer_dict.pop(peer_name, None)
+        directory.invalidate(peer_name)
+        detector.remove(peer_name)
+
+        if Peer.algorithm == "maekawa":
+            maekawa.peer_failed(peer_name)
+
     def exit_section():
-        if Peer.state != "HELD":
-            return None
+        with Peer.vote_lock:
+            if Peer.state != "HELD":
+                return None
 
-        Peer.state = "RELEASED"
-        print_with_time(f"State: {Peer.state}")
+            Peer.state = "RELEASED"
+            print_with_time(f"State: {Peer.state}")
+
+            timeout_job, Peer.timeout_job = Peer.timeout_job, None
+
+        if Peer.algorithm == "maekawa":
+            maekawa.exit()
+        else:
+            Peer.reply_all_requests()
 
-        Peer.reply_all_requests()
-        Peer.timeout_job.remove()
-        Peer.timeout_job = None
+        timeout_job.remove()
 
     @Pyro5.api.expose
-    def request(self, peer_name: str, timestamp: float):
-        if Peer.state == "HELD" or (
-            Peer.state == "WANTED" and Peer.request_timestamp < timestamp
-        ):
-            Peer.queued_request_list.add(peer_name)
-            return False
+    def request(
+        self, peer_name: str, timestamp: float, table: dict[str, int] | None = None
+    ):
+        Peer.merge_gossip(peer_name, table)
+
+        # Com o lock, o pedido ou entra na fila antes de reply_all_requests pega-la,
+        # ou ve o estado ja liberado
+        with Peer.vote_lock:
+            if Peer.state == "HELD" or (
+                Peer.state == "WANTED" and Peer.request_timestamp < timestamp
+            ):
+                Peer.queued_request_list[peer_name] = timestamp
+                return False
 
         return True
 
     @Pyro5.api.expose
     @Pyro5.api.oneway
-    def release(self):
-        Peer.reply_count += 1
+    def release(
+        self,
+        t_peer_name: str | None = None,
+        table: dict[str, int] | None = None,
+        timestamp: float | None = None,
+    ):
+        if t_peer_name is None:
+            return None
 
-        if Peer.reply_count == Peer.maximum_count:
-            Peer.state = "HELD"
-            print_with_time(f"State: {Peer.state}")
+        Peer.merge_gossip(t_peer_name, table)
 
-            Peer.timeout_job = scheduler.add_job(
-                Peer.exit_section, trigger="interval", seconds=Peer.monopoly_timeout_s
-            )
+        # O release de um pedido de uma rodada anterior nao e voto nesta
+        if timestamp is None:
+            timestamp = Peer.request_timestamp
+
+        Peer.count_vote(t_peer_name, timestamp)
+
+    @Pyro5.api.expose
+    def maekawa(self, t_peer_name: str, message: str, *args):
+        # Mensagens do modo maekawa (MaekawaMutex): request, grant, failed, inquire,
+        # relinquish e release
+        Peer.merge_gossip(t_peer_name, None)
+        maekawa.receive(t_peer_name, message, *args)
 
 
 def _init_peer():
@@ -153,6 +841,7 @@ def _init_peer():
     # Populate all possible active peers
     for key in list(existing_peer_list.keys()):
         Peer.peer_dict[key] = datetime.now().timestamp()
+        detector.heartbeat(key, Peer.peer_dict[key], sample=False)
 
     # Initialize peer name
     while True:
@@ -182,12 +871,27 @@ def _peer_heartbeat_worker():
     while True:
         sleep(Peer.heartbeat_s)
 
+        # Fofoca: a tabela de contadores vai para alguns peers sorteados
+        with Peer.gossip_lock:
+            Peer.heartbeat_counter += 1
+
+        table = Peer.gossip_snapshot()
+        peer_name_list = list(Peer.peer_dict.keys())
+
+        fanout = min(Peer.gossip_fanout, len(peer_name_list))
+        for key in random.sample(peer_name_list, fanout):
+            try:
+                directory.call(
+                    key, "gossip", Peer.name, table, timeout=Peer.request_timeout_s
+                )
+            except Exception as e:
+                continue
+
         removed_keys: list[str] = []
         enter_section = False
-        for key, value in Peer.peer_dict.items():
-            now = datetime.now().timestamp()
-
-            if now - value > Peer.timeout_s:
+        now = datetime.now().timestamp()
+        for key in peer_name_list:
+            if detector.phi(key, now) > PhiAccrualDetector.threshold:
                 print_with_time(f"{key} has died.")
                 removed_keys.append(key)
 
@@ -195,25 +899,28 @@ def _peer_heartbeat_worker():
                     enter_section = True
 
         for removed_key in removed_keys:
-            Peer.peer_dict.pop(removed_key)
+            Peer.forget_peer(removed_key)
+
+        Peer.prune_gossip(now)
+
+        # No modo maekawa o quorum do pedido e recalculado em forget_peer
+        if Peer.algorithm == "maekawa":
+            enter_section = False
+        elif enter_section:
+            with Peer.vote_lock:
+                # A rodada pode ter terminado (HELD) desde a verificacao
+                enter_section = Peer.state == "WANTED"
+                if enter_section:
+                    Peer.state = "RELEASED"
 
         if enter_section:
-            Peer.state = "RELEASED"
             # Caso alguem morra, responder todos em sua lista antes de entrar na secao critica novamente
             print_with_time(f"State: {Peer.state}")
 
             Peer.reply_all_requests()
             Peer.enter_section()
 
-        for key in list(Peer.peer_dict.keys()):
-            name_server = locate_ns()
-            t_uri = name_server.lookup(key)
-
-            try:
-                t_peer = Proxy(t_uri)
-                t_peer.heartbeat(Peer.name)
-            except Exception as e:
-                continue
+        directory.refresh()
 
 
 def _init_menu(threads: list[PyThreadKiller]):
@@ -258,6 +965,13 @@ def _init_menu(threads: list[PyThreadKiller]):
 
 
 def main():
+    Peer.algorithm = sys.argv[1] if len(sys.argv) > 1 else "ricart"
+    if Peer.algorithm not in ("ricart", "maekawa"):
+        print(f"Algoritmo desconhecido: {Peer.algorithm} (use ricart ou maekawa)")
+        return
+
+    print_with_time(f"Algorithm: {Peer.algorithm}")
+
     scheduler.start()
     daemon, name_server, peer_name = _init_peer()
 